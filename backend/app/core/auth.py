@@ -1,6 +1,318 @@
-from fastapi import HTTPException, status
-from fastapi.security import HTTPAuthorizationCredentials
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
 
-def verify_token(credentials: HTTPAuthorizationCredentials):
-    # Simplified auth for demo - always return valid
-    return {"user_id": "demo_user", "role": "admin"}
\ No newline at end of file
+from fastapi import Depends, HTTPException, Query, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwk, jwt
+from passlib.context import CryptContext
+
+from ..models.models import User
+from .database import SessionLocal
+from .metrics import Gauge, record_cache
+from .pubsub import OVERFLOW, pubsub
+
+SECRET_KEY = os.getenv("SECRET_KEY", "nordia_secret_key_2025_change_in_production")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+INVALIDATION_TOPIC = "auth"
+# Clave Redis por jti revocado, con TTL hasta el vencimiento del token
+REVOKED_PREFIX = "nordia:revoked:"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class KeyRing:
+    """
+    Claves de firma ya construidas (jose re-parsea la clave en cada decode si
+    se le pasa el string). `SECRET_KEY_PREVIOUS` permite rotar sin invalidar
+    los tokens emitidos con la clave anterior.
+    """
+
+    def __init__(self, secret: str, algorithm: str, previous: Optional[str] = None):
+        self.algorithm = algorithm
+        self.current_kid = self._kid(secret)
+        self._keys = {self.current_kid: jwk.construct(secret, algorithm)}
+        self._secret = secret
+        for old in filter(None, (previous or "").split(",")):
+            self._keys[self._kid(old)] = jwk.construct(old, algorithm)
+
+    @staticmethod
+    def _kid(secret: str) -> str:
+        return uuid.uuid5(uuid.NAMESPACE_OID, secret).hex[:8]
+
+    def sign(self, claims: Dict) -> str:
+        return jwt.encode(claims, self._secret, algorithm=self.algorithm, headers={"kid": self.current_kid})
+
+    def decode(self, token: str) -> Dict:
+        kid = jwt.get_unverified_header(token).get("kid", self.current_kid)
+        key = self._keys.get(kid)
+        if key is None:
+            raise JWTError("Clave de firma desconocida")
+        return jwt.decode(token, key, algorithms=[self.algorithm])
+
+
+class TokenCache:
+    """
+    LRU con TTL corto de token -> claims ya verificados (firma + usuario en la
+    base). Un hit evita la verificación criptográfica y la query. También
+    guarda los jti revocados por logout hasta que el token expira.
+    """
+
+    def __init__(self, ttl: float = 60.0, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # Sube con cada invalidación: un miss que leyó la base antes no se cachea
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[Dict]:
+        entry = self._entries.get(token)
+        if entry is None:
+            return None
+        expires_at, claims = entry
+        if expires_at < time.time():
+            self._discard(token)
+            return None
+        try:
+            self._entries.move_to_end(token)
+        except KeyError:
+            pass
+        return claims
+
+    def put(self, token: str, claims: Dict, generation: int):
+        # Nunca más allá del vencimiento del propio token
+        expires_at = min(time.time() + self.ttl, claims["exp"])
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[token] = (expires_at, claims)
+            self._entries.move_to_end(token)
+            self._by_user.setdefault(claims["user_id"], set()).add(token)
+            while len(self._entries) > self.maxsize:
+                oldest, (_, old_claims) = self._entries.popitem(last=False)
+                self._forget(oldest, old_claims["user_id"])
+
+    def _discard(self, token: str):
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            if entry is not None:
+                self._forget(token, entry[1]["user_id"])
+
+    def _forget(self, token: str, user_id: str):
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user_id]
+
+    def invalidate_all(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_user.clear()
+
+    def invalidate_user(self, user_id: str):
+        """Descarta los claims cacheados de un usuario (ej: cambio de rol)"""
+        with self._lock:
+            self.generation += 1
+            for token in self._by_user.pop(user_id, ()):
+                self._entries.pop(token, None)
+
+    def revoke(self, jti: str, exp: float):
+        with self._lock:
+            self.generation += 1
+            self._revoked[jti] = exp
+            for token, (_, claims) in list(self._entries.items()):
+                if claims["jti"] == jti:
+                    self._entries.pop(token)
+                    self._forget(token, claims["user_id"])
+            # Los jti vencidos ya no hace falta recordarlos
+            now = time.time()
+            for old in [j for j, e in self._revoked.items() if e < now]:
+                del self._revoked[old]
+
+    def is_revoked(self, jti: str) -> bool:
+        return jti in self._revoked
+
+
+key_ring = KeyRing(SECRET_KEY, ALGORITHM, os.getenv("SECRET_KEY_PREVIOUS"))
+token_cache = TokenCache(ttl=float(os.getenv("AUTH_CACHE_TTL", "60")))
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+
+def create_access_token(user: User, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
+    now = datetime.utcnow()
+    return key_ring.sign({
+        "sub": user.id,
+        "store_id": user.store_id,
+        "role": user.role,
+        "jti": uuid.uuid4().hex,
+        "iat": now,
+        "exp": now + timedelta(minutes=expires_minutes),
+    })
+
+
+def _verify_uncached(token: str) -> Optional[Dict]:
+    """Firma + usuario activo en la base; el rol se toma de la base, no del token"""
+    generation = token_cache.generation
+    try:
+        payload = key_ring.decode(token)
+    except JWTError:
+        return None
+    jti, exp = payload.get("jti"), payload.get("exp")
+    # Sin jti no se puede revocar, y sin exp no vence: esos tokens no se aceptan
+    if not jti or exp is None or token_cache.is_revoked(jti):
+        return None
+
+    db = SessionLocal()
+    try:
+        user = db.query(User.id, User.store_id, User.role, User.permissions, User.is_active) \
+            .filter(User.id == payload.get("sub")).first()
+    finally:
+        db.close()
+    if user is None or not user.is_active:
+        return None
+
+    claims = {
+        "user_id": user.id,
+        "store_id": user.store_id,
+        "role": user.role,
+        "permissions": user.permissions or [],
+        "jti": jti,
+        "exp": exp,
+    }
+    token_cache.put(token, claims, generation)
+    return claims
+
+
+async def verify_token(token: str) -> Optional[Dict]:
+    """
+    Devuelve los claims del usuario o None si el token no es válido. Con cache
+    hit no hay firma ni query; en un miss la verificación corre fuera del loop.
+    """
+    claims = token_cache.get(token)
+    record_cache("auth_token", claims is not None)
+    if claims is not None:
+        return claims
+    return await asyncio.to_thread(_verify_uncached, token)
+
+
+security = HTTPBearer(auto_error=False)
+
+
+async def _authenticate(token: Optional[str]) -> Dict:
+    user = await verify_token(token) if token else None
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Dict:
+    return await _authenticate(credentials.credentials if credentials else None)
+
+
+async def get_stream_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
+                          access_token: Optional[str] = Query(None)) -> Dict:
+    """Igual que get_current_user, pero EventSource no puede mandar headers: acepta `?access_token=`"""
+    return await _authenticate(credentials.credentials if credentials else access_token)
+
+
+async def revoke_token(claims: Dict):
+    """
+    Logout: revoca el token en este worker y en el resto. Con Redis la
+    revocación también queda guardada hasta que el token vence, así sobrevive
+    reinicios y avisos de pubsub perdidos.
+    """
+    token_cache.revoke(claims["jti"], claims["exp"])
+    pubsub.publish(INVALIDATION_TOPIC, "invalidate", {"jti": claims["jti"], "exp": claims["exp"]})
+    client = pubsub.client
+    ttl = int(claims["exp"] - time.time()) + 1
+    if client is None or ttl <= 0:
+        return
+    try:
+        await client.set(f"{REVOKED_PREFIX}{claims['jti']}", claims["exp"], ex=ttl)
+    except Exception as e:
+        print(f"No se pudo guardar la revocación en Redis: {e}")
+
+
+async def load_revocations() -> int:
+    """Carga en el cache los tokens revocados guardados en Redis que todavía no vencieron"""
+    client = pubsub.client
+    if client is None:
+        return 0
+    keys = [key async for key in client.scan_iter(match=f"{REVOKED_PREFIX}*", count=500)]
+    if not keys:
+        return 0
+    loaded = 0
+    for key, exp in zip(keys, await client.mget(keys)):
+        if exp is not None:
+            key = key.decode() if isinstance(key, bytes) else key
+            token_cache.revoke(key[len(REVOKED_PREFIX):], float(exp))
+            loaded += 1
+    return loaded
+
+
+def invalidate_user(user_id: str):
+    """Cambio de rol o baja: los próximos requests del usuario vuelven a leerlo de la base"""
+    token_cache.invalidate_user(user_id)
+    pubsub.publish(INVALIDATION_TOPIC, "invalidate", {"user_id": user_id})
+
+
+async def _load_revocations_safely():
+    try:
+        await load_revocations()
+    except Exception as e:
+        print(f"No se pudieron cargar las revocaciones desde Redis: {e}")
+
+
+async def listen_invalidations():
+    """Aplica las revocaciones e invalidaciones publicadas por otros workers"""
+    sub, _, _ = pubsub.subscribe(INVALIDATION_TOPIC, "invalidate", maxsize=1000)
+    try:
+        # Después de suscribirse: una revocación hecha entretanto llega por alguno de los dos lados
+        await _load_revocations_safely()
+        while True:
+            message = await sub.get(timeout=60)
+            if message is None:
+                continue
+            if message is OVERFLOW:
+                # Se perdieron avisos: se vacía el cache para forzar relectura de usuarios
+                # y se recuperan de Redis las revocaciones que pudieron perderse
+                token_cache.invalidate_all()
+                sub, _, _ = pubsub.subscribe(INVALIDATION_TOPIC, "invalidate", maxsize=1000)
+                await _load_revocations_safely()
+                continue
+            data = message[1]
+            if "jti" in data:
+                token_cache.revoke(data["jti"], data["exp"])
+            elif "user_id" in data:
+                token_cache.invalidate_user(data["user_id"])
+    finally:
+        pubsub.unsubscribe(sub)
+
+
+Gauge("nordia_auth_token_cache_entries", "Tokens verificados en cache", callback=lambda: len(token_cache))
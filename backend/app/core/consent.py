@@ -0,0 +1,188 @@
+import asyncio
+import threading
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..models.models import DataConsent
+from .database import SessionLocal
+from .metrics import Gauge, record_cache
+from .pubsub import OVERFLOW, pubsub
+
+# Un bit por consentimiento; el orden define la posición en el bitmap
+CONSENT_FLAGS = (
+    "sales_volume",
+    "time_patterns",
+    "product_categories",
+    "price_ranges",
+    "customer_segments",
+    "delivery_patterns",
+)
+FLAG_BITS = {flag: np.uint8(1 << i) for i, flag in enumerate(CONSENT_FLAGS)}
+
+INVALIDATION_TOPIC = "consent"
+
+
+def pack_flags(flags: Dict[str, bool]) -> int:
+    return sum(int(FLAG_BITS[flag]) for flag in CONSENT_FLAGS if flags.get(flag))
+
+
+def unpack_flags(bits: int) -> Dict[str, bool]:
+    return {flag: bool(bits & FLAG_BITS[flag]) for flag in CONSENT_FLAGS}
+
+
+class ConsentCache:
+    """
+    Bitmap en memoria con los consentimientos de todos los comercios: un uint8
+    por tienda y un dict store_id -> fila. Anonimizar un lote resuelve los
+    consentimientos con un solo fancy-index de NumPy, sin ir a la base.
+
+    Un comercio sin fila de consentimiento no comparte nada. Los cambios se
+    aplican localmente y se avisan a los demás workers por pubsub.
+    """
+
+    def __init__(self):
+        # (índice store_id -> fila, bitmap) se reemplaza entero, nunca por partes: un
+        # lector toma la tupla una vez y el índice siempre corresponde a su bitmap.
+        # La última posición del bitmap queda en 0: los store_id desconocidos indexan -1
+        self._state: Tuple[Dict[str, int], np.ndarray] = ({}, np.zeros(1, dtype=np.uint8))
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def size(self) -> int:
+        return len(self._state[0])
+
+    def load(self):
+        """Carga el bitmap completo desde la base"""
+        db = SessionLocal()
+        try:
+            rows = db.query(DataConsent.store_id, *(getattr(DataConsent, f) for f in CONSENT_FLAGS)).all()
+        finally:
+            db.close()
+
+        index = {row[0]: i for i, row in enumerate(rows)}
+        bits = np.zeros(len(rows) + 1, dtype=np.uint8)
+        for i, row in enumerate(rows):
+            bits[i] = pack_flags(dict(zip(CONSENT_FLAGS, row[1:])))
+        with self._lock:
+            self._state, self._loaded = (index, bits), True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def refresh(self, store_ids: Iterable[str]):
+        """Relee de la base los consentimientos de algunas tiendas"""
+        store_ids = list(store_ids)
+        db = SessionLocal()
+        try:
+            rows = db.query(DataConsent.store_id, *(getattr(DataConsent, f) for f in CONSENT_FLAGS)) \
+                .filter(DataConsent.store_id.in_(store_ids)).all()
+        finally:
+            db.close()
+        found = {row[0]: dict(zip(CONSENT_FLAGS, row[1:])) for row in rows}
+        for store_id in store_ids:
+            self.set(store_id, found.get(store_id))
+
+    def set(self, store_id: str, flags: Optional[Dict[str, bool]]):
+        """Actualiza una tienda en el bitmap; `None` la quita (sin consentimiento)"""
+        self._ensure_loaded()
+        with self._lock:
+            index, bits = self._state
+            row = index.get(store_id)
+            if flags is None:
+                if row is not None:
+                    bits[row] = 0
+                return
+            if row is None:
+                # Se agrega antes del centinela con copias nuevas de índice y bitmap;
+                # O(n) pero solo al dar de alta un comercio
+                row = len(bits) - 1
+                index = {**index, store_id: row}
+                bits = np.append(bits, np.uint8(0))
+                bits[row] = pack_flags(flags)
+                self._state = (index, bits)
+                return
+            # Cambiar un byte en el lugar es atómico para los lectores
+            bits[row] = pack_flags(flags)
+
+    def flags(self, store_id: str) -> Dict[str, bool]:
+        self._ensure_loaded()
+        index, bits = self._state
+        row = index.get(store_id)
+        record_cache("consent", row is not None)
+        return unpack_flags(int(bits[row]) if row is not None else 0)
+
+    def bits_for(self, store_ids: Sequence[str]) -> np.ndarray:
+        """Bitmap de consentimientos alineado con `store_ids`"""
+        self._ensure_loaded()
+        index, bits = self._state
+        rows = np.fromiter((index.get(s, -1) for s in store_ids), dtype=np.int64, count=len(store_ids))
+        known = int(np.count_nonzero(rows >= 0))
+        record_cache("consent", True, known)
+        record_cache("consent", False, len(store_ids) - known)
+        return bits[rows]
+
+    def invalidate(self, store_id: str, flags: Optional[Dict[str, bool]]):
+        """Aplica el cambio en este worker y avisa al resto para que relean la tienda"""
+        self.set(store_id, flags)
+        pubsub.publish(INVALIDATION_TOPIC, "invalidate", {"store_id": store_id})
+
+    async def start(self):
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception as e:
+            print(f"No se pudo cargar el cache de consentimientos: {e}")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        sub, _, _ = pubsub.subscribe(INVALIDATION_TOPIC, "invalidate", maxsize=1000)
+        try:
+            while True:
+                message = await sub.get(timeout=60)
+                if message is None:
+                    continue
+                try:
+                    if message is OVERFLOW:
+                        # Se perdieron avisos: se recarga todo y se vuelve a suscribir
+                        await asyncio.to_thread(self.load)
+                        sub, _, _ = pubsub.subscribe(INVALIDATION_TOPIC, "invalidate", maxsize=1000)
+                        continue
+                    await asyncio.to_thread(self.refresh, [message[1]["store_id"]])
+                except Exception as e:
+                    print(f"Error actualizando cache de consentimientos: {e}")
+        finally:
+            pubsub.unsubscribe(sub)
+
+
+def mask_columns(columns: Dict[str, np.ndarray], consent_bits: np.ndarray,
+                 field_flags: Dict[str, str], masked_values: Dict[str, object]) -> Dict[str, np.ndarray]:
+    """
+    Enmascara en un solo paso vectorizado las columnas cuyo consentimiento no
+    fue dado: `field_flags` mapea columna -> flag que la habilita.
+    """
+    masked = dict(columns)
+    for column, flag in field_flags.items():
+        if column not in columns:
+            continue
+        allowed = (consent_bits & FLAG_BITS[flag]).astype(bool)
+        if not allowed.all():
+            values = np.asarray(columns[column], dtype=object)
+            masked[column] = np.where(allowed, values, masked_values.get(column))
+    return masked
+
+
+consent_cache = ConsentCache()
+
+Gauge("nordia_consent_cache_stores", "Comercios con consentimiento en el cache", callback=lambda: consent_cache.size)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from .metrics import Gauge
+
+OK, DEGRADED, UNHEALTHY = "healthy", "degraded", "unhealthy"
+
+
+class HealthMonitor:
+    """
+    Corre los probes en background cada `interval` segundos y guarda un snapshot.
+    Los endpoints de salud solo leen ese snapshot, así un balanceador puede
+    consultarlos seguido sin sumar carga a la base.
+    """
+
+    def __init__(self, interval: float = 10.0, timeout: float = 3.0):
+        self.interval = interval
+        self.timeout = timeout
+        self.snapshot: Dict = {"status": "starting", "checks": {}, "checked_at": None}
+        self._probes: Dict[str, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_probe(self, name: str, probe: Callable[[], Awaitable[Dict]], critical: bool = True):
+        """
+        Registra un probe. Devuelve un dict con al menos `ok`; si falla un probe
+        crítico el worker queda unhealthy (no ready), si no solo degraded.
+        """
+        self._probes[name] = (probe, critical)
+
+    async def start(self):
+        await self.run_once()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def is_ready(self) -> bool:
+        checked_at = self.snapshot["checked_at"]
+        # Un snapshot viejo significa que el loop de probes está trabado
+        fresh = checked_at is not None and time.time() - checked_at < self.interval * 3
+        return fresh and self.snapshot["status"] != UNHEALTHY
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Health monitor error: {e}")
+
+    async def run_once(self):
+        names = list(self._probes)
+        results = await asyncio.gather(*(self._run_probe(name) for name in names))
+        checks = dict(zip(names, results))
+
+        status = OK
+        for name, result in checks.items():
+            if not result["ok"]:
+                if self._probes[name][1]:
+                    status = UNHEALTHY
+                    break
+                status = DEGRADED
+
+        # Se reemplaza el snapshot entero: los lectores nunca ven uno a medio armar
+        self.snapshot = {"status": status, "checks": checks, "checked_at": time.time()}
+
+    async def _run_probe(self, name: str) -> Dict:
+        probe, _ = self._probes[name]
+        try:
+            return await asyncio.wait_for(probe(), self.timeout)
+        except asyncio.TimeoutError:
+            return {"ok": False, "error": f"timeout después de {self.timeout}s"}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+
+def database_probe(engine, saturation_limit: float = 0.9) -> Callable[[], Awaitable[Dict]]:
+    """SELECT 1 con latencia, más la ocupación del pool de conexiones"""
+
+    # Executor propio de un solo hilo: wait_for no puede cortar un thread, así un
+    # ping colgado ocupa solo este hilo y no se acumulan en el executor por defecto
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="health-db")
+    running: Optional[Future] = None
+
+    def ping() -> float:
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return (time.perf_counter() - started) * 1000
+
+    async def probe() -> Dict:
+        nonlocal running
+        if running is not None and not running.done():
+            # El ping anterior sigue colgado (ya venció su timeout): no se encola otro
+            return {"ok": False, "error": "el ping anterior a la base sigue en curso"}
+        running = executor.submit(ping)
+        latency_ms = await asyncio.wrap_future(running)
+        result = {"ok": True, "latency_ms": round(latency_ms, 2)}
+        pool = engine.pool
+        if hasattr(pool, "checkedout") and hasattr(pool, "size"):
+            capacity = pool.size() + max(0, getattr(pool, "_max_overflow", 0))
+            saturation = pool.checkedout() / capacity if capacity else 0.0
+            result.update(pool_checked_out=pool.checkedout(), pool_capacity=capacity,
+                          pool_saturation=round(saturation, 2))
+            result["ok"] = saturation < saturation_limit
+        return result
+
+    return probe
+
+
+def neural_engine_probe(neural_engine, max_stage_age: float) -> Callable[[], Awaitable[Dict]]:
+    """El motor corre y cada etapa terminó bien hace menos de `max_stage_age` segundos"""
+    started_at = time.time()
+
+    async def probe() -> Dict:
+        now = time.time()
+        ages = {stage: round(now - ts, 1) for stage, ts in neural_engine.stage_last_success.items()}
+        # Durante el primer ciclo todavía no hay éxitos registrados
+        stale = now - started_at > max_stage_age and (
+            not ages or any(age > max_stage_age for age in ages.values())
+        )
+        return {
+            "ok": neural_engine.is_healthy() and not stale,
+            "running": neural_engine.is_running,
+            "last_success_age_seconds": ages,
+        }
+
+    return probe
+
+
+def pubsub_probe(pubsub, max_queue_depth: int = 50) -> Callable[[], Awaitable[Dict]]:
+    """Lag de entrega a las cajas: la cola de suscriptor más llena"""
+
+    async def probe() -> Dict:
+        depth = pubsub.max_queue_depth()
+        return {"ok": depth < max_queue_depth, "subscribers": pubsub.subscriber_count, "max_queue_depth": depth}
+
+    return probe
+
+
+def redis_probe(pubsub) -> Callable[[], Awaitable[Dict]]:
+    async def probe() -> Dict:
+        latency_ms = await pubsub.ping()
+        if latency_ms is None:
+            return {"ok": True, "enabled": False}
+        return {"ok": True, "enabled": True, "latency_ms": round(latency_ms, 2)}
+
+    return probe
+
+
+def config_probe(*env_vars: str) -> Callable[[], Awaitable[Dict]]:
+    """Para integraciones externas: solo verifica que estén configuradas"""
+
+    async def probe() -> Dict:
+        missing = [var for var in env_vars if not os.getenv(var)]
+        return {"ok": not missing, "configured": not missing, "missing": missing}
+
+    return probe
+
+
+def circuit_probe(breaker, *env_vars: str) -> Callable[[], Awaitable[Dict]]:
+    """Integración externa configurada y con su circuit breaker cerrado"""
+    config = config_probe(*env_vars)
+
+    async def probe() -> Dict:
+        result = await config()
+        result["circuit"] = breaker.state
+        result["ok"] = result["ok"] and breaker.state != "open"
+        return result
+
+    return probe
+
+
+health_monitor = HealthMonitor(interval=float(os.getenv("HEALTH_CHECK_INTERVAL", "10")))
+
+Gauge(
+    "nordia_health_check_up", "Resultado del último probe de salud (1 ok, 0 falla)", ("check",),
+    callback=lambda: {(name,): int(result["ok"]) for name, result in health_monitor.snapshot["checks"].items()}
+)
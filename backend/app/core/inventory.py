@@ -0,0 +1,441 @@
+import asyncio
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, event, func, insert, select, text, update
+from sqlalchemy.orm import Session
+
+from ..models.models import InventoryMovement, NetworkEvent, Product
+from .database import SessionLocal
+from .metrics import Counter, Gauge, Histogram
+from .pubsub import pubsub
+from .sync import sync_journal
+
+STOCK_UPDATE_LATENCY = Histogram(
+    "nordia_inventory_update_duration_seconds", "Transacción de descuento de stock (una venta o un lote)"
+)
+INVENTORY_EVENTS = Counter("nordia_inventory_events_total", "Eventos de red disparados por stock", ("event_type",))
+STOCK_BATCH_SIZE = Histogram(
+    "nordia_inventory_batch_sales", "Ventas aplicadas por transacción del escritor de stock",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 200)
+)
+
+# Una venta es "alta demanda" si en la ventana se vendió más que esto...
+HIGH_DEMAND_WINDOW = timedelta(hours=1)
+HIGH_DEMAND_MIN_UNITS = int(os.getenv("HIGH_DEMAND_MIN_UNITS", "20"))
+# ...y además supera este múltiplo de la velocidad habitual (sales_velocity es unidades/día)
+HIGH_DEMAND_FACTOR = float(os.getenv("HIGH_DEMAND_FACTOR", "3"))
+
+_PRODUCT_COLUMNS = [column.name for column in Product.__table__.columns]
+
+
+@dataclass(slots=True)
+class StockChange:
+    product_id: str
+    name: str
+    quantity: int
+    stock_before: int
+    stock_after: int
+    min_stock: int
+    sales_velocity: float
+    shortfall: int = 0  # Unidades vendidas que no había en stock
+
+    @property
+    def ran_out(self) -> bool:
+        return self.stock_before > 0 >= self.stock_after
+
+
+def _update_statement(size: int, dialect: str) -> str:
+    """
+    UPDATE ... FROM (VALUES ...) para todos los productos de la venta en una
+    sola sentencia. En Postgres las filas se bloquean antes, ordenadas por id:
+    dos cajas con los mismos productos en distinto orden no pueden trabarse
+    entre sí (deadlock). SQLite ya serializa las escrituras.
+    Solo se actualizan los productos con stock suficiente: el stock nunca
+    queda negativo.
+    """
+    values = ", ".join(f"(:id{i}, :qty{i})" for i in range(size))
+    returning = ", ".join(f"products.{name}" for name in _PRODUCT_COLUMNS)
+    update = "UPDATE products SET stock = products.stock + v.qty, updated_at = :now"
+    where = "products.id = v.id AND products.store_id = :store_id AND products.stock + v.qty >= 0"
+    if dialect == "postgresql":
+        ids = ", ".join(f":id{i}" for i in range(size))
+        return (
+            f"WITH locked AS MATERIALIZED (SELECT id FROM products WHERE store_id = :store_id "
+            f"AND id IN ({ids}) ORDER BY id FOR UPDATE) "
+            f"{update} FROM (VALUES {values}) AS v(id, qty), locked "
+            f"WHERE {where} AND locked.id = v.id RETURNING {returning}"
+        )
+    # SQLite no acepta alias de columnas en VALUES; además pysqlite solo abre
+    # transacción si la sentencia empieza con UPDATE (no con WITH)
+    return (
+        f"{update} FROM (SELECT column1 AS id, column2 AS qty FROM (VALUES {values})) AS v "
+        f"WHERE {where} RETURNING {returning}"
+    )
+
+
+def _recent_units_sold(db: Session, store_id: str, product_ids: List[str], since: datetime) -> Dict[str, int]:
+    rows = db.execute(
+        select(
+            InventoryMovement.product_id,
+            (func.sum(InventoryMovement.shortfall) - func.sum(InventoryMovement.quantity)).label("units")
+        )
+        .where(
+            InventoryMovement.store_id == store_id,
+            InventoryMovement.reason == "sale",
+            InventoryMovement.product_id.in_(product_ids),
+            InventoryMovement.created_at >= since,
+        )
+        .group_by(InventoryMovement.product_id)
+    )
+    return {product_id: int(units or 0) for product_id, units in rows}
+
+
+def _store_product_ids(db: Session, store_id: str, product_ids: List[str]) -> List[str]:
+    return sorted(db.execute(
+        select(Product.id).where(Product.store_id == store_id, Product.id.in_(product_ids))
+    ).scalars())
+
+
+def _short_rows(db: Session, store_id: str, product_ids: List[str]) -> List[Dict]:
+    """
+    Productos con salidas mayores al stock. Se leen después del UPDATE
+    principal, con la escritura ya tomada (y en Postgres las filas ya
+    bloqueadas), así el stock leído es el vigente.
+    """
+    table = Product.__table__
+    return db.execute(
+        select(table).where(table.c.store_id == store_id, table.c.id.in_(product_ids))
+    ).mappings().all()
+
+
+def apply_movements(db: Session, store_id: str, quantities: Dict[str, int], reason: str,
+                    sale_id: Optional[str] = None) -> List[StockChange]:
+    """Aplica los deltas de stock de un solo movimiento; ver `apply_batch_movements`"""
+    return apply_batch_movements(db, store_id, [(sale_id, quantities)], reason)[0]
+
+
+def apply_batch_movements(db: Session, store_id: str, movements: List[Tuple[Optional[str], Dict[str, int]]],
+                          reason: str) -> List[List[StockChange]]:
+    """
+    Aplica los deltas de stock (negativo = salida) de varios movimientos de un
+    comercio: se suman por producto y van en un solo UPDATE, un solo asiento
+    multi-fila en el libro y un solo registro en el journal de sync. Dispara
+    `stock_out` / `high_demand` cuando se cruza el umbral. No hace commit: la
+    transacción es del llamador. Devuelve los cambios de cada movimiento, en
+    el orden recibido.
+    Los productos que no existen en la tienda se ignoran; una salida mayor al
+    stock lo deja en 0 y el faltante queda asentado en el libro.
+    """
+    result: List[List[StockChange]] = [[] for _ in movements]
+    totals: Dict[str, int] = {}
+    for _, quantities in movements:
+        for product_id, qty in quantities.items():
+            if qty:
+                totals[product_id] = totals.get(product_id, 0) + int(qty)
+    if not totals:
+        return result
+    # Lectura previa sin lock: si ningún producto es de la tienda (ej: ítems
+    # cargados a mano en la caja) no se abre una transacción de escritura
+    product_ids = _store_product_ids(db, store_id, list(totals))
+    if not product_ids:
+        return result
+
+    now = datetime.utcnow()
+    params = {"store_id": store_id, "now": now}
+    for i, product_id in enumerate(product_ids):
+        params[f"id{i}"] = product_id
+        params[f"qty{i}"] = totals[product_id]
+    rows = db.execute(text(_update_statement(len(product_ids), db.get_bind().dialect.name)), params).mappings().all()
+
+    products = {row["id"]: row for row in rows}
+    stock = {row["id"]: row["stock"] - totals[row["id"]] for row in rows}
+    short = [product_id for product_id in product_ids if product_id not in products and totals[product_id] < 0]
+    for row in _short_rows(db, store_id, short) if short else ():
+        products[row["id"]] = row
+        stock[row["id"]] = row["stock"]
+    before = dict(stock)
+
+    # Se repasan los movimientos en orden: cada uno ve el stock que dejó el anterior.
+    # Solo los productos que no alcanzaron se recortan en 0
+    clamped = set(short)
+    for index, (_, quantities) in enumerate(movements):
+        for product_id, qty in quantities.items():
+            row = products.get(product_id)
+            if row is None or not qty:
+                continue
+            current = stock[product_id]
+            applied = -max(current, 0) if product_id in clamped and current + qty < 0 else int(qty)
+            stock[product_id] = current + applied
+            result[index].append(StockChange(
+                product_id=product_id,
+                name=row["name"],
+                quantity=applied,
+                stock_before=current,
+                stock_after=current + applied,
+                min_stock=row["min_stock"] or 0,
+                sales_velocity=row["sales_velocity"] or 0.0,
+                shortfall=applied - int(qty),
+            ))
+    changed = [product_id for product_id in sorted(clamped) if product_id in products and stock[product_id] != before[product_id]]
+    if changed:
+        table = Product.__table__
+        db.execute(
+            update(table).where(table.c.id == bindparam("product_id")).values(stock=bindparam("stock"), updated_at=now),
+            [{"product_id": product_id, "stock": stock[product_id]} for product_id in changed]
+        )
+    if not products:
+        return result
+
+    # Se lee con las filas de producto ya bloqueadas: otra caja vendiendo lo
+    # mismo espera y después ve estos movimientos, así el umbral se cruza una sola vez
+    units: Dict[str, int] = {}
+    for changes in result:
+        for change in changes:
+            if change.quantity < 0 or change.shortfall:
+                units[change.product_id] = units.get(change.product_id, 0) + change.shortfall - change.quantity
+    recent = _recent_units_sold(db, store_id, list(units), now - HIGH_DEMAND_WINDOW) if units else {}
+
+    events = []
+    window_hours = HIGH_DEMAND_WINDOW.total_seconds() / 3600
+    for product_id, sold in units.items():
+        row = products[product_id]
+        if before[product_id] > 0 >= stock[product_id]:
+            events.append(("stock_out", product_id, {"product_name": row["name"], "stock": stock[product_id]}))
+        threshold = max(HIGH_DEMAND_MIN_UNITS, HIGH_DEMAND_FACTOR * (row["sales_velocity"] or 0.0) / 24 * window_hours)
+        previous = recent.get(product_id, 0)
+        if previous < threshold <= previous + sold:
+            events.append(("high_demand", product_id, {
+                "product_name": row["name"],
+                "units_last_hour": previous + sold,
+                "threshold": threshold,
+                "stock": stock[product_id],
+            }))
+
+    db.execute(insert(InventoryMovement.__table__), [
+        {
+            "id": str(uuid.uuid4()),
+            "store_id": store_id,
+            "product_id": change.product_id,
+            "sale_id": sale_id,
+            "quantity": change.quantity,
+            "stock_after": change.stock_after,
+            "shortfall": change.shortfall,
+            "reason": reason,
+            "created_at": now,
+        }
+        for (sale_id, _), changes in zip(movements, result)
+        for change in changes
+    ])
+    if events:
+        db.execute(insert(NetworkEvent.__table__), [
+            {
+                "id": str(uuid.uuid4()),
+                "event_type": event_type,
+                "source_store_id": store_id,
+                "product_id": product_id,
+                "data": data,
+                "created_at": now,
+                "processed": False,
+            }
+            for event_type, product_id, data in events
+        ])
+        for event_type, _, _ in events:
+            INVENTORY_EVENTS.inc(event_type)
+
+    # El UPDATE de Core no pasa por los eventos del ORM: se registra en el
+    # journal de sync dentro de la misma transacción
+    sync_journal.record(db, store_id, "product", sorted(products))
+    return result
+
+
+def _lock_products(db: Session, product_ids: List[str]):
+    """
+    En Postgres bloquea todos los productos de un lote de una vez, ordenados
+    por id: cada venta del lote después vuelve a pedir locks que ya tiene, y
+    dos workers con lotes que se cruzan no pueden trabarse entre sí.
+    """
+    if product_ids and db.get_bind().dialect.name == "postgresql":
+        db.execute(select(Product.id).where(Product.id.in_(product_ids)).order_by(Product.id).with_for_update())
+
+
+def sale_quantities(items: Iterable[Tuple[str, int]]) -> Dict[str, int]:
+    """Agrupa los ítems de una venta por producto como deltas negativos"""
+    quantities: Dict[str, int] = {}
+    for product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) - quantity
+    return quantities
+
+
+def apply_sale(store_id: str, sale_id: str, items: Iterable[Tuple[str, int]],
+               session_factory=SessionLocal) -> List[StockChange]:
+    """Descuenta el stock de una venta en su propia transacción"""
+    started = time.perf_counter()
+    db = session_factory()
+    try:
+        changes = apply_movements(db, store_id, sale_quantities(items), "sale", sale_id=sale_id)
+        db.commit()
+        return changes
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+        STOCK_UPDATE_LATENCY.observe(time.perf_counter() - started)
+
+
+def stock_alerts(changes: Iterable[StockChange]) -> List[Dict]:
+    """Alertas para la caja: producto agotado o que cruzó su stock mínimo"""
+    alerts = []
+    for change in changes:
+        if change.ran_out:
+            alerts.append({"message": f"Sin stock: {change.name}", "priority": "high"})
+        elif change.stock_before > change.min_stock >= change.stock_after:
+            alerts.append({
+                "message": f"{change.name} quedó en {change.stock_after} unidades (mínimo {change.min_stock})",
+                "priority": "medium"
+            })
+    return alerts
+
+
+class StockWriter:
+    """
+    La venta solo encola su descuento de stock y responde: saltar a un thread
+    por venta cuesta más que la venta misma. Un worker toma todo lo encolado,
+    descarta con una sola lectura las ventas sin productos de la tienda y
+    aplica el resto en una única transacción. Las alertas de stock llegan a
+    la caja por el stream de insights.
+    """
+
+    def __init__(self, batch_size: int = 200, max_queue: int = 10000, session_factory=SessionLocal):
+        self.batch_size = batch_size
+        self.session_factory = session_factory
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, store_id: str, sale_id: str, items: List[Tuple[str, int]]) -> bool:
+        """Encola el descuento de una venta; False si la cola está llena"""
+        try:
+            self.queue.put_nowait((store_id, sale_id, items))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def start(self):
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Lo que quedó en la cola se aplica entero antes de cerrar, de a un lote por vez
+        while not self.queue.empty():
+            batch = self._drain()
+            try:
+                await self.process(batch)
+            except Exception as e:
+                print(f"Error descontando stock al cerrar, se pierden {len(batch)} ventas: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def flush(self):
+        """Espera a que todo lo encolado hasta ahora esté aplicado (lote en curso incluido)"""
+        await self.queue.join()
+
+    def _drain(self) -> List[Tuple[str, str, List[Tuple[str, int]]]]:
+        batch = []
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()] + self._drain()
+            try:
+                await self.process(batch)
+            except Exception as e:
+                print(f"Error descontando stock: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def process(self, entries: List[Tuple[str, str, List[Tuple[str, int]]]]) -> int:
+        """Aplica un lote de (store_id, sale_id, ítems); devuelve cuántas ventas movieron stock"""
+        results = await asyncio.to_thread(self._apply_batch, entries)
+        for store_id, sale_id, changes in results:
+            alerts = stock_alerts(changes)
+            if alerts:
+                pubsub.publish("insights", store_id, {
+                    "id": str(uuid.uuid4()),
+                    "store_id": store_id,
+                    "type": "stock_alert",
+                    "title": "Alerta de stock",
+                    "message": "; ".join(alert["message"] for alert in alerts),
+                    "priority": "high" if any(a["priority"] == "high" for a in alerts) else "medium",
+                    "data": {"sale_id": sale_id, "alerts": alerts},
+                    "created_at": datetime.utcnow().isoformat(),
+                })
+        return sum(1 for _, _, changes in results if changes)
+
+    def _apply_batch(self, entries) -> List[Tuple[str, str, List[StockChange]]]:
+        started = time.perf_counter()
+        product_ids = {product_id for _, _, items in entries for product_id, _ in items}
+        db = self.session_factory()
+        try:
+            known = set(db.execute(
+                select(Product.id, Product.store_id).where(Product.id.in_(product_ids))
+            ).tuples()) if product_ids else set()
+            # Ítems cargados a mano en la caja: ni siquiera se abre la transacción
+            pending = [
+                (store_id, sale_id, items) for store_id, sale_id, items in entries
+                if any((product_id, store_id) in known for product_id, _ in items)
+            ]
+            if not pending:
+                return []
+            try:
+                _lock_products(db, sorted(product_id for product_id, _ in known))
+                # Las ventas de un mismo comercio se aplican juntas, sumadas por producto
+                by_store: Dict[str, List[Tuple[str, List[Tuple[str, int]]]]] = {}
+                for store_id, sale_id, items in pending:
+                    by_store.setdefault(store_id, []).append((sale_id, items))
+                results = []
+                for store_id, sales in by_store.items():
+                    changes = apply_batch_movements(
+                        db, store_id, [(sale_id, sale_quantities(items)) for sale_id, items in sales], "sale"
+                    )
+                    results.extend((store_id, sale_id, sale_changes) for (sale_id, _), sale_changes in zip(sales, changes))
+                db.commit()
+                STOCK_BATCH_SIZE.observe(len(pending))
+                STOCK_UPDATE_LATENCY.observe(time.perf_counter() - started)
+                return results
+            except Exception as e:
+                db.rollback()
+                print(f"Error descontando stock del lote, se aplica de a una venta: {e}")
+        finally:
+            db.close()
+
+        # Una venta que falla no arrastra al resto del lote
+        results = []
+        for store_id, sale_id, items in pending:
+            try:
+                results.append((store_id, sale_id, apply_sale(store_id, sale_id, items, self.session_factory)))
+            except Exception as e:
+                print(f"Error descontando stock de la venta {sale_id}: {e}")
+        return results
+
+
+@event.listens_for(InventoryMovement, "before_update")
+@event.listens_for(InventoryMovement, "before_delete")
+def _append_only(mapper, connection, target):
+    raise ValueError("El libro de movimientos de stock es append-only: registrar un ajuste en su lugar")
+
+
+stock_writer = StockWriter()
+Gauge("nordia_inventory_queue_depth", "Ventas esperando el descuento de stock",
+      callback=lambda: stock_writer.queue.qsize())
@@ -0,0 +1,269 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as _Tally, deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    """Registro de métricas expuestas en formato texto de Prometheus"""
+
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def render(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> Iterator[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Gauge(_Metric):
+    """Gauge con valor fijado a mano o calculado al momento del scrape (callback)"""
+    type = "gauge"
+
+    def __init__(self, *args, callback: Optional[Callable] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def render(self) -> Iterator[str]:
+        values = self._values
+        if self._callback is not None:
+            result = self._callback()
+            values = result if isinstance(result, dict) else {(): result}
+        for labels, value in list(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [conteo por bucket (+Inf al final), suma, cantidad]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> Iterator[str]:
+        for labels, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{le}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}"
+
+
+# Métricas compartidas por varios módulos
+HTTP_LATENCY = Histogram(
+    "nordia_http_request_duration_seconds", "Latencia de requests HTTP por ruta",
+    ("method", "route", "status")
+)
+SLOW_REQUESTS = Counter("nordia_http_slow_requests_total", "Requests más lentos que SLOW_REQUEST_MS", ("route",))
+CACHE_REQUESTS = Counter(
+    "nordia_cache_requests_total", "Consultas a caches internos (hit/miss); ratio = hit / total",
+    ("cache", "result")
+)
+
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss", amount=count)
+
+
+def instrument_engine(engine):
+    """Cuenta y cronometra las queries de un engine de SQLAlchemy por tipo de statement"""
+    from sqlalchemy import event
+
+    queries = Counter("nordia_db_queries_total", "Queries ejecutadas contra la base", ("operation",))
+    errors = Counter("nordia_db_query_errors_total", "Queries que terminaron con error", ("operation",))
+    latency = Histogram("nordia_db_query_duration_seconds", "Duración de queries", ("operation",))
+
+    def _operation(statement: Optional[str]) -> str:
+        return statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else "OTHER"
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = _operation(statement)
+        queries.inc(operation)
+        latency.observe(elapsed, operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # Una query que falla no llega a after_cursor_execute: se saca su inicio
+        # del stack para que no crezca ni desfase las mediciones siguientes
+        conn = context.connection
+        stack = conn.info.get("query_start") if conn is not None else None
+        if stack:
+            stack.pop()
+        errors.inc(_operation(context.statement))
+
+
+class StackSampler:
+    """
+    Profiler por muestreo opcional: toma los stacks de todos los threads `hz`
+    veces por segundo y guarda los últimos segundos en un ring buffer. Cuando
+    un request es lento se resumen las muestras de su ventana de tiempo (incluye
+    lo que corrió en paralelo en el mismo proceso).
+    """
+
+    IDLE_LEAVES = {"select", "poll", "wait", "acquire", "_wait_for_tstate_lock", "_worker"}
+
+    def __init__(self, hz: int = 100, window_seconds: int = 30):
+        self.interval = 1 / hz
+        self._samples: deque = deque(maxlen=hz * window_seconds)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == me or frame.f_code.co_name in self.IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < 40:
+                    stack.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                self._samples.append((now, tuple(stack)))
+
+    def top_stacks(self, start: float, end: float, limit: int = 5) -> List[Tuple[str, int]]:
+        tally = _Tally(stack for ts, stack in list(self._samples) if start <= ts <= end)
+        return [
+            (" <- ".join(f"{code.co_name} ({os.path.basename(code.co_filename)}:{line})" for code, line in stack[:8]), count)
+            for stack, count in tally.most_common(limit)
+        ]
+
+
+_profile_hz = int(os.getenv("PROFILE_SAMPLE_HZ", "0"))
+profiler: Optional[StackSampler] = StackSampler(_profile_hz) if _profile_hz > 0 else None
+
+
+class MetricsMiddleware:
+    """
+    Mide la latencia de cada request por plantilla de ruta (no por URL, para
+    acotar la cardinalidad) y reporta los requests lentos, con los stacks más
+    frecuentes de su ventana si el profiler por muestreo está activo.
+    """
+
+    def __init__(self, app: ASGIApp, slow_request_ms: float = float(os.getenv("SLOW_REQUEST_MS", "1000"))):
+        self.app = app
+        self.slow_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            HTTP_LATENCY.observe(elapsed, scope["method"], path, status)
+            if elapsed >= self.slow_seconds and not path.endswith("/stream"):
+                self._report_slow(scope["method"], path, elapsed, started)
+
+    def _report_slow(self, method: str, path: str, elapsed: float, started: float):
+        SLOW_REQUESTS.inc(path)
+        print(f"Slow request: {method} {path} {elapsed * 1000:.0f} ms")
+        if profiler is not None:
+            for stack, count in profiler.top_stacks(started, started + elapsed):
+                print(f"  {count:4d} muestras  {stack}")
@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+import redis.asyncio as aioredis
+
+from .metrics import Counter, Gauge
+
+# Marca que recibe un suscriptor cortado por no consumir a tiempo
+OVERFLOW = object()
+
+DROPPED_SUBSCRIBERS = Counter(
+    "nordia_pubsub_dropped_subscribers_total", "Suscriptores cortados por backpressure", ("topic",)
+)
+
+
+def _parse_id(message_id: str) -> Tuple[int, int]:
+    """Los ids tienen el formato de Redis Streams: '<ms>-<seq>'"""
+    ms, _, seq = message_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class Subscription:
+    """Suscripción de un cliente a un canal (topic + key) con cola acotada"""
+
+    __slots__ = ("topic", "key", "queue", "replayed")
+
+    def __init__(self, topic: str, key: str, maxsize: int):
+        self.topic = topic
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        # Último id ya entregado por el replay: lo anterior que llegue en vivo se descarta
+        self.replayed: Optional[Tuple[int, int]] = None
+
+    async def get(self, timeout: float):
+        """Próximo mensaje (id, data), OVERFLOW, o None si venció el timeout"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class PubSub:
+    """
+    Pub/sub en proceso para empujar eventos a las cajas (ej: insights por comercio).
+
+    Con REDIS_URL los mensajes pasan por un Redis Stream por topic, así todos los
+    workers los reciben con el mismo id y el resume por Last-Event-ID funciona
+    contra cualquiera de ellos. Sin Redis la entrega es local al proceso.
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, topics: Tuple[str, ...] = ("insights",),
+                 history: int = 200, stream_maxlen: int = 10000):
+        self.redis_url = redis_url
+        self.topics = topics
+        self.history = history
+        self.stream_maxlen = stream_maxlen
+        self._subs: Dict[Tuple[str, str], Set[Subscription]] = {}
+        self._recent: Dict[Tuple[str, str], deque] = {}
+        # Id más nuevo que salió del historial por canal: hasta ahí no se puede re-enviar
+        self._evicted: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+        self._pending: Set[asyncio.Future] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._last_ms = 0
+        self._seq = 0
+        # El historial en memoria solo cubre desde que arrancó este proceso
+        self._started = (int(time.time() * 1000), 0)
+
+    @property
+    def client(self):
+        """Cliente Redis compartido, o None si se trabaja solo en proceso"""
+        return self._redis
+
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(subs) for subs in self._subs.values())
+
+    def max_queue_depth(self) -> int:
+        return max((sub.queue.qsize() for subs in self._subs.values() for sub in subs), default=0)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if not self.redis_url:
+            return
+        client = aioredis.from_url(self.redis_url)
+        try:
+            await client.ping()
+        except Exception as e:
+            print(f"PubSub: Redis no disponible ({e}), entrega solo local")
+            await client.close()
+            return
+        self._redis = client
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis:
+            await self._redis.close()
+            self._redis = None
+
+    async def ping(self) -> Optional[float]:
+        """Latencia a Redis en ms, o None si se trabaja solo en proceso"""
+        if self._redis is None:
+            return None
+        started = time.perf_counter()
+        await self._redis.ping()
+        return (time.perf_counter() - started) * 1000
+
+    def subscribe(self, topic: str, key: str, last_id: Optional[str] = None,
+                  maxsize: int = 100) -> Tuple[Subscription, List[Tuple[str, Dict]], bool]:
+        """
+        Registra una suscripción y devuelve también los mensajes posteriores a
+        `last_id` que siguen en el historial. El último valor indica un hueco:
+        el historial no cubre todo lo posterior a `last_id` (se descartaron
+        mensajes, o `last_id` es de antes de que arrancara este proceso) y el
+        cliente debe resincronizar.
+        """
+        sub = Subscription(topic, key, maxsize)
+        self._subs.setdefault((topic, key), set()).add(sub)
+
+        if not last_id:
+            return sub, [], False
+        try:
+            last = _parse_id(last_id)
+        except ValueError:
+            return sub, [], True
+
+        recent = self._recent.get((topic, key), ())
+        replay = [(mid, data) for parsed, mid, data in recent if parsed > last]
+        evicted = self._evicted.get((topic, key))
+        gap = last < self._started or (evicted is not None and evicted > last)
+        return sub, replay, gap
+
+    async def resume(self, topic: str, key: str, last_id: Optional[str] = None,
+                     maxsize: int = 100) -> Tuple[Subscription, List[Tuple[str, Dict]], bool]:
+        """
+        Como `subscribe`, pero con Redis el historial sale del stream (XRANGE
+        desde `last_id`): sobrevive a reinicios del worker. La suscripción se
+        registra antes de leer para no perder nada; lo que llegue en vivo y ya
+        estaba en el replay no se vuelve a encolar.
+        """
+        sub, replay, gap = self.subscribe(topic, key, last_id, maxsize)
+        if self._redis is None or not last_id:
+            return sub, replay, gap
+        try:
+            last = _parse_id(last_id)
+        except ValueError:
+            return sub, [], True
+        try:
+            replay, gap = await self._stream_range(topic, key, last_id, last)
+        except Exception as e:
+            print(f"PubSub: no se pudo leer el historial de Redis ({e}), se usa el local")
+        if replay:
+            sub.replayed = _parse_id(replay[-1][0])
+            # Lo que ya estaba en la cola y salió en el replay se saca
+            pending = [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+            for message in pending:
+                if message is OVERFLOW or _parse_id(message[0]) > sub.replayed:
+                    sub.queue.put_nowait(message)
+        return sub, replay, gap
+
+    async def _stream_range(self, topic: str, key: str, last_id: str,
+                            last: Tuple[int, int]) -> Tuple[List[Tuple[str, Dict]], bool]:
+        stream = f"nordia:{topic}"
+        # Si lo más viejo del stream es posterior a last_id, el recorte por maxlen se llevó algo
+        oldest = await self._redis.xrange(stream, count=1)
+        gap = bool(oldest) and _parse_id(oldest[0][0].decode()) > last
+
+        replay, start = [], f"({last_id}"
+        while True:
+            entries = await self._redis.xrange(stream, min=start, count=500)
+            for message_id, fields in entries:
+                if fields[b"key"].decode() == key:
+                    replay.append((message_id.decode(), json.loads(fields[b"data"])))
+            if len(entries) < 500:
+                break
+            start = f"({entries[-1][0].decode()}"
+        if len(replay) > self.history:
+            return replay[-self.history:], True
+        return replay, gap
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subs.get((sub.topic, sub.key))
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subs[(sub.topic, sub.key)]
+
+    def publish(self, topic: str, key: str, data: Dict):
+        """Publica un mensaje; se puede llamar desde cualquier thread"""
+        loop = self._loop
+        if loop is not None and loop.is_running() and not self._in_loop(loop):
+            loop.call_soon_threadsafe(self._publish, topic, key, data)
+        else:
+            self._publish(topic, key, data)
+
+    @staticmethod
+    def _in_loop(loop: asyncio.AbstractEventLoop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    def _publish(self, topic: str, key: str, data: Dict):
+        if self._redis is None:
+            self._deliver(topic, key, self._next_id(), data)
+            return
+
+        future = asyncio.ensure_future(self._redis.xadd(
+            f"nordia:{topic}",
+            {"key": key, "data": json.dumps(data, default=str)},
+            maxlen=self.stream_maxlen
+        ))
+        self._pending.add(future)
+
+        def _done(f: asyncio.Future):
+            self._pending.discard(f)
+            if f.cancelled() or f.exception() is not None:
+                # Si Redis falla, al menos los clientes de este worker lo reciben
+                self._deliver(topic, key, self._next_id(), data)
+
+        future.add_done_callback(_done)
+
+    def _next_id(self) -> str:
+        ms = int(time.time() * 1000)
+        if ms <= self._last_ms:
+            self._seq += 1
+        else:
+            self._last_ms, self._seq = ms, 0
+        return f"{self._last_ms}-{self._seq}"
+
+    def _deliver(self, topic: str, key: str, message_id: str, data: Dict):
+        recent = self._recent.get((topic, key))
+        if recent is None:
+            recent = self._recent[(topic, key)] = deque(maxlen=self.history)
+        if len(recent) == recent.maxlen:
+            self._evicted[(topic, key)] = recent[0][0]
+        parsed = _parse_id(message_id)
+        recent.append((parsed, message_id, data))
+
+        for sub in list(self._subs.get((topic, key), ())):
+            if sub.replayed is not None and parsed <= sub.replayed:
+                continue
+            try:
+                sub.queue.put_nowait((message_id, data))
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def _drop(self, sub: Subscription):
+        """Corta a un cliente lento: vacía su cola y le deja solo la marca OVERFLOW"""
+        self.unsubscribe(sub)
+        DROPPED_SUBSCRIBERS.inc(sub.topic)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(OVERFLOW)
+
+    async def _listen(self):
+        """Relee los Redis Streams y reparte a los suscriptores locales"""
+        streams = {f"nordia:{topic}": "$" for topic in self.topics}
+        while True:
+            try:
+                response = await self._redis.xread(streams, count=500, block=5000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"PubSub: error leyendo Redis: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for stream, entries in response or ():
+                name = stream.decode()
+                topic = name.split(":", 1)[1]
+                for message_id, fields in entries:
+                    message_id = message_id.decode()
+                    streams[name] = message_id
+                    self._deliver(topic, fields[b"key"].decode(), message_id, json.loads(fields[b"data"]))
+
+
+pubsub = PubSub(os.getenv("REDIS_URL"), topics=("insights", "consent", "auth"))
+
+Gauge("nordia_pubsub_subscribers", "Clientes suscriptos (streams SSE abiertos)",
+      callback=lambda: pubsub.subscriber_count)
+Gauge("nordia_pubsub_max_queue_depth", "Mensajes pendientes en la cola de suscriptor más llena",
+      callback=pubsub.max_queue_depth)
@@ -0,0 +1,272 @@
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from ..models.models import Product, Sale, Insight, SyncChange, SyncVersion
+from .database import SessionLocal
+
+SYNC_ENTITIES = ("product", "sale", "insight")
+
+# Modelos ORM cuyos cambios se publican en el journal
+TRACKED_MODELS = {
+    Product: "product",
+    Sale: "sale",
+    Insight: "insight",
+}
+ENTITY_TABLES = {entity: model.__table__ for model, entity in TRACKED_MODELS.items()}
+
+_versions = SyncVersion.__table__
+_changes = SyncChange.__table__
+
+
+def _insert(connection: Connection, table):
+    """INSERT con soporte de ON CONFLICT para el motor en uso (Postgres o SQLite)"""
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+
+class SyncJournal:
+    """
+    Journal de cambios por comercio para la sincronización incremental de la PWA,
+    persistido en la base (sync_versions + sync_changes).
+
+    Cada comercio tiene una versión monotónica. El contador se incrementa en la
+    misma transacción que el cambio y su fila queda bloqueada hasta el commit:
+    un cliente nunca ve la versión N+1 antes de que la N sea visible. Por cada
+    entidad solo se guarda su último cambio (upsert o tombstone) y los datos se
+    leen de su tabla al sincronizar, así el journal no duplica filas.
+    """
+
+    def __init__(self, max_tombstones: int = 5000, session_factory=SessionLocal):
+        self.max_tombstones = max_tombstones
+        self.session_factory = session_factory
+
+    def current(self, store_id: str) -> Tuple[Optional[str], int]:
+        """(epoch, versión) actuales del comercio"""
+        db = self.session_factory()
+        try:
+            state = db.execute(
+                select(_versions.c.epoch, _versions.c.version).where(_versions.c.store_id == store_id)
+            ).first()
+        finally:
+            db.close()
+        return (state.epoch, state.version) if state else (None, 0)
+
+    def record(self, db: Session, store_id: str, entity: str, entity_ids: Iterable[str],
+               deleted: bool = False) -> int:
+        """
+        Registra upserts (o tombstones) hechos por fuera del ORM, por ejemplo con
+        INSERT/UPDATE de Core. Corre en la transacción de `db`: si no hay commit,
+        el cambio no existe. Devuelve la nueva versión del comercio.
+        """
+        return self.record_changes(db.connection(), store_id, [(entity, entity_id, deleted) for entity_id in entity_ids])
+
+    def record_changes(self, connection: Connection, store_id: str, changes: List[Tuple[str, str, bool]]) -> int:
+        """Registra (entidad, id, borrado) en un solo UPDATE del contador y un upsert multi-fila"""
+        latest: Dict[Tuple[str, str], bool] = {}
+        for entity, entity_id, deleted in changes:
+            latest[(entity, entity_id)] = deleted
+        if not latest:
+            return 0
+
+        last = self._bump(connection, store_id, len(latest))
+        first = last - len(latest) + 1
+        rows = [
+            {"store_id": store_id, "entity": entity, "entity_id": entity_id, "version": first + i, "deleted": deleted}
+            for i, ((entity, entity_id), deleted) in enumerate(latest.items())
+        ]
+        stmt = _insert(connection, _changes)
+        connection.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["store_id", "entity", "entity_id"],
+                set_={"version": stmt.excluded.version, "deleted": stmt.excluded.deleted}
+            ),
+            rows
+        )
+        if any(latest.values()):
+            self._compact(connection, store_id)
+        return last
+
+    def _bump(self, connection: Connection, store_id: str, count: int) -> int:
+        """Suma `count` a la versión del comercio (creando la fila si hace falta) y devuelve la nueva"""
+        bump = update(_versions).where(_versions.c.store_id == store_id) \
+            .values(version=_versions.c.version + count).returning(_versions.c.version)
+        version = connection.execute(bump).scalar()
+        if version is None:
+            # Dos workers pueden crear la fila a la vez: el segundo no hace nada y actualiza
+            connection.execute(
+                _insert(connection, _versions)
+                .values(store_id=store_id, version=0, floor=0, epoch=uuid.uuid4().hex[:12])
+                .on_conflict_do_nothing(index_elements=["store_id"])
+            )
+            version = connection.execute(bump).scalar()
+        return version
+
+    def _compact(self, connection: Connection, store_id: str):
+        """
+        Si hay más de `max_tombstones`, descarta la mitad más vieja. Los clientes
+        con una versión anterior al piso resultante necesitan un resync completo.
+        """
+        tombstones = (_changes.c.store_id == store_id) & _changes.c.deleted
+        count = connection.execute(select(func.count()).select_from(_changes).where(tombstones)).scalar()
+        if count <= self.max_tombstones:
+            return
+        floor = connection.execute(
+            select(_changes.c.version).where(tombstones).order_by(_changes.c.version)
+            .offset(count - self.max_tombstones // 2 - 1).limit(1)
+        ).scalar()
+        connection.execute(delete(_changes).where(tombstones & (_changes.c.version <= floor)))
+        connection.execute(update(_versions).where(_versions.c.store_id == store_id).values(floor=floor))
+
+    def changes_since(self, store_id: str, since: int = 0, epoch: Optional[str] = None,
+                      limit: Optional[int] = None, cursor: Optional[str] = None) -> Dict:
+        """
+        Devuelve el delta compacto desde `since`: filas agrupadas por entidad
+        y ids borrados. Si el cursor no es válido se devuelve el estado completo
+        del comercio leído de la base, paginado de a `limit` filas: mientras
+        `has_more`, la página siguiente se pide con el `cursor` devuelto.
+        """
+        db = self.session_factory()
+        try:
+            state = db.execute(
+                select(_versions.c.version, _versions.c.floor, _versions.c.epoch)
+                .where(_versions.c.store_id == store_id)
+            ).first()
+            current, floor, current_epoch = state if state else (0, 0, None)
+
+            page = _parse_cursor(cursor) if cursor else None
+            if page is not None:
+                pinned, entity, last_id = page
+                # Con otro epoch o tombstones compactados el delta posterior no alcanza: se empieza de nuevo
+                if epoch != current_epoch or not floor <= pinned <= current:
+                    page = None
+            full_resync = page is not None or since <= 0 or epoch != current_epoch \
+                or since > current or since < floor
+
+            if full_resync:
+                # La versión se fija en la primera página y se leyó antes que las filas:
+                # lo que cambie entretanto llega otra vez en el delta desde esa versión
+                version = pinned if page is not None else current
+                changes, after = self._snapshot(db, store_id, limit, page[1:] if page is not None else None)
+                return {
+                    "epoch": current_epoch,
+                    "version": version,
+                    "full_resync": True,
+                    "has_more": after is not None,
+                    "cursor": f"{version}:{after[0]}:{after[1]}" if after is not None else None,
+                    "changes": changes,
+                    "deleted": {},
+                }
+
+            query = select(_changes.c.entity, _changes.c.entity_id, _changes.c.version, _changes.c.deleted).where(
+                _changes.c.store_id == store_id,
+                _changes.c.version > since,
+                _changes.c.version <= current,
+            ).order_by(_changes.c.version)
+            if limit is not None:
+                query = query.limit(limit + 1)
+            pending = db.execute(query).all()
+
+            has_more = limit is not None and len(pending) > limit
+            if has_more:
+                pending = pending[:limit]
+            version = pending[-1].version if has_more else current
+
+            upserts: Dict[str, List[str]] = {}
+            deleted: Dict[str, list] = {}
+            for row in pending:
+                if row.deleted:
+                    deleted.setdefault(row.entity, []).append(row.entity_id)
+                else:
+                    upserts.setdefault(row.entity, []).append(row.entity_id)
+
+            changes: Dict[str, list] = {}
+            for entity, ids in upserts.items():
+                found = self._load(db, entity, store_id, ids)
+                changes[entity] = [found[entity_id] for entity_id in ids if entity_id in found]
+                # Borradas por fuera del ORM (sin tombstone): para el cliente también son borrados
+                missing = [entity_id for entity_id in ids if entity_id not in found]
+                if missing:
+                    deleted.setdefault(entity, []).extend(missing)
+        finally:
+            db.close()
+
+        return {
+            "epoch": current_epoch,
+            "version": version,
+            "full_resync": False,
+            "has_more": has_more,
+            "cursor": None,
+            "changes": changes,
+            "deleted": deleted,
+        }
+
+    @staticmethod
+    def _load(db: Session, entity: str, store_id: str, ids: List[str]) -> Dict[str, Dict]:
+        table = ENTITY_TABLES[entity]
+        rows = db.execute(select(table).where(table.c.store_id == store_id, table.c.id.in_(ids))).mappings()
+        return {row["id"]: dict(row) for row in rows}
+
+    @staticmethod
+    def _snapshot(db: Session, store_id: str, limit: Optional[int] = None,
+                  after: Optional[Tuple[str, str]] = None) -> Tuple[Dict[str, list], Optional[Tuple[str, str]]]:
+        """
+        Página del estado completo, por entidad y en orden de id (keyset): sigue
+        después de `after` = (entidad, último id) y devuelve dónde continúa, o
+        None si no queda nada. Un id vacío es el comienzo de la entidad.
+        """
+        entities = list(ENTITY_TABLES)
+        start = entities.index(after[0]) if after else 0
+        remaining = limit
+        snapshot = {}
+        for entity in entities[start:]:
+            table = ENTITY_TABLES[entity]
+            query = select(table).where(table.c.store_id == store_id).order_by(table.c.id)
+            if after and entity == after[0] and after[1]:
+                query = query.where(table.c.id > after[1])
+            if remaining is not None:
+                query = query.limit(remaining + 1)
+            rows = [dict(row) for row in db.execute(query).mappings()]
+            if remaining is not None and len(rows) > remaining:
+                if remaining:
+                    snapshot[entity] = rows[:remaining]
+                return snapshot, (entity, rows[remaining - 1]["id"] if remaining else "")
+            snapshot[entity] = rows
+            if remaining is not None:
+                remaining -= len(rows)
+        return snapshot, None
+
+
+def _parse_cursor(cursor: str) -> Optional[Tuple[int, str, str]]:
+    """(versión fijada, entidad, último id) de un cursor de snapshot, o None si no es válido"""
+    version, _, rest = cursor.partition(":")
+    entity, _, last_id = rest.partition(":")
+    if not version.isdigit() or entity not in ENTITY_TABLES:
+        return None
+    return int(version), entity, last_id
+
+
+sync_journal = SyncJournal()
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session: Session, flush_context):
+    """Registra los cambios de entidades sincronizables en la misma transacción del flush"""
+    by_store: Dict[str, List[Tuple[str, str, bool]]] = {}
+    for obj in list(session.new) + list(session.dirty):
+        entity = TRACKED_MODELS.get(type(obj))
+        if entity and session.is_modified(obj, include_collections=False):
+            by_store.setdefault(obj.store_id, []).append((entity, obj.id, False))
+    for obj in session.deleted:
+        entity = TRACKED_MODELS.get(type(obj))
+        if entity:
+            by_store.setdefault(obj.store_id, []).append((entity, obj.id, True))
+    if not by_store:
+        return
+    connection = session.connection()
+    for store_id, changes in by_store.items():
+        sync_journal.record_changes(connection, store_id, changes)
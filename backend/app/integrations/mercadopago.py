@@ -1,7 +1,161 @@
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from ..core.metrics import Counter, Histogram
+
+PROVIDER_LATENCY = Histogram("nordia_mercadopago_request_duration_seconds", "Latencia de la API de MercadoPago", ("operation",))
+PROVIDER_ERRORS = Counter("nordia_mercadopago_errors_total", "Errores llamando a MercadoPago", ("operation", "reason"))
+
+
+class PaymentProviderError(Exception):
+    """La API de MercadoPago falló, no respondió a tiempo o el circuito está abierto"""
+
+
+class CircuitOpenError(PaymentProviderError):
+    pass
+
+
+class PaymentRejectedError(PaymentProviderError):
+    """MercadoPago respondió 4xx: el pedido es inválido y reintentarlo igual no cambia nada"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas al proveedor después de `failure_threshold` fallas seguidas.
+    Pasado `reset_timeout` deja pasar una llamada de prueba (half-open).
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise CircuitOpenError("MercadoPago no disponible (circuito abierto)")
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
 class MercadoPagoService:
-    def __init__(self):
-        self.token = "demo_token"
+    """
+    Cliente async de la API de pagos de MercadoPago con un pool de conexiones
+    compartido, timeouts cortos y circuit breaker para no trabar la caja.
+    `MERCADOPAGO_API_URL` permite apuntarlo al proveedor mock local.
+    """
+
+    def __init__(self, token: Optional[str] = None, base_url: Optional[str] = None,
+                 timeout: float = 3.0, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.token = token or os.getenv("MERCADOPAGO_ACCESS_TOKEN", "demo_token")
+        self.base_url = base_url or os.getenv("MERCADOPAGO_API_URL", "https://api.mercadopago.com")
+        self.timeout = httpx.Timeout(timeout, connect=1.0)
+        self.transport = transport
+        self.breaker = CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                headers={"Authorization": f"Bearer {self.token}"},
+                transport=self.transport,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, operation: str, method: str, path: str, **kwargs) -> Dict:
+        self.breaker.before_call()
+        started = time.perf_counter()
+        succeeded = False
+        # Cualquier salida sin respuesta válida (incluida la cancelación) cuenta como
+        # falla: así también se libera la llamada de prueba del estado half-open
+        try:
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TimeoutException as e:
+                PROVIDER_ERRORS.inc(operation, "timeout")
+                raise PaymentProviderError(f"timeout en {operation}") from e
+            except httpx.HTTPError as e:
+                PROVIDER_ERRORS.inc(operation, "transport")
+                raise PaymentProviderError(f"error de red en {operation}: {e}") from e
+
+            if response.status_code >= 500:
+                PROVIDER_ERRORS.inc(operation, "server_error")
+                raise PaymentProviderError(f"MercadoPago respondió {response.status_code} en {operation}")
+            if response.status_code >= 400:
+                # El proveedor respondió: un pedido rechazado no abre el circuito
+                succeeded = True
+                PROVIDER_ERRORS.inc(operation, "rejected_request")
+                raise PaymentRejectedError(f"MercadoPago rechazó {operation}: {response.text}", response.status_code)
+            try:
+                data = response.json()
+            except ValueError as e:
+                PROVIDER_ERRORS.inc(operation, "invalid_response")
+                raise PaymentProviderError(f"respuesta inválida de MercadoPago en {operation}") from e
+            succeeded = True
+            return data
+        finally:
+            PROVIDER_LATENCY.observe(time.perf_counter() - started, operation)
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    async def create_payment(self, amount: float, description: str, idempotency_key: str,
+                             external_reference: Optional[str] = None,
+                             payment_method_id: str = "account_money",
+                             payer_email: Optional[str] = None) -> Dict:
+        """
+        Crea un pago. Reintentar con la misma `idempotency_key` devuelve el mismo
+        pago en vez de cobrar dos veces.
+        """
+        body = {
+            "transaction_amount": amount,
+            "description": description,
+            "payment_method_id": payment_method_id,
+            "external_reference": external_reference,
+            "payer": {"email": payer_email or "cliente@nordia.app"},
+        }
+        return await self._request(
+            "create_payment", "POST", "/v1/payments",
+            json=body, headers={"X-Idempotency-Key": idempotency_key}
+        )
 
-    def create_payment(self, amount: float, description: str):
-        # Demo implementation
-        return {"id": "demo_payment_123", "status": "approved", "amount": amount}
\ No newline at end of file
+    async def get_payment(self, payment_id: str) -> Dict:
+        return await self._request("get_payment", "GET", f"/v1/payments/{payment_id}")
@@ -0,0 +1,92 @@
+"""
+Proveedor MercadoPago falso para desarrollo y pruebas de carga.
+
+    uvicorn app.integrations.mercadopago_mock:app --port 9000
+    MERCADOPAGO_API_URL=http://localhost:9000 uvicorn app.main:app
+
+O en proceso, sin red:
+
+    MercadoPagoService(base_url="http://mock", transport=httpx.ASGITransport(app=create_mock_app()))
+"""
+import asyncio
+import os
+import random
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse
+
+
+def create_mock_app(latency: float = 0.0, failure_rate: float = 0.0) -> FastAPI:
+    """
+    `latency` demora cada respuesta (segundos) y `failure_rate` devuelve 500 en
+    esa fracción de requests, para ejercitar timeouts y el circuit breaker.
+    """
+    mock = FastAPI(title="MercadoPago mock")
+    payments: Dict[str, Dict] = {}
+    by_idempotency_key: Dict[str, str] = {}
+    mock.state.payments = payments
+    mock.state.latency = latency
+    mock.state.failure_rate = failure_rate
+
+    async def simulate_network():
+        if mock.state.latency:
+            await asyncio.sleep(mock.state.latency)
+        if random.random() < mock.state.failure_rate:
+            raise HTTPException(status_code=500, detail="internal_error")
+
+    @mock.post("/v1/payments")
+    async def create_payment(body: dict, x_idempotency_key: Optional[str] = Header(None)):
+        await simulate_network()
+        if not x_idempotency_key:
+            return JSONResponse({"message": "X-Idempotency-Key requerido"}, status_code=400)
+        if x_idempotency_key in by_idempotency_key:
+            return payments[by_idempotency_key[x_idempotency_key]]
+
+        amount = float(body["transaction_amount"])
+        # Centavos .13 se rechazan, montos altos quedan en revisión: igual que las tarjetas de prueba
+        if round(amount * 100) % 100 == 13:
+            status, detail = "rejected", "cc_rejected_other_reason"
+        elif amount > 100000:
+            status, detail = "in_process", "pending_review_manual"
+        else:
+            status, detail = "approved", "accredited"
+
+        payment_id = str(random.randint(10**9, 10**10 - 1))
+        payments[payment_id] = {
+            "id": payment_id,
+            "status": status,
+            "status_detail": detail,
+            "transaction_amount": amount,
+            "description": body.get("description"),
+            "external_reference": body.get("external_reference"),
+            "date_created": datetime.utcnow().isoformat(),
+            "request_id": str(uuid.uuid4()),
+        }
+        by_idempotency_key[x_idempotency_key] = payment_id
+        return JSONResponse(payments[payment_id], status_code=201)
+
+    @mock.get("/v1/payments/{payment_id}")
+    async def get_payment(payment_id: str):
+        await simulate_network()
+        if payment_id not in payments:
+            raise HTTPException(status_code=404, detail="not_found")
+        return payments[payment_id]
+
+    @mock.post("/__mock__/payments/{payment_id}/status")
+    async def set_status(payment_id: str, body: dict):
+        """Cambia el estado de un pago como lo haría el proveedor (luego se manda el webhook)"""
+        if payment_id not in payments:
+            raise HTTPException(status_code=404, detail="not_found")
+        payments[payment_id].update(status=body["status"], status_detail=body.get("status_detail", body["status"]))
+        return payments[payment_id]
+
+    return mock
+
+
+app = create_mock_app(
+    latency=float(os.getenv("MOCK_MP_LATENCY", "0")),
+    failure_rate=float(os.getenv("MOCK_MP_FAILURE_RATE", "0"))
+)
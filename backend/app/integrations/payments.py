@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import hmac
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Union
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..core.database import SessionLocal
+from ..core.metrics import Counter, Gauge
+from ..models.compact import SalesLedger, StoreLedgers
+from ..models.models import Payment, Sale
+from ..routers.sales import sales_storage
+from .mercadopago import MercadoPagoService, PaymentProviderError, PaymentRejectedError
+
+PAYMENTS = Counter("nordia_payments_total", "Cobros iniciados por resultado", ("status",))
+RECONCILED = Counter("nordia_payments_reconciled_total", "Pagos actualizados por el reconciliador")
+
+# Estados de MercadoPago que ya no cambian solos, más "error": MercadoPago
+# rechazó el pedido de cobro (4xx) y reintentarlo no lo arregla
+FINAL_STATUSES = {"approved", "rejected", "cancelled", "refunded", "charged_back", "error"}
+
+
+def idempotency_key(sale_id: str) -> str:
+    """La clave depende solo de la venta: reintentos de la caja no generan cobros nuevos"""
+    return f"nordia-sale-{sale_id}"
+
+
+def _apply_provider_result(payment: Payment, result: Dict):
+    payment.provider_payment_id = str(result["id"])
+    payment.status = result.get("status", payment.status)
+    payment.status_detail = result.get("status_detail")
+
+
+def _claim_payment(db: Session, sale_id: str, amount: float, store_id: Optional[str]) -> Payment:
+    """Busca o crea (una sola vez por venta) la fila del cobro"""
+    payment = db.query(Payment).filter(Payment.sale_id == sale_id).first()
+    if payment is None:
+        payment = Payment(
+            sale_id=sale_id,
+            store_id=store_id,
+            idempotency_key=idempotency_key(sale_id),
+            amount=amount,
+            status="pending"
+        )
+        db.add(payment)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Otra caja/request creó el cobro de esta venta al mismo tiempo
+            db.rollback()
+            payment = db.query(Payment).filter(Payment.sale_id == sale_id).one()
+
+    if abs(payment.amount - amount) > 0.01:
+        raise ValueError("La venta ya tiene un cobro por otro monto")
+    return payment
+
+
+def _save_payment(db: Session, payment: Payment, result: Optional[Dict] = None, error: Optional[str] = None,
+                  status: Optional[str] = None):
+    if result is not None:
+        _apply_provider_result(payment, result)
+    else:
+        payment.status_detail = error
+        payment.status = status or payment.status
+    db.commit()
+    # Se recarga acá (en el thread) para que leerlo después no vuelva a ir a la base
+    db.refresh(payment)
+
+
+async def charge_sale(db: Session, service: MercadoPagoService, sale_id: str, amount: float,
+                      description: str, store_id: Optional[str] = None,
+                      payer_email: Optional[str] = None) -> Payment:
+    """
+    Inicia (o retoma) el cobro de una venta. Si MercadoPago está lento o caído
+    el pago queda `pending` y la caja sigue: el reconciliador lo completa después.
+    Si rechaza el pedido (4xx) el pago queda en `error`, cerrado.
+    El trabajo con la base corre en threads para no trabar el event loop.
+    """
+    payment = await asyncio.to_thread(_claim_payment, db, sale_id, amount, store_id)
+    if payment.provider_payment_id or payment.status in FINAL_STATUSES:
+        return payment
+
+    try:
+        result = await service.create_payment(
+            amount, description, payment.idempotency_key,
+            external_reference=sale_id, payer_email=payer_email
+        )
+    except PaymentRejectedError as e:
+        # Pedido inválido: queda cerrado y ni el barrido ni la caja lo tratan como en curso
+        await asyncio.to_thread(_save_payment, db, payment, error=str(e)[:200], status="error")
+        PAYMENTS.inc("error")
+        return payment
+    except PaymentProviderError as e:
+        await asyncio.to_thread(_save_payment, db, payment, error=str(e)[:200])
+        PAYMENTS.inc("deferred")
+        return payment
+
+    await asyncio.to_thread(_save_payment, db, payment, result)
+    PAYMENTS.inc(payment.status)
+    return payment
+
+
+def verify_webhook_signature(secret: str, signature_header: str, request_id: str, data_id: str) -> bool:
+    """
+    Valida el header x-signature ("ts=...,v1=...") de MercadoPago: HMAC-SHA256
+    del manifiesto "id:<data.id>;request-id:<x-request-id>;ts:<ts>;".
+    """
+    parts = dict(item.strip().split("=", 1) for item in signature_header.split(",") if "=" in item)
+    ts, received = parts.get("ts"), parts.get("v1")
+    if not ts or not received:
+        return False
+    manifest = f"id:{data_id};request-id:{request_id};ts:{ts};"
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, received)
+
+
+class PaymentReconciler:
+    """
+    Recibe las notificaciones del webhook en una cola acotada, consulta el
+    estado de cada pago a MercadoPago y actualiza pagos y ventas en lote: las
+    de la base y las de la caja (`ledger`), que todavía viven en memoria.
+    Cada `sweep_interval` también barre pagos que quedaron pendientes
+    (webhook perdido o creados con el proveedor caído).
+    """
+
+    def __init__(self, service: MercadoPagoService, ledger: Optional[Union[SalesLedger, StoreLedgers]] = None,
+                 batch_size: int = 100, flush_interval: float = 1.0, sweep_interval: float = 60.0,
+                 max_queue: int = 10000, concurrency: int = 10):
+        self.service = service
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self._tasks: List[asyncio.Task] = []
+
+    def notify(self, provider_payment_id: str) -> bool:
+        """Encola una notificación; False si la cola está llena (el webhook responde 503 y MP reintenta)"""
+        try:
+            self.queue.put_nowait(str(provider_payment_id))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()), asyncio.create_task(self._sweeper())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _next_batch(self) -> List[str]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.reconcile(batch)
+            except Exception as e:
+                print(f"Error reconciliando pagos: {e}")
+
+    async def reconcile(self, provider_payment_ids: Iterable[str]) -> int:
+        """Consulta el estado actual de los pagos y lo persiste en un solo lote"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(payment_id: str) -> Optional[Dict]:
+            async with semaphore:
+                try:
+                    return await self.service.get_payment(payment_id)
+                except PaymentProviderError as e:
+                    print(f"No se pudo consultar el pago {payment_id}: {e}")
+                    return None
+
+        unique_ids = list(dict.fromkeys(provider_payment_ids))
+        results = [r for r in await asyncio.gather(*(fetch(pid) for pid in unique_ids)) if r]
+        if not results:
+            return 0
+        updated = await asyncio.to_thread(self._apply_batch, results)
+        RECONCILED.inc(amount=updated)
+        return updated
+
+    def _apply_batch(self, results: List[Dict]) -> int:
+        by_provider_id = {str(r["id"]): r for r in results}
+        by_sale_id = {r["external_reference"]: r for r in results if r.get("external_reference")}
+
+        db = SessionLocal()
+        try:
+            # Se matchea también por venta: el pago pudo crearse aunque la caja no recibió la respuesta
+            rows = db.query(Payment.id, Payment.sale_id, Payment.provider_payment_id).filter(or_(
+                Payment.provider_payment_id.in_(list(by_provider_id)),
+                Payment.sale_id.in_(list(by_sale_id))
+            )).all()
+
+            now = datetime.utcnow()
+            payment_params, sale_params = [], []
+            for row in rows:
+                result = by_provider_id.get(row.provider_payment_id) or by_sale_id[row.sale_id]
+                payment_params.append({
+                    "b_id": row.id,
+                    "b_provider_id": str(result["id"]),
+                    "b_status": result["status"],
+                    "b_detail": result.get("status_detail"),
+                    "b_now": now,
+                })
+                sale_params.append({"b_id": row.sale_id, "b_status": result["status"]})
+
+            if payment_params:
+                payments = Payment.__table__
+                db.execute(
+                    update(payments).where(payments.c.id == bindparam("b_id")).values(
+                        provider_payment_id=bindparam("b_provider_id"),
+                        status=bindparam("b_status"),
+                        status_detail=bindparam("b_detail"),
+                        updated_at=bindparam("b_now"),
+                    ),
+                    payment_params
+                )
+                sales = Sale.__table__
+                db.execute(
+                    update(sales).where(sales.c.id == bindparam("b_id")).values(payment_status=bindparam("b_status")),
+                    sale_params
+                )
+            db.commit()
+        finally:
+            db.close()
+
+        for params in sale_params:
+            self.mark_sale(params["b_id"], params["b_status"])
+        return len(payment_params)
+
+    def mark_sale(self, sale_id: str, status: str):
+        """Refleja el estado del cobro en la venta de la caja, si está en el ledger"""
+        row = self.ledger.get(sale_id) if self.ledger is not None else None
+        if row is not None:
+            row.payment_status = status
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Error barriendo pagos pendientes: {e}")
+
+    async def sweep(self, older_than: timedelta = timedelta(minutes=2), limit: int = 200):
+        """Re-encola pagos pendientes y reintenta (idempotente) los que nunca llegaron al proveedor"""
+        cutoff = datetime.utcnow() - older_than
+
+        def load():
+            db = SessionLocal()
+            try:
+                return db.query(Payment.sale_id, Payment.amount, Payment.provider_payment_id).filter(
+                    Payment.status.in_(["pending", "in_process"]),
+                    Payment.updated_at < cutoff
+                ).limit(limit).all()
+            finally:
+                db.close()
+
+        for sale_id, amount, provider_payment_id in await asyncio.to_thread(load):
+            if provider_payment_id:
+                self.notify(provider_payment_id)
+                continue
+            db = SessionLocal()
+            try:
+                payment = await charge_sale(db, self.service, sale_id, amount, f"Venta {sale_id}")
+                self.mark_sale(sale_id, payment.status)
+            finally:
+                db.close()
+
+
+mercadopago = MercadoPagoService()
+reconciler = PaymentReconciler(mercadopago, ledger=sales_storage)
+webhook_secret = os.getenv("MERCADOPAGO_WEBHOOK_SECRET")
+
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+Gauge(
+    "nordia_mercadopago_circuit_state", "Circuit breaker de MercadoPago (0 cerrado, 1 half-open, 2 abierto)",
+    callback=lambda: _BREAKER_STATES[mercadopago.breaker.state]
+)
+Gauge("nordia_payments_reconcile_queue_depth", "Notificaciones de pago pendientes de procesar",
+      callback=lambda: reconciler.queue.qsize())
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from ..core.database import SessionLocal
+from ..core.metrics import Counter, Gauge
+from ..core.sync import sync_journal
+from ..models.models import Product, Sale, SaleItem, Store
+
+MESSAGES = Counter("nordia_whatsapp_messages_total", "Mensajes entrantes de WhatsApp por resultado", ("outcome",))
+DRAFTS_CREATED = Counter("nordia_whatsapp_draft_sales_total", "Ventas borrador creadas desde pedidos de WhatsApp")
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(phone: Optional[str]) -> str:
+    """
+    Últimos 10 dígitos: "+54 9 11 5555-1234", "5491155551234" y "1155551234"
+    son el mismo número.
+    """
+    return _NON_DIGITS.sub("", phone or "")[-10:]
+
+
+@dataclass(slots=True)
+class InboundOrder:
+    message_id: str
+    business_phone: str
+    customer_phone: str
+    customer_name: Optional[str]
+    items: List[Tuple[str, int, float]] = field(default_factory=list)  # (product_id, cantidad, precio)
+    received_at: datetime = field(default_factory=datetime.utcnow)
+
+
+def verify_signature(app_secret: str, body: bytes, signature_header: Optional[str]) -> bool:
+    """Valida el header X-Hub-Signature-256 ("sha256=<hex>"): HMAC-SHA256 del body crudo con el app secret"""
+    if not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):])
+
+
+def parse_payload(payload: Dict) -> Tuple[List[InboundOrder], int]:
+    """
+    Extrae los pedidos (mensajes `order` del catálogo) de un payload del webhook
+    de WhatsApp Cloud API. Devuelve los pedidos y cuántos mensajes se ignoraron.
+    """
+    orders, ignored = [], 0
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value") or {}
+            business_phone = (value.get("metadata") or {}).get("display_phone_number", "")
+            names = {c.get("wa_id"): (c.get("profile") or {}).get("name") for c in value.get("contacts") or []}
+            for message in value.get("messages") or []:
+                order = message.get("order")
+                if message.get("type") != "order" or not order or not message.get("id"):
+                    ignored += 1
+                    continue
+                sender = message.get("from", "")
+                timestamp = message.get("timestamp")
+                orders.append(InboundOrder(
+                    message_id=message["id"],
+                    business_phone=business_phone,
+                    customer_phone=sender,
+                    customer_name=names.get(sender),
+                    items=[
+                        (item["product_retailer_id"], int(item.get("quantity", 1)), float(item.get("item_price", 0)))
+                        for item in order.get("product_items") or []
+                        if item.get("product_retailer_id")
+                    ],
+                    received_at=datetime.utcfromtimestamp(int(timestamp)) if timestamp else datetime.utcnow(),
+                ))
+    return orders, ignored
+
+
+class StoreDirectory:
+    """
+    Índice en memoria teléfono del negocio -> store_id. Se recarga entero cada
+    `refresh_interval` segundos, o antes si llega un número desconocido.
+    """
+
+    def __init__(self, refresh_interval: float = 300.0, miss_reload_interval: float = 10.0):
+        self.refresh_interval = refresh_interval
+        self.miss_reload_interval = miss_reload_interval
+        self._by_phone: Dict[str, str] = {}
+        self._loaded_at = 0.0
+
+    def load(self):
+        db = SessionLocal()
+        try:
+            rows = db.query(Store.id, Store.phone).filter(Store.is_active == True).all()
+        finally:
+            db.close()
+        # Se reemplaza el dict entero: las lecturas concurrentes nunca ven uno a medio armar
+        self._by_phone = {normalize_phone(phone): store_id for store_id, phone in rows if phone}
+        self._loaded_at = time.monotonic()
+
+    def resolve_many(self, phones: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Resuelve varios teléfonos, recargando a lo sumo una vez si hay alguno desconocido"""
+        phones = set(phones)
+        age = time.monotonic() - self._loaded_at
+        missing = any(normalize_phone(p) not in self._by_phone for p in phones)
+        if age > self.refresh_interval or (missing and age > self.miss_reload_interval):
+            self.load()
+        return {phone: self._by_phone.get(normalize_phone(phone)) for phone in phones}
+
+
+class RecentIds:
+    """Ids de mensajes ya procesados (LRU acotado): WhatsApp reentrega ante timeouts"""
+
+    def __init__(self, maxsize: int = 50000):
+        self.maxsize = maxsize
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def claim(self, message_id: str) -> bool:
+        """True si el id es nuevo; queda reservado hasta `release`"""
+        if message_id in self._ids:
+            self._ids.move_to_end(message_id)
+            return False
+        self._ids[message_id] = None
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+        return True
+
+    def release(self, message_ids: Iterable[str]):
+        for message_id in message_ids:
+            self._ids.pop(message_id, None)
+
+
+class WhatsAppIngestor:
+    """
+    El webhook solo encola el payload crudo en una cola acotada y responde.
+    Unos pocos workers toman lotes, los parsean, descartan duplicados y crean
+    las ventas borrador de todo el lote con un único INSERT multi-fila.
+    Un payload inválido se descarta solo; si la base falla, los payloads
+    afectados se reencolan con backoff hasta `max_retries` veces.
+    """
+
+    def __init__(self, workers: int = 2, batch_size: int = 200, flush_interval: float = 0.5,
+                 max_queue: int = 5000, max_retries: int = 5, retry_delay: float = 1.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue: asyncio.Queue = asyncio.Queue(max_queue)
+        self.stores = StoreDirectory()
+        self.recent = RecentIds()
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, payload: Dict, attempt: int = 0) -> bool:
+        """Encola un payload; False si la cola está llena (el webhook responde 503 y WhatsApp reintenta)"""
+        try:
+            self.queue.put_nowait((payload, attempt))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def start(self):
+        try:
+            await asyncio.to_thread(self.stores.load)
+        except Exception as e:
+            print(f"No se pudo cargar el índice de tiendas: {e}")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _next_batch(self) -> List[Tuple[Dict, int]]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.process(batch)
+            except Exception as e:
+                print(f"Error procesando mensajes de WhatsApp: {e}")
+
+    async def process(self, entries: List[Tuple[Dict, int]]) -> int:
+        """Procesa un lote de (payload, intento) y devuelve cuántas ventas borrador se crearon"""
+        orders, sources = [], {}
+        for payload, attempt in entries:
+            try:
+                parsed, ignored = parse_payload(payload)
+            except Exception as e:
+                # Un payload mal formado no se arregla reintentando: se descarta solo ese
+                print(f"Payload de WhatsApp inválido, se descarta: {e!r}")
+                MESSAGES.inc("invalid")
+                continue
+            MESSAGES.inc("ignored", amount=ignored)
+            for order in parsed:
+                sources[order.message_id] = (payload, attempt)
+            orders.extend(parsed)
+
+        # El claim se hace en el loop, antes de pasar al thread: dos workers no toman el mismo mensaje
+        fresh = [order for order in orders if self.recent.claim(order.message_id)]
+        MESSAGES.inc("duplicate", amount=len(orders) - len(fresh))
+        if not fresh:
+            return 0
+        try:
+            created, failed = await asyncio.to_thread(self._store_orders, fresh)
+        except Exception as e:
+            print(f"Error guardando pedidos de WhatsApp: {e}")
+            created, failed = 0, fresh
+
+        if failed:
+            self.recent.release(order.message_id for order in failed)
+            # Reintentar el payload entero es seguro: lo ya guardado se descarta como duplicado
+            retry = {}
+            for order in failed:
+                payload, attempt = sources[order.message_id]
+                retry[id(payload)] = (payload, attempt)
+            for payload, attempt in retry.values():
+                self._retry(payload, attempt)
+        return created
+
+    def _retry(self, payload: Dict, attempt: int):
+        if attempt >= self.max_retries:
+            print(f"Payload de WhatsApp descartado después de {attempt + 1} intentos")
+            MESSAGES.inc("failed")
+            return
+        delay = self.retry_delay * 2 ** attempt
+        asyncio.get_running_loop().call_later(delay, self._requeue, payload, attempt + 1)
+
+    def _requeue(self, payload: Dict, attempt: int):
+        if not self.submit(payload, attempt):
+            print("Cola de WhatsApp llena, se descarta un reintento")
+            MESSAGES.inc("failed")
+
+    def _store_orders(self, orders: List[InboundOrder]) -> Tuple[int, List[InboundOrder]]:
+        """Guarda los pedidos; devuelve las ventas creadas y los pedidos a reintentar"""
+        store_ids = self.stores.resolve_many(order.business_phone for order in orders)
+        resolved = [(order, store_ids[order.business_phone]) for order in orders if store_ids[order.business_phone]]
+        MESSAGES.inc("unknown_store", amount=len(orders) - len(resolved))
+        if not resolved:
+            return 0, []
+
+        db = SessionLocal()
+        try:
+            try:
+                return self._insert_orders(db, resolved), []
+            except IntegrityError:
+                # Otro worker guardó alguno de los mensajes entre el chequeo y el INSERT
+                db.rollback()
+            except Exception as e:
+                db.rollback()
+                print(f"Error guardando el lote de WhatsApp: {e}")
+                return 0, [order for order, _ in resolved]
+
+            # Se separan los duplicados guardando de a un pedido
+            created, failed = 0, []
+            for order, store_id in resolved:
+                try:
+                    created += self._insert_orders(db, [(order, store_id)])
+                except IntegrityError:
+                    db.rollback()
+                    MESSAGES.inc("duplicate")
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error guardando el pedido de WhatsApp {order.message_id}: {e}")
+                    failed.append(order)
+            return created, failed
+        finally:
+            db.close()
+
+    @staticmethod
+    def _existing_message_ids(db, message_ids: List[str]) -> set:
+        return {mid for (mid,) in db.query(Sale.whatsapp_message_id).filter(Sale.whatsapp_message_id.in_(message_ids))}
+
+    def _insert_orders(self, db, resolved: List[Tuple[InboundOrder, str]]) -> int:
+        # El LRU es por proceso y no sobrevive reinicios: se chequea también contra la base
+        # (y la columna es única, por si dos workers llegan a la vez)
+        existing = self._existing_message_ids(db, [order.message_id for order, _ in resolved])
+        resolved = [(order, store_id) for order, store_id in resolved if order.message_id not in existing]
+        MESSAGES.inc("duplicate", amount=len(existing))
+        if not resolved:
+            return 0
+
+        # Solo se vinculan ítems a productos existentes de la tienda (sale_items tiene FK)
+        product_ids = {product_id for order, _ in resolved for product_id, _, _ in order.items}
+        known_products = set(db.query(Product.id, Product.store_id).filter(Product.id.in_(product_ids))) \
+            if product_ids else set()
+
+        sale_rows, item_rows = [], []
+        for order, store_id in resolved:
+            sale_id = str(uuid.uuid4())
+            items = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "sale_id": sale_id,
+                    "product_id": product_id,
+                    "quantity": quantity,
+                    "unit_price": price,
+                    "total_price": round(quantity * price, 2),
+                }
+                for product_id, quantity, price in order.items
+                if (product_id, store_id) in known_products
+            ]
+            sale_rows.append({
+                "id": sale_id,
+                "store_id": store_id,
+                # El total sale de los ítems que quedaron en la venta, no del pedido crudo
+                "total_amount": round(sum(item["total_price"] for item in items), 2),
+                "payment_method": "whatsapp",
+                "customer_name": order.customer_name,
+                "customer_phone": order.customer_phone,
+                "delivery_status": "draft",
+                "delivery_cost": 0.0,
+                "created_at": order.received_at,
+                "whatsapp_message_id": order.message_id,
+                "notification_sent": False,
+            })
+            item_rows.extend(items)
+
+        db.execute(insert(Sale.__table__), sale_rows)
+        if item_rows:
+            db.execute(insert(SaleItem.__table__), item_rows)
+        # Los INSERT de Core no pasan por los eventos del ORM: se registran a mano en el journal
+        by_store: Dict[str, List[str]] = {}
+        for row in sale_rows:
+            by_store.setdefault(row["store_id"], []).append(row["id"])
+        for store_id, sale_ids in by_store.items():
+            sync_journal.record(db, store_id, "sale", sale_ids)
+        db.commit()
+
+        MESSAGES.inc("order", amount=len(sale_rows))
+        DRAFTS_CREATED.inc(amount=len(sale_rows))
+        return len(sale_rows)
+
+
+whatsapp_ingestor = WhatsAppIngestor(workers=int(os.getenv("WHATSAPP_INGEST_WORKERS", "2")))
+app_secret = os.getenv("WHATSAPP_APP_SECRET")
+
+Gauge("nordia_whatsapp_ingest_queue_depth", "Payloads de WhatsApp pendientes de procesar",
+      callback=lambda: whatsapp_ingestor.queue.qsize())
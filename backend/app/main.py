@@ -1,39 +1,86 @@
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
 import asyncio
+import orjson
 from typing import Optional
 
 from .core.database import get_db, engine, Base
-from .core.auth import verify_token
+from .core.auth import get_current_user, listen_invalidations
+from .core.compression import CompressionMiddleware
+from .core.metrics import MetricsMiddleware, REGISTRY, profiler
+from .core.health import (
+    health_monitor, database_probe, neural_engine_probe, pubsub_probe, redis_probe, config_probe, circuit_probe
+)
+from .core.pubsub import pubsub
+from .core.consent import consent_cache
+from .core.inventory import stock_writer
 from .neural.engine import NeuralEngine
-from .integrations.whatsapp import WhatsAppService
-from .integrations.mercadopago import MercadoPagoService
-from .routers import pos, insights, products, sales, analytics, auth, consent
+from .integrations.whatsapp_inbound import whatsapp_ingestor, app_secret as whatsapp_app_secret, verify_signature
+from .integrations.payments import mercadopago, reconciler, webhook_secret, verify_webhook_signature
+from .routers import pos, insights, products, sales, analytics, auth, consent, sync
 
 # Initialize neural engine
 neural_engine = NeuralEngine()
 
+# Probes de salud: corren en background y /health solo lee el último resultado
+health_monitor.add_probe("database", database_probe(engine))
+health_monitor.add_probe("neural_engine", neural_engine_probe(neural_engine, max_stage_age=900), critical=False)
+health_monitor.add_probe("pubsub", pubsub_probe(pubsub), critical=False)
+health_monitor.add_probe("redis", redis_probe(pubsub), critical=False)
+health_monitor.add_probe("whatsapp", config_probe("WHATSAPP_TOKEN", "WHATSAPP_PHONE_NUMBER_ID"), critical=False)
+health_monitor.add_probe("mercadopago", circuit_probe(mercadopago.breaker, "MERCADOPAGO_ACCESS_TOKEN"), critical=False)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     Base.metadata.create_all(bind=engine)
+    await pubsub.start()
+    await consent_cache.start()
+    auth_listener = asyncio.create_task(listen_invalidations())
+    await reconciler.start()
+    await whatsapp_ingestor.start()
+    await stock_writer.start()
+    if profiler is not None:
+        profiler.start()
     await neural_engine.initialize()
     print("🧠 Nordia Neural Engine initialized")
+    await health_monitor.start()
     yield
     # Shutdown
+    await health_monitor.stop()
     await neural_engine.cleanup()
+    await stock_writer.stop()
+    await whatsapp_ingestor.stop()
+    await reconciler.stop()
+    await mercadopago.close()
+    await consent_cache.stop()
+    auth_listener.cancel()
+    try:
+        await auth_listener
+    except asyncio.CancelledError:
+        pass
+    await pubsub.stop()
+    if profiler is not None:
+        profiler.stop()
     print("🧠 Nordia Neural Engine cleaned up")
 
 app = FastAPI(
     title="Nordia Neural API",
     description="API para la red neural comercial de PyMEs",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Compresión gzip/brotli para payloads grandes (catálogo, ventas, sync)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+# Latencias por ruta y requests lentos (se agrega último para medir también la compresión)
+app.add_middleware(MetricsMiddleware)
+
 # CORS para PWA
 app.add_middleware(
     CORSMiddleware,
@@ -47,16 +94,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Security
-security = HTTPBearer()
-
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    user = await verify_token(token)
-    if not user:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    return user
-
 # Include routers
 app.include_router(auth.router)
 app.include_router(pos.router)
@@ -65,6 +102,7 @@ app.include_router(products.router)
 app.include_router(sales.router)
 app.include_router(analytics.router)
 app.include_router(consent.router)
+app.include_router(sync.router)
 
 @app.get("/")
 async def root():
@@ -76,27 +114,97 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {
-        "status": "healthy",
-        "neural_engine": neural_engine.is_healthy(),
-        "database": "connected",
+    """Último resultado de los probes (cacheado); 503 si el worker está unhealthy"""
+    snapshot = health_monitor.snapshot
+    checks = snapshot["checks"]
+    body = {
+        "status": snapshot["status"],
         "version": "1.0.0",
+        "checked_at": snapshot["checked_at"],
+        "neural_engine": neural_engine.is_healthy(),
+        "database": checks.get("database", {}),
         "services": {
-            "whatsapp": True,  # TODO: Check WhatsApp API status
-            "mercadopago": True,  # TODO: Check MercadoPago API status
+            "whatsapp": checks.get("whatsapp", {}).get("ok", False),
+            "mercadopago": checks.get("mercadopago", {}).get("ok", False),
             "neural_processing": neural_engine.is_running
-        }
+        },
+        "checks": checks
     }
+    return ORJSONResponse(body, status_code=200 if health_monitor.is_ready else 503)
+
+@app.get("/health/live")
+async def liveness():
+    """El proceso responde: si el event loop estuviera trabado no llegaríamos acá"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Listo para recibir tráfico según el último snapshot de probes"""
+    ready = health_monitor.is_ready
+    return ORJSONResponse(
+        {"ready": ready, "status": health_monitor.snapshot["status"]},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Métricas en formato Prometheus"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.post("/api/webhook/whatsapp")
-async def whatsapp_webhook(data: dict, background_tasks: BackgroundTasks):
+async def whatsapp_webhook(request: Request):
     """
-    Webhook para recibir mensajes de WhatsApp Business
+    Webhook para recibir mensajes de WhatsApp Business. Valida la firma y solo
+    encola el payload: los pedidos se procesan en lote en background.
     """
-    whatsapp_service = WhatsAppService()
-    background_tasks.add_task(whatsapp_service.handle_incoming_message, data)
+    raw = await request.body()
+    if whatsapp_app_secret and not verify_signature(
+        whatsapp_app_secret, raw, request.headers.get("x-hub-signature-256")
+    ):
+        raise HTTPException(status_code=401, detail="Firma inválida")
+    try:
+        data = orjson.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body JSON inválido")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Body JSON inválido")
+
+    if not whatsapp_ingestor.submit(data):
+        # Cola llena: WhatsApp reintenta las entregas que no reciben 200
+        raise HTTPException(status_code=503, detail="Ocupado, reintentar")
     return {"status": "received"}
 
+@app.post("/api/webhook/mercadopago")
+async def mercadopago_webhook(request: Request):
+    """
+    Notificaciones de pagos de MercadoPago. Solo se encola el id y se responde
+    enseguida; el reconciliador consulta el estado y actualiza en lote.
+    """
+    params = request.query_params
+    try:
+        body = await request.json() if await request.body() else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body JSON inválido")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Body JSON inválido")
+    topic = body.get("type") or params.get("type") or params.get("topic")
+    payment_id = (body.get("data") or {}).get("id") or params.get("data.id") or params.get("id")
+    if topic != "payment" or not payment_id:
+        return {"status": "ignored"}
+
+    if webhook_secret and not verify_webhook_signature(
+        webhook_secret,
+        request.headers.get("x-signature", ""),
+        request.headers.get("x-request-id", ""),
+        str(payment_id)
+    ):
+        raise HTTPException(status_code=401, detail="Firma inválida")
+
+    if not reconciler.notify(str(payment_id)):
+        # Cola llena: MercadoPago reintenta las notificaciones no aceptadas
+        raise HTTPException(status_code=503, detail="Ocupado, reintentar")
+    return {"status": "queued"}
+
 @app.get("/api/webhook/whatsapp")
 async def whatsapp_webhook_verify(
     hub_mode: str = None,
@@ -0,0 +1,107 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+@dataclass(slots=True)
+class SaleItemRow:
+    """Item de venta compacto para caminos calientes (sin validación de Pydantic)"""
+    product_id: str
+    product_name: str
+    quantity: int
+    unit_price: float
+    total_price: float
+
+
+@dataclass(slots=True)
+class SaleRow:
+    """Venta compacta; Pydantic se usa solo al entrar y salir de la API"""
+    id: str
+    store_id: str
+    items: Tuple[SaleItemRow, ...]
+    total: float
+    payment_method: str
+    timestamp: datetime
+    customer_info: Optional[dict] = None
+    payment_status: Optional[str] = None  # Cobro online: lo actualiza el reconciliador de pagos
+
+
+class SalesLedger:
+    """
+    Ventas en memoria: filas compactas más columnas de totales y timestamps
+    (array) ordenadas por tiempo, para agregar por rango sin recorrer objetos.
+    """
+
+    def __init__(self):
+        self.rows: List[SaleRow] = []
+        self.totals = array("d")
+        self.timestamps = array("d")
+        self._index: Dict[str, SaleRow] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[SaleRow]:
+        return iter(self.rows)
+
+    def append(self, row: SaleRow):
+        ts = row.timestamp.timestamp()
+        if self.timestamps and ts < self.timestamps[-1]:
+            # Reloj atrasado: insertar en orden para no romper la búsqueda binaria
+            pos = bisect_right(self.timestamps, ts)
+            self.rows.insert(pos, row)
+            self.totals.insert(pos, row.total)
+            self.timestamps.insert(pos, ts)
+        else:
+            self.rows.append(row)
+            self.totals.append(row.total)
+            self.timestamps.append(ts)
+        self._index[row.id] = row
+
+    def get(self, sale_id: str) -> Optional[SaleRow]:
+        return self._index.get(sale_id)
+
+    def _range(self, start: datetime, end: datetime) -> slice:
+        return slice(
+            bisect_left(self.timestamps, start.timestamp()),
+            bisect_left(self.timestamps, end.timestamp())
+        )
+
+    def between(self, start: datetime, end: datetime) -> List[SaleRow]:
+        """Ventas con timestamp en [start, end)"""
+        return self.rows[self._range(start, end)]
+
+    def revenue(self, start: datetime, end: datetime) -> Tuple[float, int]:
+        """Facturación y cantidad de ventas en [start, end)"""
+        totals = self.totals[self._range(start, end)]
+        return sum(totals), len(totals)
+
+
+class StoreLedgers:
+    """
+    Un SalesLedger por comercio: listar y agregar las ventas de un comercio
+    no recorre las de los demás. Las ventas también se buscan por id.
+    """
+
+    def __init__(self):
+        self._ledgers: Dict[str, SalesLedger] = {}
+        self._index: Dict[str, SaleRow] = {}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def append(self, row: SaleRow):
+        ledger = self._ledgers.get(row.store_id)
+        if ledger is None:
+            ledger = self._ledgers[row.store_id] = SalesLedger()
+        ledger.append(row)
+        self._index[row.id] = row
+
+    def get(self, sale_id: str) -> Optional[SaleRow]:
+        return self._index.get(sale_id)
+
+    def for_store(self, store_id: str) -> SalesLedger:
+        """Ledger del comercio (uno vacío si todavía no vendió nada)"""
+        return self._ledgers.get(store_id) or SalesLedger()
@@ -1,10 +1,10 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, JSON
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text, JSON, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
 
-Base = declarative_base()
+# Misma Base que core.database, para que create_all en el arranque cree estas tablas
+from ..core.database import Base
 
 class Store(Base):
     __tablename__ = "stores"
@@ -88,13 +88,16 @@ class Sale(Base):
     customer_name = Column(String(100))
     customer_phone = Column(String(20))
     delivery_address = Column(String(200))
-    delivery_status = Column(String(30), default="pending")  # pending, preparing, shipped, delivered
+    delivery_status = Column(String(30), default="pending")  # draft (pedido de WhatsApp), pending, preparing, shipped, delivered
     delivery_cost = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
     delivered_at = Column(DateTime)
     
+    # Estado del cobro online (MercadoPago): pending, approved, rejected, etc.
+    payment_status = Column(String(30))
+    
     # WhatsApp integration
-    whatsapp_message_id = Column(String(100))
+    whatsapp_message_id = Column(String(100), index=True, unique=True)  # Dedup entre workers
     notification_sent = Column(Boolean, default=False)
     
     # Neural data
@@ -105,6 +108,22 @@ class Sale(Base):
     store = relationship("Store", back_populates="sales")
     items = relationship("SaleItem", back_populates="sale")
 
+class Payment(Base):
+    __tablename__ = "payments"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    # Sin FK: también se cobran ventas de la caja que todavía no están en la base
+    sale_id = Column(String, nullable=False, unique=True)  # Una venta, un cobro
+    store_id = Column(String)
+    idempotency_key = Column(String(64), nullable=False, unique=True)
+    provider = Column(String(30), default="mercadopago")
+    provider_payment_id = Column(String(50), index=True)
+    amount = Column(Float, nullable=False)
+    status = Column(String(30), default="pending", index=True)  # pending, in_process, approved, rejected, cancelled, refunded
+    status_detail = Column(String(200))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class SaleItem(Base):
     __tablename__ = "sale_items"
     
@@ -119,6 +138,21 @@ class SaleItem(Base):
     sale = relationship("Sale", back_populates="items")
     product = relationship("Product", back_populates="sale_items")
 
+class InventoryMovement(Base):
+    __tablename__ = "inventory_movements"
+    __table_args__ = (Index("ix_inventory_movements_product_created", "product_id", "created_at"),)
+    
+    # Libro de movimientos de stock: solo se agregan filas, nunca se editan ni borran
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    store_id = Column(String, ForeignKey("stores.id"), nullable=False)
+    product_id = Column(String, ForeignKey("products.id"), nullable=False)
+    sale_id = Column(String)  # Sin FK: las ventas de la caja pueden no estar en la base
+    quantity = Column(Integer, nullable=False)  # Negativo = salida (venta), positivo = entrada
+    stock_after = Column(Integer, nullable=False)
+    shortfall = Column(Integer, nullable=False, default=0)  # Unidades vendidas sin stock (el stock no baja de 0)
+    reason = Column(String(20), nullable=False)  # sale, restock, adjustment
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Insight(Base):
     __tablename__ = "insights"
     
@@ -149,11 +183,35 @@ class NetworkEvent(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     processed = Column(Boolean, default=False)
 
+class SyncVersion(Base):
+    __tablename__ = "sync_versions"
+
+    # Versión monotónica de sincronización por comercio; la fila se bloquea hasta el commit de cada cambio
+    store_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    floor = Column(Integer, nullable=False, default=0)  # Tombstones compactados hasta esta versión
+    epoch = Column(String(12), nullable=False)  # Cambia si se recrea la fila: los clientes hacen resync completo
+
+class SyncChange(Base):
+    __tablename__ = "sync_changes"
+    __table_args__ = (
+        UniqueConstraint("store_id", "entity", "entity_id", name="uq_sync_changes_entity"),
+        Index("ix_sync_changes_store_version", "store_id", "version"),
+    )
+
+    # Último cambio de cada entidad sincronizable; los datos se leen de su tabla al sincronizar
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    store_id = Column(String, nullable=False)
+    entity = Column(String(20), nullable=False)  # product, sale, insight
+    entity_id = Column(String, nullable=False)
+    version = Column(Integer, nullable=False)
+    deleted = Column(Boolean, default=False, nullable=False)  # Tombstone
+
 class DataConsent(Base):
     __tablename__ = "data_consents"
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    store_id = Column(String, ForeignKey("stores.id"), nullable=False)
+    store_id = Column(String, ForeignKey("stores.id"), nullable=False, unique=True)  # Una fila por comercio
     
     # Consentimientos específicos
     sales_volume = Column(Boolean, default=True)
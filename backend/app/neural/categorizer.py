@@ -0,0 +1,253 @@
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..core.metrics import Gauge, record_cache
+
+FALLBACK_CATEGORY = "otros"
+
+# Palabras clave de alta precisión, en este orden de prioridad. Se buscan como
+# palabra entera (admiten plural): "pan" no matchea "pañales" ni "panchos"
+KEYWORDS = {
+    "bebidas": ["coca", "pepsi", "agua", "cerveza", "vino", "jugo"],
+    "lacteos": ["leche", "yogur", "yogurt", "queso", "manteca"],
+    "panaderia": ["pan", "factura", "torta", "galleta", "galletita"],
+    "almacen": ["arroz", "aceite", "azucar", "sal", "fideos"],
+    "limpieza": ["lavandina", "detergente", "jabon", "papel"],
+    "cigarrillos": ["marlboro", "philip", "parlament"],
+    "golosinas": ["chocolate", "caramelo", "chicle", "alfajor"],
+}
+# El modelo solo aprende estas etiquetas: las categorías libres de cada
+# comercio no se filtran a los datos anonimizados
+TAXONOMY = tuple(KEYWORDS)
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_name(name: str) -> str:
+    """Minúsculas, sin acentos ni puntuación: 'Café La Virginia 500g' -> 'cafe la virginia 500g'"""
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode()
+    return _NON_WORD.sub(" ", ascii_name.lower()).strip()
+
+
+def normalize_label(category: str) -> str:
+    """Las categorías de Product vienen con mayúsculas y acentos ('Lácteos')"""
+    return normalize_name(category).replace(" ", "_")
+
+
+def _compile_keywords(keywords: Dict[str, List[str]]) -> re.Pattern:
+    """Un solo regex con un grupo nombrado por categoría; `lastgroup` dice cuál matcheó"""
+    groups = []
+    for category, words in keywords.items():
+        alternatives = "|".join(re.escape(normalize_name(w)) for w in words)
+        groups.append(f"(?P<{category}>{alternatives})")
+    return re.compile(r"\b(?:" + "|".join(groups) + r")(?:es|s)?\b")
+
+
+class HashingVectorizer:
+    """
+    Palabras + trigramas de caracteres hasheados a `n_features` columnas
+    (crc32, estable entre procesos). Filas normalizadas L2. Devuelve la
+    matriz dispersa como (filas, columnas, valores) para operar en NumPy.
+    """
+
+    def __init__(self, n_features: int = 1 << 16):
+        self.n_features = n_features
+        self._token_features = lru_cache(maxsize=65536)(self._hash_token)
+
+    def _hash_token(self, token: str) -> Tuple[int, ...]:
+        padded = f" {token} "
+        grams = [f"w:{token}"] + [padded[i:i + 3] for i in range(len(padded) - 2)]
+        return tuple(zlib.crc32(g.encode()) % self.n_features for g in grams)
+
+    def transform(self, names: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rows, cols = [], []
+        for i, name in enumerate(names):
+            for token in name.split():
+                features = self._token_features(token)
+                cols.extend(features)
+                rows.extend([i] * len(features))
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.ones(len(cols), dtype=np.float32)
+        norms = np.sqrt(np.bincount(rows, minlength=len(names))).astype(np.float32)
+        values /= np.where(norms[rows] > 0, norms[rows], 1)
+        return rows, cols, values
+
+
+class LinearCategoryModel:
+    """Regresión logística multinomial sobre features hasheados, entrenada con SGD en NumPy"""
+
+    def __init__(self, vectorizer: HashingVectorizer, labels: List[str], weights: np.ndarray, bias: np.ndarray):
+        self.vectorizer = vectorizer
+        self.labels = labels
+        self.weights = weights
+        self.bias = bias
+
+    def _scores(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+        scores = np.tile(self.bias, (size, 1))
+        np.add.at(scores, rows, self.weights[cols] * values[:, None])
+        return scores
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        scores = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(scores)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, names: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """Categoría más probable y su probabilidad para cada nombre normalizado"""
+        if not names:
+            return [], np.zeros(0, dtype=np.float32)
+        probs = self._softmax(self._scores(*self.vectorizer.transform(names), len(names)))
+        best = probs.argmax(axis=1)
+        return [self.labels[i] for i in best], probs[np.arange(len(names)), best]
+
+    @classmethod
+    def train(cls, names: Sequence[str], labels: Sequence[str], vectorizer: HashingVectorizer,
+              epochs: int = 15, batch_size: int = 32, learning_rate: float = 1.0,
+              l2: float = 1e-5, seed: int = 7) -> "LinearCategoryModel":
+        classes = sorted(set(labels))
+        index = {label: i for i, label in enumerate(classes)}
+        y = np.array([index[label] for label in labels], dtype=np.int64)
+        weights = np.zeros((vectorizer.n_features, len(classes)), dtype=np.float32)
+        bias = np.zeros(len(classes), dtype=np.float32)
+        model = cls(vectorizer, classes, weights, bias)
+
+        rng = np.random.default_rng(seed)
+        names = list(names)
+        for _ in range(epochs):
+            order = rng.permutation(len(names))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                rows, cols, values = vectorizer.transform([names[i] for i in batch])
+                probs = cls._softmax(model._scores(rows, cols, values, len(batch)))
+                probs[np.arange(len(batch)), y[batch]] -= 1  # gradiente de la cross-entropy
+                probs /= len(batch)
+                # Solo se actualizan las columnas presentes en el batch
+                unique_cols, inverse = np.unique(cols, return_inverse=True)
+                gradient = np.zeros((len(unique_cols), len(classes)), dtype=np.float32)
+                np.add.at(gradient, inverse, probs[rows] * values[:, None])
+                weights[unique_cols] -= learning_rate * (gradient + l2 * weights[unique_cols])
+                bias -= learning_rate * probs.sum(axis=0)
+        return model
+
+
+class ProductCategorizer:
+    """
+    Categoriza nombres de productos: primero palabras clave (regex compilado),
+    si no matchea el modelo lineal entrenado con las categorías que cargaron
+    los comercios de la red, y si no confía lo suficiente "otros". Los
+    resultados se memorizan por nombre normalizado en un LRU acotado.
+    """
+
+    def __init__(self, keywords: Dict[str, List[str]] = KEYWORDS, min_confidence: float = 0.6,
+                 memo_size: int = 50000):
+        self.pattern = _compile_keywords(keywords)
+        self.min_confidence = min_confidence
+        self.memo_size = memo_size
+        self.vectorizer = HashingVectorizer()
+        self.model: Optional[LinearCategoryModel] = None
+        self.trained_at: Optional[float] = None
+        self._memo: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def memo_len(self) -> int:
+        return len(self._memo)
+
+    def categorize(self, name: str) -> str:
+        return self.categorize_many([name])[0]
+
+    def categorize_many(self, names: Iterable[str]) -> List[str]:
+        """Categoriza un lote; solo los nombres nuevos pasan por el regex y el modelo"""
+        normalized = [normalize_name(name) for name in names]
+        results: List[Optional[str]] = []
+        misses: Dict[str, None] = {}
+        with self._lock:
+            for key in normalized:
+                category = self._memo.get(key)
+                if category is not None:
+                    self._memo.move_to_end(key)
+                else:
+                    misses[key] = None
+                results.append(category)
+        record_cache("categorizer", True, len(normalized) - sum(r is None for r in results))
+        record_cache("categorizer", False, sum(r is None for r in results))
+        if not misses:
+            return results
+
+        resolved = self._resolve(list(misses))
+        with self._lock:
+            for key, category in resolved.items():
+                self._memo[key] = category
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return [category if category is not None else resolved[key] for key, category in zip(normalized, results)]
+
+    def _resolve(self, keys: List[str]) -> Dict[str, str]:
+        resolved, pending = {}, []
+        for key in keys:
+            match = self.pattern.search(key)
+            if match:
+                resolved[key] = match.lastgroup
+            else:
+                pending.append(key)
+
+        model = self.model
+        if model is not None and pending:
+            labels, confidence = model.predict(pending)
+            for key, label, score in zip(pending, labels, confidence):
+                resolved[key] = label if score >= self.min_confidence else FALLBACK_CATEGORY
+        else:
+            resolved.update((key, FALLBACK_CATEGORY) for key in pending)
+        return resolved
+
+    def fit(self, names: Sequence[str], categories: Sequence[str], min_samples: int = 50) -> int:
+        """
+        Entrena con pares (nombre, categoría) y reemplaza el modelo. Devuelve
+        cuántos nombres distintos se usaron (0 si no alcanza para entrenar).
+        Las categorías fuera de TAXONOMY se ignoran.
+        """
+        # Un nombre, una etiqueta: la más frecuente entre los comercios que lo cargaron
+        votes: Dict[str, Dict[str, int]] = {}
+        for name, category in zip(names, categories):
+            key, label = normalize_name(name), normalize_label(category or "")
+            if key and label in TAXONOMY:
+                counts = votes.setdefault(key, {})
+                counts[label] = counts.get(label, 0) + 1
+        training = [(key, max(counts, key=counts.get)) for key, counts in votes.items()]
+        if len(training) < min_samples or len({label for _, label in training}) < 2:
+            return 0
+
+        model = LinearCategoryModel.train([k for k, _ in training], [l for _, l in training], self.vectorizer)
+        with self._lock:
+            self.model = model
+            self.trained_at = time.time()
+            # Los resultados memorizados con el modelo anterior ya no valen
+            self._memo.clear()
+        return len(training)
+
+    def fit_from_db(self, db: Session, limit: int = 200000) -> int:
+        rows = db.execute(text("""
+            SELECT name, category FROM products
+            WHERE category IS NOT NULL AND category != ''
+            ORDER BY updated_at DESC
+            LIMIT :limit
+        """), {"limit": limit}).fetchall()
+        return self.fit([r.name for r in rows], [r.category for r in rows])
+
+
+categorizer = ProductCategorizer()
+
+Gauge("nordia_categorizer_memo_entries", "Nombres de productos memorizados por el categorizador",
+      callback=lambda: categorizer.memo_len)
@@ -1,16 +1,42 @@
 import asyncio
+import time
 import numpy as np
 import pandas as pd
 import hashlib
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, inspect
+from fastapi.encoders import jsonable_encoder
 
 from ..core.database import get_db
+from ..core.pubsub import pubsub
+from ..core.consent import consent_cache, mask_columns
+from .categorizer import categorizer
+from ..core.metrics import Counter, Gauge, Histogram
 from ..models.models import Store, Product, Sale, Insight, NetworkEvent, AnonymizedData
 from ..integrations.whatsapp import WhatsAppService
 
+STAGE_LATENCY = Histogram("nordia_neural_stage_duration_seconds", "Duración de cada etapa del motor neural", ("stage",))
+STAGE_ROWS = Counter("nordia_neural_stage_rows_total", "Filas procesadas por etapa", ("stage",))
+STAGE_ERRORS = Counter("nordia_neural_stage_errors_total", "Etapas que terminaron con error", ("stage",))
+STAGE_LAST_SUCCESS = Gauge(
+    "nordia_neural_stage_last_success_timestamp_seconds", "Última ejecución exitosa de cada etapa", ("stage",)
+)
+INSIGHTS_PUBLISHED = Counter("nordia_insights_published_total", "Insights creados y publicados a las cajas")
+
+# Qué consentimiento habilita cada campo anonimizado; sin él se enmascara
+ANONYMIZED_FIELD_CONSENT = {
+    "product_category": "product_categories",
+    "price_range": "price_ranges",
+    "quantity_range": "sales_volume",
+    "time_segment": "time_patterns",
+    "day_of_week": "time_patterns",
+    "is_weekend": "time_patterns",
+}
+# product_category no admite NULL: se usa la categoría genérica
+MASKED_VALUES = {"product_category": "otros"}
+
 class NeuralEngine:
     """
     Motor neural de Nordia que procesa datos anónimos y genera insights colectivos
@@ -23,6 +49,11 @@ class NeuralEngine:
         self.whatsapp = WhatsAppService()
         self.salt = "nordia_neural_salt_2025"
         self.aggregation_threshold = 5  # Mínimo 5 comercios para publicar insights
+        self.stage_last_success: Dict[str, float] = {}
+        self.categorizer_retrain_interval = 6 * 3600  # segundos
+        self.categorizer_retry_delay = 600  # primer reintento si no hubo datos para entrenar
+        self._categorizer_next_train = 0.0
+        self._categorizer_failures = 0
         
     async def initialize(self):
         """Inicializa el motor neural"""
@@ -39,43 +70,88 @@ class NeuralEngine:
         
     async def neural_processing_loop(self):
         """Loop principal que ejecuta análisis neural cada 5 minutos"""
+        stages = (
+            self.train_categorizer,
+            self.process_network_insights,
+            self.detect_market_anomalies,
+            self.update_price_recommendations,
+            self.predict_stock_needs,
+        )
         while self.is_running:
             try:
-                await self.process_network_insights()
-                await self.detect_market_anomalies()
-                await self.update_price_recommendations()
-                await self.predict_stock_needs()
+                for stage in stages:
+                    await self._run_stage(stage)
                 await asyncio.sleep(300)  # 5 minutos
             except Exception as e:
                 print(f"Error in neural processing: {e}")
                 await asyncio.sleep(60)  # Retry en 1 minuto si hay error
     
+    async def _run_stage(self, stage):
+        """Ejecuta una etapa registrando duración, filas procesadas y último éxito"""
+        name = stage.__name__
+        started = time.perf_counter()
+        try:
+            rows = await stage()
+        except Exception:
+            STAGE_ERRORS.inc(name)
+            raise
+        finally:
+            STAGE_LATENCY.observe(time.perf_counter() - started, name)
+        STAGE_ROWS.inc(name, amount=rows or 0)
+        self.stage_last_success[name] = time.time()
+        STAGE_LAST_SUCCESS.set(self.stage_last_success[name], name)
+    
     def anonymize_sale(self, sale_data: Dict) -> Dict:
         """
         Anonimiza una venta individual manteniendo valor analítico
         """
-        # Generar ID anónimo consistente para el comercio
-        store_hash = hashlib.sha256(
-            (sale_data["store_id"] + self.salt).encode()
-        ).hexdigest()[:12]
+        return self.anonymize_sales([sale_data])[0]
+    
+    def anonymize_sales(self, sales: List[Dict]) -> List[Dict]:
+        """
+        Anonimiza un lote de ventas por columnas y enmascara los campos que cada
+        comercio no consintió compartir (consentimientos del cache en memoria)
+        """
+        if not sales:
+            return []
         
-        # Categorizar productos sin nombres específicos
-        product_category = self._categorize_product(sale_data.get("product_name", ""))
+        store_ids = [sale["store_id"] for sale in sales]
+        # Hash y categoría se calculan una vez por valor distinto, no por fila
+        store_hashes = {
+            store_id: hashlib.sha256((store_id + self.salt).encode()).hexdigest()[:12]
+            for store_id in set(store_ids)
+        }
+        names = [sale.get("product_name", "") for sale in sales]
+        unique_names = list(set(names))
+        categories = dict(zip(unique_names, categorizer.categorize_many(unique_names)))
         
-        # Segmentar tiempo y ubicación
-        time_segment = self._get_time_segment(sale_data["timestamp"])
-        geo_segment = self._get_geo_segment(sale_data.get("store_location", {}))
+        prices = np.fromiter((sale["price"] for sale in sales), dtype=np.float64, count=len(sales))
+        quantities = np.fromiter((sale["quantity"] for sale in sales), dtype=np.int64, count=len(sales))
+        hours = np.fromiter((sale["timestamp"].hour for sale in sales), dtype=np.int64, count=len(sales))
+        weekdays = np.fromiter((sale["timestamp"].weekday() for sale in sales), dtype=np.int64, count=len(sales))
         
-        return {
-            "anonymous_store_id": store_hash,
-            "product_category": product_category,
-            "price_range": self._get_price_range(sale_data["price"]),
-            "quantity_range": self._get_quantity_range(sale_data["quantity"]),
-            "time_segment": time_segment,
-            "geo_segment": geo_segment,
-            "day_of_week": sale_data["timestamp"].weekday(),
-            "is_weekend": sale_data["timestamp"].weekday() >= 5
+        columns = {
+            "anonymous_store_id": np.array([store_hashes[s] for s in store_ids], dtype=object),
+            "product_category": np.array([categories[n] for n in names], dtype=object),
+            # Mismos cortes que _get_price_range, _get_quantity_range y _get_time_segment
+            "price_range": np.select(
+                [prices < 500, prices < 2000, prices < 5000], ["bajo", "medio", "alto"], "premium"
+            ).astype(object),
+            "quantity_range": np.select(
+                [quantities == 1, quantities <= 5, quantities <= 20], ["unitario", "pequeño", "mediano"], "mayorista"
+            ).astype(object),
+            "time_segment": np.select(
+                [(hours >= 6) & (hours < 12), (hours >= 12) & (hours < 18), (hours >= 18) & (hours < 22)],
+                ["mañana", "tarde", "noche"], "madrugada"
+            ).astype(object),
+            "geo_segment": np.array([self._get_geo_segment(sale.get("store_location", {})) for sale in sales], dtype=object),
+            "day_of_week": weekdays.astype(object),
+            "is_weekend": (weekdays >= 5).astype(object),
         }
+        
+        masked = mask_columns(columns, consent_cache.bits_for(store_ids), ANONYMIZED_FIELD_CONSENT, MASKED_VALUES)
+        fields = list(masked)
+        return [dict(zip(fields, row)) for row in zip(*(masked[f].tolist() for f in fields))]
     
     async def generate_market_insights(self, db: Session, geo_area: str) -> List[Dict]:
         """
@@ -116,8 +192,36 @@ class NeuralEngine:
         
         return insights
     
-    async def process_network_insights(self):
-        """Procesa eventos de la red para generar insights"""
+    async def train_categorizer(self) -> int:
+        """Reentrena el categorizador con las categorías cargadas en la red; devuelve nombres usados"""
+        now = time.time()
+        if now < self._categorizer_next_train:
+            return 0
+        
+        def train() -> int:
+            db = next(get_db())
+            try:
+                return categorizer.fit_from_db(db)
+            finally:
+                db.close()
+        
+        # Entrenar es CPU puro: fuera del event loop
+        used = 0
+        try:
+            used = await asyncio.to_thread(train)
+        finally:
+            if used:
+                self._categorizer_failures = 0
+                self._categorizer_next_train = now + self.categorizer_retrain_interval
+            else:
+                # Sin datos suficientes (o con error) se espera cada vez más, no en cada vuelta del loop
+                delay = self.categorizer_retry_delay * 2 ** self._categorizer_failures
+                self._categorizer_failures += 1
+                self._categorizer_next_train = now + min(delay, self.categorizer_retrain_interval)
+        return used
+    
+    async def process_network_insights(self) -> int:
+        """Procesa eventos de la red para generar insights; devuelve cuántos eventos procesó"""
         db = next(get_db())
         
         try:
@@ -130,7 +234,8 @@ class NeuralEngine:
                 await self.analyze_network_event(event, db)
                 event.processed = True
                 
-            db.commit()
+            self._commit_and_publish(db)
+            return len(unprocessed_events)
             
         except Exception as e:
             db.rollback()
@@ -199,7 +304,7 @@ class NeuralEngine:
             SELECT s.id, s.name, s.phone, p.stock, p.price, p.name as product_name
             FROM stores s
             JOIN products p ON s.id = p.store_id
-            WHERE p.name ILIKE (SELECT name FROM products WHERE id = :product_id)
+            WHERE LOWER(p.name) = (SELECT LOWER(name) FROM products WHERE id = :product_id)
             AND p.stock > 0
             AND s.id != :source_store_id
             AND s.category = (SELECT category FROM stores WHERE id = :source_store_id)
@@ -231,8 +336,41 @@ class NeuralEngine:
                 )
                 db.add(insight)
     
-    async def predict_stock_needs(self):
-        """Predice necesidades de stock basado en patrones de venta"""
+    async def alert_demand_spike(self, event: NetworkEvent, db: Session):
+        """Avisa a comercios del mismo rubro que venden el producto que su demanda está subiendo"""
+        
+        stores_with_product = db.execute(text("""
+            SELECT s.id, p.stock, p.name as product_name
+            FROM stores s
+            JOIN products p ON s.id = p.store_id
+            WHERE LOWER(p.name) = (SELECT LOWER(name) FROM products WHERE id = :product_id)
+            AND s.id != :source_store_id
+            AND s.category = (SELECT category FROM stores WHERE id = :source_store_id)
+            ORDER BY p.stock ASC
+            LIMIT 5
+        """), {
+            "product_id": event.product_id,
+            "source_store_id": event.source_store_id
+        }).fetchall()
+        
+        for store_data in stores_with_product:
+            insight = Insight(
+                store_id=store_data.id,
+                type="demand_spike",
+                title="Demanda en alza",
+                message=f"La demanda de {store_data.product_name} está subiendo en comercios de tu zona. Tenés {store_data.stock} unidades.",
+                actionable=True,
+                priority="high" if store_data.stock == 0 else "medium",
+                data={
+                    "product_name": store_data.product_name,
+                    "current_stock": store_data.stock,
+                    "suggested_action": "increase_stock"
+                }
+            )
+            db.add(insight)
+    
+    async def predict_stock_needs(self) -> int:
+        """Predice necesidades de stock basado en patrones de venta; devuelve productos analizados"""
         db = next(get_db())
         
         try:
@@ -271,7 +409,8 @@ class NeuralEngine:
                 )
                 db.add(insight)
                 
-            db.commit()
+            self._commit_and_publish(db)
+            return len(low_stock_products)
             
         except Exception as e:
             db.rollback()
@@ -279,6 +418,19 @@ class NeuralEngine:
         finally:
             db.close()
     
+    def _commit_and_publish(self, db: Session):
+        """Commitea la sesión y empuja en tiempo real los insights nuevos a las cajas"""
+        new_insights = [obj for obj in db.new if isinstance(obj, Insight)]
+        db.flush()
+        payloads = [
+            jsonable_encoder({attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs})
+            for obj in new_insights
+        ]
+        db.commit()
+        for payload in payloads:
+            pubsub.publish("insights", payload["store_id"], payload)
+        INSIGHTS_PUBLISHED.inc(amount=len(payloads))
+    
     async def detect_market_anomalies(self):
         """Detecta anomalías en patrones de mercado"""
         # TODO: Implementar detección de anomalías
@@ -291,22 +443,7 @@ class NeuralEngine:
     
     def _categorize_product(self, product_name: str) -> str:
         """Categoriza productos sin revelar nombres específicos"""
-        categories = {
-            "bebidas": ["coca", "pepsi", "agua", "cerveza", "vino", "jugo"],
-            "lacteos": ["leche", "yogur", "queso", "manteca"],
-            "panaderia": ["pan", "factura", "torta", "galleta"],
-            "almacen": ["arroz", "aceite", "azucar", "sal", "fideos"],
-            "limpieza": ["lavandina", "detergente", "jabon", "papel"],
-            "cigarrillos": ["marlboro", "philip", "parlament"],
-            "golosinas": ["chocolate", "caramelo", "chicle", "alfajor"]
-        }
-        
-        product_lower = product_name.lower()
-        for category, keywords in categories.items():
-            if any(keyword in product_lower for keyword in keywords):
-                return category
-        
-        return "otros"
+        return categorizer.categorize(product_name)
     
     def _get_price_range(self, price: float) -> str:
         """Convierte precios exactos en rangos para preservar privacidad"""
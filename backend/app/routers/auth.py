@@ -1,7 +1,73 @@
-from fastapi import APIRouter
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import Dict, List
+
+from ..core.auth import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token, get_current_user, invalidate_user,
+    revoke_token, verify_password
+)
+from ..core.database import get_db
+from ..models.models import User
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
+ROLES = ("owner", "employee")
+
+class LoginRequest(BaseModel):
+    email: str
+    password: str
+
+class TokenResponse(BaseModel):
+    access_token: str
+    token_type: str = "bearer"
+    expires_in: int
+
+class RoleUpdate(BaseModel):
+    role: str
+    permissions: List[str] = []
+
 @router.get("/health")
 async def health_check():
     return {"status": "ok", "service": "auth"}
+
+@router.post("/login", response_model=TokenResponse)
+async def login(request: LoginRequest, db: Session = Depends(get_db)):
+    user = db.query(User).filter(User.email == request.email).first()
+    # bcrypt es lento a propósito: se verifica fuera del event loop
+    if not user or not user.is_active or not await asyncio.to_thread(
+        verify_password, request.password, user.hashed_password
+    ):
+        raise HTTPException(status_code=401, detail="Email o contraseña incorrectos")
+    user.last_login = datetime.utcnow()
+    db.commit()
+    return TokenResponse(access_token=create_access_token(user), expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+@router.post("/logout")
+async def logout(current_user: Dict = Depends(get_current_user)):
+    """Revoca el token actual en todos los workers"""
+    await revoke_token(current_user)
+    return {"status": "logged_out"}
+
+@router.get("/me")
+async def me(current_user: Dict = Depends(get_current_user)):
+    return {key: value for key, value in current_user.items() if key != "jti"}
+
+@router.put("/users/{user_id}/role")
+async def update_role(user_id: str, update: RoleUpdate, current_user: Dict = Depends(get_current_user),
+                      db: Session = Depends(get_db)):
+    """El dueño cambia el rol de un usuario de su comercio; aplica desde el próximo request"""
+    if current_user["role"] != "owner":
+        raise HTTPException(status_code=403, detail="Solo el dueño puede cambiar roles")
+    if update.role not in ROLES:
+        raise HTTPException(status_code=400, detail=f"Rol inválido, opciones: {', '.join(ROLES)}")
+    user = db.query(User).filter(User.id == user_id, User.store_id == current_user["store_id"]).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    user.role = update.role
+    user.permissions = update.permissions
+    db.commit()
+    invalidate_user(user_id)
+    return {"user_id": user_id, "role": user.role, "permissions": user.permissions}
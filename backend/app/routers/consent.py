@@ -1,7 +1,103 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Dict, Optional
+from datetime import datetime
+
+from ..core.auth import get_current_user
+from ..core.consent import CONSENT_FLAGS, consent_cache
+from ..core.database import get_db
+from ..models.models import DataConsent, Store
 
 router = APIRouter(prefix="/api/consent", tags=["consent"])
 
+class ConsentSettings(BaseModel):
+    store_id: str
+    sales_volume: bool = True
+    time_patterns: bool = True
+    product_categories: bool = True
+    price_ranges: bool = False
+    customer_segments: bool = False
+    delivery_patterns: bool = False
+
+class ConsentUpdate(BaseModel):
+    sales_volume: Optional[bool] = None
+    time_patterns: Optional[bool] = None
+    product_categories: Optional[bool] = None
+    price_ranges: Optional[bool] = None
+    customer_segments: Optional[bool] = None
+    delivery_patterns: Optional[bool] = None
+
+class ConsentResponse(ConsentSettings):
+    updated_at: Optional[datetime] = None
+
+def _flags(consent: DataConsent) -> dict:
+    return {flag: bool(getattr(consent, flag)) for flag in CONSENT_FLAGS}
+
+def _to_response(consent: DataConsent) -> ConsentResponse:
+    return ConsentResponse(store_id=consent.store_id, updated_at=consent.updated_at, **_flags(consent))
+
+def _check_store(current_user: Dict, store_id: str):
+    """Cada comercio solo ve y decide sus propios consentimientos"""
+    if current_user["store_id"] != store_id:
+        raise HTTPException(status_code=403, detail="Solo se pueden gestionar los consentimientos del propio comercio")
+
+def _get_consent(db: Session, store_id: str) -> DataConsent:
+    consent = db.query(DataConsent).filter(DataConsent.store_id == store_id).first()
+    if not consent:
+        raise HTTPException(status_code=404, detail="El comercio no tiene consentimientos registrados")
+    return consent
+
 @router.get("/health")
 async def health_check():
-    return {"status": "ok", "service": "consent"}
+    return {"status": "ok", "service": "consent", "cached_stores": consent_cache.size}
+
+@router.get("/{store_id}", response_model=ConsentSettings)
+async def get_consent(store_id: str, current_user: Dict = Depends(get_current_user)):
+    """
+    Consentimientos vigentes del comercio (desde el cache en memoria).
+    Sin registro no se comparte ningún dato.
+    """
+    _check_store(current_user, store_id)
+    return ConsentSettings(store_id=store_id, **consent_cache.flags(store_id))
+
+@router.post("/", response_model=ConsentResponse, status_code=201)
+async def create_consent(settings: ConsentSettings, current_user: Dict = Depends(get_current_user),
+                         db: Session = Depends(get_db)):
+    """Registra los consentimientos de un comercio"""
+    _check_store(current_user, settings.store_id)
+    if not db.query(Store.id).filter(Store.id == settings.store_id).first():
+        raise HTTPException(status_code=404, detail="Comercio no encontrado")
+    consent = DataConsent(**settings.model_dump())
+    db.add(consent)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="El comercio ya tiene consentimientos registrados")
+    consent_cache.invalidate(consent.store_id, _flags(consent))
+    return _to_response(consent)
+
+@router.patch("/{store_id}", response_model=ConsentResponse)
+async def update_consent(store_id: str, update: ConsentUpdate, current_user: Dict = Depends(get_current_user),
+                         db: Session = Depends(get_db)):
+    """Actualiza solo los consentimientos enviados; el cambio aplica en todos los workers"""
+    _check_store(current_user, store_id)
+    consent = _get_consent(db, store_id)
+    for flag, value in update.model_dump(exclude_none=True).items():
+        setattr(consent, flag, value)
+    db.commit()
+    consent_cache.invalidate(store_id, _flags(consent))
+    return _to_response(consent)
+
+@router.delete("/{store_id}")
+async def delete_consent(store_id: str, current_user: Dict = Depends(get_current_user),
+                         db: Session = Depends(get_db)):
+    """Revoca todos los consentimientos: el comercio deja de compartir datos"""
+    _check_store(current_user, store_id)
+    consent = _get_consent(db, store_id)
+    db.delete(consent)
+    db.commit()
+    consent_cache.invalidate(store_id, None)
+    return {"status": "revoked", "store_id": store_id}
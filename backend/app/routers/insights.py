@@ -1,7 +1,57 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import StreamingResponse
+from typing import Dict, Optional
+import json
+
+from ..core.auth import get_stream_user
+from ..core.pubsub import pubsub, OVERFLOW
 
 router = APIRouter(prefix="/api/insights", tags=["insights"])
 
+# Cada cuánto mandar un comentario para que proxies y el cliente no corten la conexión
+HEARTBEAT_SECONDS = 15
+
 @router.get("/health")
 async def health_check():
-    return {"status": "ok", "service": "insights"}
\ No newline at end of file
+    return {"status": "ok", "service": "insights"}
+
+def _sse_event(message_id: str, data: dict) -> str:
+    return f"id: {message_id}\nevent: insight\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@router.get("/stream")
+async def stream_insights(last_event_id: Optional[str] = Header(None),
+                          current_user: Dict = Depends(get_stream_user)):
+    """
+    Stream SSE de insights del comercio del usuario autenticado (el token va
+    en `?access_token=` porque EventSource no manda headers). Al reconectar, EventSource manda
+    Last-Event-ID y se re-envía lo que se perdió; si el historial ya no lo cubre
+    se emite `resync` para que la caja use /api/sync/changes.
+    """
+    store_id = current_user["store_id"]
+
+    async def events():
+        sub, replay, gap = await pubsub.resume("insights", store_id, last_event_id)
+        try:
+            yield "retry: 5000\n\n"
+            if gap:
+                yield "event: resync\ndata: {}\n\n"
+            for message_id, data in replay:
+                yield _sse_event(message_id, data)
+
+            while True:
+                message = await sub.get(HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ": ping\n\n"
+                elif message is OVERFLOW:
+                    # Cliente lento: cerramos y al reconectar retoma desde su último id
+                    break
+                else:
+                    yield _sse_event(*message)
+        finally:
+            pubsub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,7 +1,73 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import Dict, Optional
+import asyncio
+
+from ..core.auth import get_current_user
+from ..core.database import get_db
+from ..integrations.payments import charge_sale, mercadopago
+from ..models.models import Payment
+from .sales import sales_storage
 
 router = APIRouter(prefix="/api/pos", tags=["pos"])
 
+class PaymentRequest(BaseModel):
+    # El monto y el comercio salen de la venta registrada, no del cliente
+    sale_id: str
+    description: Optional[str] = None
+    payer_email: Optional[str] = None
+
+class PaymentResponse(BaseModel):
+    payment_id: str
+    sale_id: str
+    status: str
+    status_detail: Optional[str] = None
+    provider_payment_id: Optional[str] = None
+
+def _to_response(payment: Payment) -> PaymentResponse:
+    return PaymentResponse(
+        payment_id=payment.id,
+        sale_id=payment.sale_id,
+        status=payment.status,
+        status_detail=payment.status_detail,
+        provider_payment_id=payment.provider_payment_id
+    )
+
 @router.get("/health")
 async def health_check():
-    return {"status": "ok", "service": "pos"}
\ No newline at end of file
+    return {"status": "ok", "service": "pos"}
+
+@router.post("/payments", response_model=PaymentResponse)
+async def create_payment(request: PaymentRequest, current_user: Dict = Depends(get_current_user),
+                         db: Session = Depends(get_db)):
+    """
+    Cobrar una venta con MercadoPago. Es idempotente por venta: reintentar
+    devuelve el mismo cobro. Si el proveedor no responde a tiempo el pago
+    queda `pending` y se resuelve por webhook.
+    """
+    sale = sales_storage.get(request.sale_id)
+    if sale is None or sale.store_id != current_user["store_id"]:
+        raise HTTPException(status_code=404, detail="Venta no encontrada")
+    if sale.total <= 0:
+        raise HTTPException(status_code=400, detail="El monto debe ser positivo")
+    try:
+        payment = await charge_sale(
+            db, mercadopago, sale.id, sale.total,
+            request.description or f"Venta {sale.id}",
+            store_id=sale.store_id, payer_email=request.payer_email
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    sale.payment_status = payment.status
+    return _to_response(payment)
+
+@router.get("/payments/{sale_id}", response_model=PaymentResponse)
+async def get_payment(sale_id: str, current_user: Dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Estado del cobro de una venta"""
+    payment = await asyncio.to_thread(lambda: db.query(Payment).filter(
+        Payment.sale_id == sale_id, Payment.store_id == current_user["store_id"]
+    ).first())
+    if not payment:
+        raise HTTPException(status_code=404, detail="Pago no encontrado")
+    return _to_response(payment)
@@ -1,6 +1,6 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from typing import List
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 router = APIRouter(prefix="/api/products", tags=["products"])
 
@@ -55,15 +55,22 @@ DEMO_PRODUCTS = [
     Product(id='26', name='Preservativos Prime x3', price=890, category='Varios', stock=18)
 ]
 
+# Índices para que las búsquedas por id y código de barras (escaneo en caja) sean O(1)
+PRODUCTS_BY_ID = {p.id: p for p in DEMO_PRODUCTS}
+PRODUCTS_BY_BARCODE = {p.barcode: p for p in DEMO_PRODUCTS if p.barcode}
+
+# El catálogo demo no cambia: se serializa una sola vez
+PRODUCTS_JSON = TypeAdapter(List[Product]).dump_json(DEMO_PRODUCTS)
+
 @router.get("/", response_model=List[Product])
 async def get_products():
     """Obtener todos los productos"""
-    return DEMO_PRODUCTS
+    return Response(content=PRODUCTS_JSON, media_type="application/json")
 
 @router.get("/{product_id}", response_model=Product)
 async def get_product(product_id: str):
     """Obtener un producto específico"""
-    product = next((p for p in DEMO_PRODUCTS if p.id == product_id), None)
+    product = PRODUCTS_BY_ID.get(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     return product
@@ -87,7 +94,7 @@ async def search_products(query: str):
 @router.get("/barcode/{barcode}")
 async def get_product_by_barcode(barcode: str):
     """Buscar producto por código de barras"""
-    product = next((p for p in DEMO_PRODUCTS if p.barcode == barcode), None)
+    product = PRODUCTS_BY_BARCODE.get(barcode)
     if not product:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     return product
\ No newline at end of file
@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+import asyncio
 import uuid
 
+from ..core.auth import get_current_user
+from ..core.inventory import apply_sale, stock_alerts, stock_writer
+from ..models.compact import SaleRow, SaleItemRow, StoreLedgers
+
 router = APIRouter(prefix="/api/sales", tags=["sales"])
 
 class SaleItem(BaseModel):
@@ -15,6 +21,7 @@ class SaleItem(BaseModel):
 
 class Sale(BaseModel):
     id: Optional[str] = None
+    store_id: Optional[str] = None  # Lo fija el servidor: el comercio del usuario autenticado
     items: List[SaleItem]
     total: float
     payment_method: str
@@ -29,9 +36,24 @@ class SaleResponse(BaseModel):
     neural_insights: Optional[dict] = None
 
 # Storage temporal de ventas (en producción sería base de datos)
-sales_storage = []
+sales_storage = StoreLedgers()
+
+def _to_row(sale: Sale) -> SaleRow:
+    """Convierte la venta validada en la fila compacta que se guarda"""
+    return SaleRow(
+        id=sale.id,
+        store_id=sale.store_id,
+        items=tuple(
+            SaleItemRow(item.product_id, item.product_name, item.quantity, item.unit_price, item.total_price)
+            for item in sale.items
+        ),
+        total=sale.total,
+        payment_method=sale.payment_method,
+        timestamp=sale.timestamp,
+        customer_info=sale.customer_info
+    )
 
-def process_neural_insights(sale_data: Sale) -> dict:
+def process_neural_insights(sale_data: SaleRow) -> dict:
     """Procesar la venta con el motor neural y generar insights"""
 
     # Simulación de insights neurales
@@ -74,12 +96,13 @@ def process_neural_insights(sale_data: Sale) -> dict:
     return insights
 
 @router.post("/", response_model=SaleResponse)
-async def create_sale(sale: Sale, background_tasks: BackgroundTasks):
+async def create_sale(sale: Sale, background_tasks: BackgroundTasks, current_user: Dict = Depends(get_current_user)):
     """Registrar una nueva venta"""
 
     # Generar ID y timestamp
     sale.id = str(uuid.uuid4())
     sale.timestamp = datetime.now()
+    sale.store_id = current_user["store_id"]
 
     # Validar datos
     if not sale.items:
@@ -90,10 +113,22 @@ async def create_sale(sale: Sale, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=400, detail="El total no coincide con los items")
 
     # Guardar venta
-    sales_storage.append(sale)
+    row = _to_row(sale)
+    sales_storage.append(row)
 
     # Procesar insights neurales en background
-    insights = process_neural_insights(sale)
+    insights = process_neural_insights(row)
+
+    # El descuento de stock se encola y se aplica en lote; las alertas llegan
+    # por el stream de insights. Con la cola llena se aplica acá mismo
+    items = [(item.product_id, item.quantity) for item in row.items]
+    if not stock_writer.submit(row.store_id, row.id, items):
+        try:
+            changes = await asyncio.to_thread(apply_sale, row.store_id, row.id, items)
+            insights["inventory_alerts"].extend(stock_alerts(changes))
+        except Exception as e:
+            # Si la base no responde la venta igual queda registrada en la caja
+            print(f"Error descontando stock de la venta {row.id}: {e}")
 
     return SaleResponse(
         id=sale.id,
@@ -104,25 +139,26 @@ async def create_sale(sale: Sale, background_tasks: BackgroundTasks):
     )
 
 @router.get("/", response_model=List[Sale])
-async def get_sales():
-    """Obtener todas las ventas"""
-    return sales_storage
+async def get_sales(current_user: Dict = Depends(get_current_user)):
+    """Obtener todas las ventas del comercio"""
+    # Las filas ya fueron validadas al entrar: se serializan directo sin pasar por Pydantic
+    return ORJSONResponse(sales_storage.for_store(current_user["store_id"]).rows)
 
 @router.get("/{sale_id}", response_model=Sale)
-async def get_sale(sale_id: str):
+async def get_sale(sale_id: str, current_user: Dict = Depends(get_current_user)):
     """Obtener una venta específica"""
-    sale = next((s for s in sales_storage if s.id == sale_id), None)
-    if not sale:
+    sale = sales_storage.get(sale_id)
+    if not sale or sale.store_id != current_user["store_id"]:
         raise HTTPException(status_code=404, detail="Venta no encontrada")
-    return sale
+    return ORJSONResponse(sale)
 
 @router.get("/analytics/today")
-async def get_today_analytics():
+async def get_today_analytics(current_user: Dict = Depends(get_current_user)):
     """Analíticas del día actual"""
-    today_sales = [s for s in sales_storage if s.timestamp.date() == datetime.now().date()]
-
-    total_revenue = sum(s.total for s in today_sales)
-    total_transactions = len(today_sales)
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    total_revenue, total_transactions = sales_storage.for_store(current_user["store_id"]).revenue(
+        today, today + timedelta(days=1)
+    )
     avg_ticket = total_revenue / total_transactions if total_transactions > 0 else 0
 
     return {
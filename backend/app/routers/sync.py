@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Query, Response
+from typing import Dict, Optional
+import asyncio
+import orjson
+
+from ..core.auth import get_current_user
+from ..core.sync import sync_journal
+
+router = APIRouter(prefix="/api/sync", tags=["sync"])
+
+@router.get("/health")
+async def health_check():
+    return {"status": "ok", "service": "sync"}
+
+@router.get("/version")
+async def get_sync_version(current_user: Dict = Depends(get_current_user)):
+    """Versión actual del comercio, para saber si hay algo nuevo sin bajar el delta"""
+    epoch, version = await asyncio.to_thread(sync_journal.current, current_user["store_id"])
+    return {"epoch": epoch, "version": version}
+
+@router.get("/changes")
+async def get_changes(
+    since: int = Query(0, ge=0),
+    epoch: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    cursor: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user)
+):
+    """
+    Cambios de productos, ventas e insights del comercio desde la versión `since`.
+    Sin `epoch` o con un cursor vencido se devuelve el estado completo del comercio,
+    de a `limit` filas: las páginas siguientes se piden con el `cursor` de la respuesta.
+    """
+    payload = await asyncio.to_thread(
+        sync_journal.changes_since, current_user["store_id"], since, epoch, limit, cursor
+    )
+    # orjson serializa directo las filas; la compresión la hace el middleware
+    return Response(content=orjson.dumps(payload), media_type="application/json")
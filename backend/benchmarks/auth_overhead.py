@@ -0,0 +1,115 @@
+"""
+Costo de autenticar un request de la caja: verificación completa (firma JWT
++ usuario en la base) contra cache hit, y overhead agregado de punta a punta
+comparando un endpoint con y sin `Depends(get_current_user)`. Objetivo: un
+request autenticado con cache caliente suma menos de 100 µs.
+
+    cd backend
+    DATABASE_URL=sqlite:////tmp/nordia_bench.db python -m benchmarks.auth_overhead
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import httpx
+from fastapi import Depends, FastAPI
+
+from app.core.auth import (
+    _verify_uncached, create_access_token, get_current_user, hash_password, token_cache, verify_token
+)
+from app.core.database import Base, SessionLocal, engine
+from app.models.models import Store, User
+
+TARGET_US = 100
+
+
+def create_user() -> User:
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        store = Store(name="Bench", owner_name="Bench", phone="0")
+        db.add(store)
+        db.flush()
+        user = User(
+            store_id=store.id, email=f"bench-{uuid.uuid4().hex[:8]}@nordia.app", name="Bench",
+            hashed_password=hash_password("bench"), role="owner"
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        return user
+    finally:
+        db.close()
+
+
+def per_call_us(fn, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples), statistics.quantiles(samples, n=100)[98]
+
+
+def bench_app() -> FastAPI:
+    bench = FastAPI()
+
+    @bench.get("/open")
+    async def open_endpoint():
+        return {"ok": True}
+
+    @bench.get("/authed")
+    async def authed_endpoint(user: dict = Depends(get_current_user)):
+        return {"ok": True}
+
+    return bench
+
+
+async def endpoint_overhead(token: str, repeat: int):
+    """Mediana del endpoint autenticado menos la del abierto, intercalando para compartir ruido"""
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=bench_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.get("/authed", headers=headers)).raise_for_status()
+        open_samples, authed_samples = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await client.get("/open", headers=headers)
+            open_samples.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await client.get("/authed", headers=headers)
+            authed_samples.append(time.perf_counter() - started)
+    return statistics.median(open_samples) * 1e6, statistics.median(authed_samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5000)
+    args = parser.parse_args()
+
+    token = create_access_token(create_user())
+
+    def uncached():
+        token_cache.invalidate_all()
+        assert _verify_uncached(token)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(verify_token(token))
+
+    miss_p50, miss_p99 = per_call_us(uncached, max(args.repeat // 10, 100))
+    loop.run_until_complete(verify_token(token))
+    hit_p50, hit_p99 = per_call_us(lambda: loop.run_until_complete(verify_token(token)), args.repeat)
+    open_us, authed_us = loop.run_until_complete(endpoint_overhead(token, args.repeat))
+    overhead = authed_us - open_us
+
+    print(f"verificación sin cache (firma + query)  p50 {miss_p50:8.1f} µs   p99 {miss_p99:8.1f} µs")
+    print(f"verify_token con cache hit               p50 {hit_p50:8.1f} µs   p99 {hit_p99:8.1f} µs")
+    print(f"endpoint abierto {open_us:8.1f} µs  autenticado {authed_us:8.1f} µs  "
+          f"overhead {overhead:6.1f} µs  ({'OK' if overhead < TARGET_US else 'SUPERA'} objetivo {TARGET_US} µs)")
+
+
+if __name__ == "__main__":
+    main()
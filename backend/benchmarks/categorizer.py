@@ -0,0 +1,117 @@
+"""
+Precisión y throughput del categorizador de productos: el diccionario de
+palabras clave anterior (any() anidados por nombre) contra el categorizador
+actual (regex compilado + modelo lineal entrenado + memo). Se entrena con
+los nombres del CATALOG de seed y se evalúa con HELD_OUT, un vocabulario
+de productos que no aparece en el entrenamiento; los que no son de
+ninguna categoría de la red deberían quedar en "otros".
+
+    cd backend
+    python -m benchmarks.categorizer --products 20000
+"""
+import argparse
+import random
+import time
+
+from app.neural.categorizer import ProductCategorizer, normalize_name
+from benchmarks.seed import BRANDS, CATALOG, SIZES
+
+LEGACY_CATEGORIES = {
+    "bebidas": ["coca", "pepsi", "agua", "cerveza", "vino", "jugo"],
+    "lacteos": ["leche", "yogur", "queso", "manteca"],
+    "panaderia": ["pan", "factura", "torta", "galleta"],
+    "almacen": ["arroz", "aceite", "azucar", "sal", "fideos"],
+    "limpieza": ["lavandina", "detergente", "jabon", "papel"],
+    "cigarrillos": ["marlboro", "philip", "parlament"],
+    "golosinas": ["chocolate", "caramelo", "chicle", "alfajor"],
+}
+
+
+# Productos que no están en CATALOG
+HELD_OUT = {
+    "bebidas": ["Gaseosa Manaos", "Soda Sifon", "Tonica Schweppes", "Energizante Speed", "Agua Saborizada Levite",
+                "Cerveza Patagonia", "Vino Blanco Dulce"],
+    "lacteos": ["Ricota", "Crema de Leche", "Postre Serenito", "Queso Rallado", "Leche Chocolatada", "Yogurt Firme",
+                "Flan Casero"],
+    "panaderia": ["Pan Rallado", "Budin", "Vainillas", "Prepizza", "Grisines", "Tostadas", "Pan Dulce"],
+    "almacen": ["Polenta", "Lentejas", "Arroz Integral", "Tomate Triturado", "Cafe Molido", "Mayonesa",
+                "Atun en Lata"],
+    "limpieza": ["Limpiador de Pisos", "Desodorante de Ambiente", "Papel de Cocina", "Trapo de Piso",
+                 "Jabon Liquido", "Lustramuebles", "Bolsas de Residuos"],
+    "cigarrillos": ["Lucky Strike", "Chesterfield", "Marlboro Gold", "Red Point", "Jockey Club"],
+    "golosinas": ["Chupetin Pico Dulce", "Gomitas Mogul", "Bon o Bon", "Chocolate Blanco", "Caramelos Media Hora",
+                  "Pastillas DRF"],
+    "otros": ["Pañales Pampers", "Salchichas Vienissima", "Panchos Paty", "Shampoo", "Pilas AA", "Encendedor"],
+}
+
+
+def legacy_categorize(product_name: str) -> str:
+    """_categorize_product tal como era"""
+    product_lower = product_name.lower()
+    for category, keywords in LEGACY_CATEGORIES.items():
+        if any(keyword in product_lower for keyword in keywords):
+            return category
+    return "otros"
+
+
+def build_names(catalog, count: int, seed: int):
+    rng = random.Random(seed)
+    names, labels = [], []
+    for _ in range(count):
+        category = rng.choice(list(catalog))
+        names.append(f"{rng.choice(catalog[category])} {rng.choice(BRANDS)} {rng.choice(SIZES)}")
+        labels.append(category)
+    return names, labels
+
+
+def accuracy(predicted, expected) -> float:
+    return sum(p == e for p, e in zip(predicted, expected)) / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20000, help="productos de la red para entrenar")
+    parser.add_argument("--names", type=int, default=5000, help="nombres por lote a categorizar")
+    args = parser.parse_args()
+
+    train_names, train_labels = build_names(CATALOG, args.products, seed=1)
+    test_names, test_labels = build_names(HELD_OUT, args.names, seed=2)
+    # Nombres nunca vistos: sufijo de variante para que no estén en el memo ni en el entrenamiento
+    test_names = [f"{name} v{i}" for i, name in enumerate(test_names)]
+
+    categorizer = ProductCategorizer()
+    keyword_only = categorizer.categorize_many(test_names)
+
+    started = time.perf_counter()
+    used = categorizer.fit(train_names, train_labels)
+    train_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    legacy = [legacy_categorize(name) for name in test_names]
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cold = categorizer.categorize_many(test_names)
+    cold_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    categorizer.categorize_many(test_names)
+    warm_seconds = time.perf_counter() - started
+
+    # El modelo solo, como si ningún nombre tuviera palabra clave (SKUs reales sin keywords)
+    model_only, _ = categorizer.model.predict([normalize_name(name) for name in test_names])
+
+    n = len(test_names)
+    print(f"entrenamiento: {used} nombres distintos en {train_seconds:.2f}s")
+    print(f"anterior (keywords any())   precisión {accuracy(legacy, test_labels):6.1%}  "
+          f"'otros' {legacy.count('otros') / n:6.1%}  {n / legacy_seconds:10.0f} nombres/s")
+    print(f"regex compilado sin modelo  precisión {accuracy(keyword_only, test_labels):6.1%}  "
+          f"'otros' {keyword_only.count('otros') / n:6.1%}")
+    print(f"modelo solo (sin keywords)  precisión {accuracy(model_only, test_labels):6.1%}")
+    print(f"regex + modelo (lote frío)  precisión {accuracy(cold, test_labels):6.1%}  "
+          f"'otros' {cold.count('otros') / n:6.1%}  {n / cold_seconds:10.0f} nombres/s")
+    print(f"memo (lote repetido)                                   {n / warm_seconds:10.0f} nombres/s")
+
+
+if __name__ == "__main__":
+    main()
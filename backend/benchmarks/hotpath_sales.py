@@ -0,0 +1,113 @@
+"""
+Memoria por venta y velocidad de agregación: ventas guardadas como modelos
+Pydantic (como antes) contra filas compactas en un SalesLedger por comercio
+(StoreLedgers). La facturación del día se mide para un comercio, como la
+pide /api/sales/analytics/today.
+
+    cd backend
+    python -m benchmarks.hotpath_sales --sales 50000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from app.models.compact import StoreLedgers
+from app.routers.products import DEMO_PRODUCTS
+from app.routers.sales import Sale, SaleItem, _to_row, process_neural_insights
+
+
+def build_sales(count: int, items_per_sale: int, stores: int = 1):
+    random.seed(7)
+    start = datetime.now() - timedelta(days=3)
+    step = timedelta(days=4) / count
+    sales = []
+    for i in range(count):
+        items = []
+        for product in random.sample(DEMO_PRODUCTS, items_per_sale):
+            quantity = random.randint(1, 4)
+            items.append(SaleItem(
+                product_id=product.id,
+                product_name=product.name,
+                quantity=quantity,
+                unit_price=product.price,
+                total_price=product.price * quantity
+            ))
+        sales.append(Sale(
+            id=str(uuid.uuid4()),
+            store_id=f"store-{i % stores}",
+            items=items,
+            total=sum(item.total_price for item in items),
+            payment_method="cash",
+            timestamp=start + step * i
+        ))
+    return sales
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def timeit(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sales", type=int, default=50000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    models, models_bytes = measure_memory(lambda: build_sales(args.sales, args.items, args.stores))
+
+    def build_ledger():
+        ledger = StoreLedgers()
+        for sale in models:
+            ledger.append(_to_row(sale))
+        return ledger
+
+    # Las filas comparten los strings (ids, nombres) con los modelos: se mide la estructura
+    ledger, ledger_bytes = measure_memory(build_ledger)
+
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    tomorrow = today + timedelta(days=1)
+
+    store_id = "store-0"
+
+    def aggregate_models():
+        today_sales = [s for s in models if s.store_id == store_id and s.timestamp.date() == today.date()]
+        return sum(s.total for s in today_sales), len(today_sales)
+
+    def aggregate_ledger():
+        return ledger.for_store(store_id).revenue(today, tomorrow)
+
+    assert abs(aggregate_models()[0] - aggregate_ledger()[0]) < 0.01
+
+    t_models = timeit(aggregate_models, args.repeat)
+    t_ledger = timeit(aggregate_ledger, args.repeat)
+    t_insights_models = timeit(lambda: [process_neural_insights(s) for s in models], args.repeat)
+    rows = [row for store in range(args.stores) for row in ledger.for_store(f"store-{store}")]
+    t_insights_rows = timeit(lambda: [process_neural_insights(r) for r in rows], args.repeat)
+
+    print(f"ventas: {args.sales} ({args.items} items c/u) en {args.stores} comercios")
+    print(f"memoria por venta     pydantic: {models_bytes / args.sales:8.0f} B   compacta: {ledger_bytes / args.sales:8.0f} B")
+    print(f"facturación del día   pydantic: {t_models * 1000:8.2f} ms  compacta: {t_ledger * 1000:8.3f} ms")
+    print(f"process_neural_insights pydantic: {args.sales / t_insights_models:8.0f}/s compacta: {args.sales / t_insights_rows:8.0f}/s")
+
+
+if __name__ == "__main__":
+    main()
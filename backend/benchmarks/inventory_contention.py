@@ -0,0 +1,123 @@
+"""
+Contención de stock: N cajas concurrentes vendiendo los mismos productos de
+un comercio. Compara el descuento set-based de core.inventory (un UPDATE por
+venta, filas bloqueadas en orden) contra leer-modificar-escribir por ítem, y
+verifica que el stock final y el libro de movimientos cierren.
+
+    cd backend
+    python -m benchmarks.inventory_contention --tills 50
+    python -m benchmarks.inventory_contention --database-url postgresql://... --tills 50
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.core.inventory import apply_sale
+from app.models.models import InventoryMovement, NetworkEvent, Product, Store
+from benchmarks.seed import reset_database
+
+INITIAL_STOCK = 10000
+
+
+def setup(database_url: str, products: int, tills: int):
+    reset_database(database_url).dispose()
+    connect_args = {"timeout": 60, "check_same_thread": False} if database_url.startswith("sqlite") else {}
+    engine = create_engine(database_url, pool_size=tills, max_overflow=0, connect_args=connect_args)
+    store_id = str(uuid.uuid4())
+    product_ids = [str(uuid.uuid4()) for _ in range(products)]
+    with engine.begin() as conn:
+        conn.execute(insert(Store.__table__), [{"id": store_id, "name": "Bench", "owner_name": "Bench", "phone": "0"}])
+        conn.execute(insert(Product.__table__), [
+            {"id": pid, "store_id": store_id, "name": f"Producto {i}", "price": 100.0,
+             "stock": INITIAL_STOCK, "min_stock": 5, "sales_velocity": 0.0}
+            for i, pid in enumerate(product_ids)
+        ])
+    return engine, store_id, product_ids
+
+
+def naive_sale(session_factory, store_id, sale_id, items):
+    """Lo que haría el código sin subsistema de inventario: leer, restar y guardar por ítem"""
+    db = session_factory()
+    try:
+        for product_id, quantity in items:
+            product = db.query(Product).filter(Product.id == product_id, Product.store_id == store_id).first()
+            product.stock = product.stock - quantity
+        db.commit()
+    finally:
+        db.close()
+
+
+def run(mode: str, engine, store_id, product_ids, tills: int, sales_per_till: int, items_per_sale: int):
+    session_factory = sessionmaker(bind=engine)
+    sale_fn = apply_sale if mode == "set-based" else naive_sale
+    latencies, errors, sold = [], [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(tills)
+
+    def till(seed: int):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(sales_per_till):
+            items = [(pid, rng.randint(1, 3)) for pid in rng.sample(product_ids, items_per_sale)]
+            started = time.perf_counter()
+            try:
+                sale_fn(store_id, str(uuid.uuid4()), items, session_factory) if mode == "set-based" \
+                    else sale_fn(session_factory, store_id, str(uuid.uuid4()), items)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                sold.extend(items)
+
+    threads = [threading.Thread(target=till, args=(i,)) for i in range(tills)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    expected_units = sum(quantity for _, quantity in sold)
+    with session_factory() as db:
+        remaining = db.query(func.sum(Product.stock)).filter(Product.store_id == store_id).scalar()
+        ledger_units = -(db.query(func.sum(InventoryMovement.quantity)).scalar() or 0)
+        events = db.query(func.count(NetworkEvent.id)).scalar()
+    actual_units = INITIAL_STOCK * len(product_ids) - remaining
+
+    latencies_ms = sorted(l * 1000 for l in latencies)
+    p99 = latencies_ms[int(len(latencies_ms) * 0.99) - 1] if latencies_ms else 0
+    print(f"[{mode}] {len(latencies)} ventas en {wall:.2f}s = {len(latencies) / wall:7.0f} ventas/s  "
+          f"p50 {statistics.median(latencies_ms) if latencies_ms else 0:6.1f} ms  p99 {p99:6.1f} ms  "
+          f"errores {len(errors)}{' (' + ', '.join(sorted(set(errors))) + ')' if errors else ''}")
+    print(f"[{mode}] unidades vendidas {expected_units}, descontadas {actual_units}, "
+          f"perdidas {expected_units - actual_units}, en el libro {ledger_units}, eventos de red {events}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite:////tmp/nordia_bench.db")
+    parser.add_argument("--tills", type=int, default=50)
+    parser.add_argument("--sales", type=int, default=40, help="ventas por caja")
+    parser.add_argument("--items", type=int, default=3, help="productos distintos por venta")
+    parser.add_argument("--products", type=int, default=20, help="catálogo chico = más contención")
+    parser.add_argument("--mode", choices=["set-based", "naive", "both"], default="both")
+    args = parser.parse_args()
+
+    modes = ["naive", "set-based"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        engine, store_id, product_ids = setup(args.database_url, args.products, args.tills)
+        run(mode, engine, store_id, product_ids, args.tills, args.sales, args.items)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,416 @@
+"""
+Harness de carga del backend: siembra datos sintéticos, ejercita la ingesta de
+ventas, la búsqueda por código de barras y las etapas del motor neural, y
+reporta throughput, latencias p50/p95/p99 y queries a la base por endpoint.
+
+Modos:
+  inprocess     cliente ASGI en el mismo proceso (cuenta queries por request)
+  multiprocess  servidor uvicorn + N procesos generadores de carga por HTTP
+
+    cd backend
+    python -m benchmarks.loadtest --requests 2000 --concurrency 20
+    python -m benchmarks.loadtest --mode multiprocess --processes 4
+    python -m benchmarks.loadtest --output /tmp/run.json --compare benchmarks/baseline.json
+
+Los resultados se guardan en JSON; con --compare se marcan las regresiones
+respecto de una corrida anterior (por defecto, más de 20% en p95 o throughput).
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# Contador de queries del request/etapa en curso
+_query_counter: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("query_counter", default=None)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0,
+              queries: Optional[List[int]] = None) -> Dict:
+    values = sorted(latencies)
+    result = {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+    if queries is not None:
+        result["db_queries_per_request"] = round(sum(queries) / len(queries), 2) if queries else 0.0
+    return result
+
+
+def install_query_counter(engine):
+    """Cuenta cada statement ejecutado contra el contador del contexto actual"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+def sale_payload(rng: random.Random, products: List[tuple]) -> Dict:
+    """Venta con productos sembrados del comercio de la caja: descuenta stock de verdad"""
+    items = []
+    for product_id, name, price in rng.sample(products, rng.randint(1, 5)):
+        quantity = rng.randint(1, 3)
+        items.append({
+            "product_id": product_id,
+            "product_name": name,
+            "quantity": quantity,
+            "unit_price": price,
+            "total_price": round(price * quantity, 2),
+        })
+    return {
+        "items": items,
+        "total": round(sum(item["total_price"] for item in items), 2),
+        "payment_method": rng.choice(["cash", "card", "mercadopago"]),
+    }
+
+
+def create_cashier(database_url: str) -> tuple:
+    """
+    Usuario de caja en el primer comercio sembrado (ventas, caja y sync
+    requieren auth). Devuelve su token y los productos (id, nombre, precio)
+    de ese comercio.
+    """
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import Session
+    from app.core.auth import create_access_token
+    from app.models.models import Product, Store, User
+
+    engine = create_engine(database_url)
+    try:
+        with Session(engine) as session:
+            store_id = session.scalars(select(Store.id).order_by(Store.name)).first()
+            user = User(store_id=store_id, email="caja@bench.local", name="Caja", hashed_password="!", role="employee")
+            session.add(user)
+            session.commit()
+            products = session.execute(
+                select(Product.id, Product.name, Product.price).where(Product.store_id == store_id).order_by(Product.id)
+            ).tuples().all()
+            return create_access_token(user), products
+    finally:
+        engine.dispose()
+
+
+def count_movements(database_url: str) -> int:
+    from sqlalchemy import create_engine, func, select
+    from app.models.models import InventoryMovement
+
+    engine = create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(InventoryMovement)).scalar_one()
+    finally:
+        engine.dispose()
+
+
+def build_requests(count: int, seed_value: int, products: List[tuple]) -> List[tuple]:
+    """Mezcla de tráfico de caja: mitad escaneos, mitad ventas"""
+    from app.routers.products import DEMO_PRODUCTS
+
+    rng = random.Random(seed_value)
+    barcodes = [p.barcode for p in DEMO_PRODUCTS if p.barcode]
+    plan = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            plan.append(("GET /api/products/barcode/{barcode}", "GET", f"/api/products/barcode/{rng.choice(barcodes)}", None))
+        else:
+            plan.append(("POST /api/sales/", "POST", "/api/sales/", sale_payload(rng, products)))
+    return plan
+
+
+async def drive(client, plan: List[tuple], concurrency: int, count_queries: bool):
+    """Ejecuta el plan con `concurrency` clientes y junta latencias por endpoint"""
+    latencies: Dict[str, List[float]] = {}
+    queries: Dict[str, List[int]] = {}
+    errors: Dict[str, int] = {}
+    position = iter(plan)
+
+    async def worker():
+        for name, method, path, body in position:
+            counter = [0]
+            token = _query_counter.set(counter) if count_queries else None
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if token is not None:
+                _query_counter.reset(token)
+                queries.setdefault(name, []).append(counter[0])
+            latencies.setdefault(name, []).append(elapsed)
+            if not ok:
+                errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, queries, errors, time.perf_counter() - started
+
+
+async def run_stages(iterations: int) -> Dict[str, Dict]:
+    """Mide las etapas del motor neural contra los datos sembrados"""
+    from app.main import neural_engine
+
+    stages: Dict[str, Callable] = {
+        "stage:process_network_insights": neural_engine.process_network_insights,
+        "stage:predict_stock_needs": neural_engine.predict_stock_needs,
+    }
+    results = {}
+    for name, stage in stages.items():
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            counter = [0]
+            token = _query_counter.set(counter)
+            t0 = time.perf_counter()
+            await stage()
+            latencies.append(time.perf_counter() - t0)
+            _query_counter.reset(token)
+            queries.append(counter[0])
+        results[name] = summarize(latencies, time.perf_counter() - started, queries=queries)
+    return results
+
+
+async def wait_for_neural_engine(timeout: float = 60):
+    """La primera vuelta del motor neural corre al arrancar: se mide después, no encima"""
+    from app.main import neural_engine
+
+    deadline = time.monotonic() + timeout
+    while "predict_stock_needs" not in neural_engine.stage_last_success and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def run_inprocess(args, headers: Dict[str, str], products: List[tuple]) -> Dict[str, Dict]:
+    import httpx
+    from app.main import app
+    from app.core.database import engine
+    from app.core.inventory import stock_writer
+
+    install_query_counter(engine)
+    # Las queries del escritor de stock corren fuera del request: se cuentan aparte
+    writer_queries = [0]
+    apply_batch = stock_writer._apply_batch
+
+    def counted_apply_batch(entries):
+        token = _query_counter.set(writer_queries)
+        try:
+            return apply_batch(entries)
+        finally:
+            _query_counter.reset(token)
+
+    stock_writer._apply_batch = counted_apply_batch
+
+    plan = build_requests(args.requests, args.seed, products)
+    transport = httpx.ASGITransport(app=app)
+    # ASGITransport no dispara el lifespan: sin esto no arrancan el escritor de stock ni los workers
+    async with app.router.lifespan_context(app):
+        await wait_for_neural_engine()
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as client:
+            await drive(client, plan[:50], 1, False)  # warmup
+            await stock_writer.flush()
+            writer_queries[0] = 0
+            started = time.perf_counter()
+            latencies, queries, errors, _ = await drive(client, plan, args.concurrency, True)
+            # El throughput incluye aplicar el stock de todas las ventas
+            await stock_writer.flush()
+            elapsed = time.perf_counter() - started
+
+        results = {
+            name: summarize(values, elapsed, errors.get(name, 0), queries.get(name, []))
+            for name, values in latencies.items()
+        }
+        sales = results.get("POST /api/sales/")
+        if sales and sales["requests"]:
+            sales["db_queries_per_request"] = round(
+                sales["db_queries_per_request"] + writer_queries[0] / sales["requests"], 2
+            )
+        results.update(await run_stages(args.stage_iterations))
+    return results
+
+
+def _load_worker(job) -> tuple:
+    """Proceso generador de carga: corre su porción del plan contra el servidor"""
+    base_url, plan, concurrency, headers = job
+    import httpx
+
+    async def go():
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, headers=headers) as client:
+            return await drive(client, plan, concurrency, False)
+
+    latencies, _, errors, elapsed = asyncio.run(go())
+    return latencies, errors, elapsed
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(base_url: str, timeout: float = 30):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/")
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("el servidor no arrancó a tiempo")
+
+
+def run_multiprocess(args, headers: Dict[str, str], products: List[tuple]) -> Dict[str, Dict]:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(args.server_workers), "--log-level", "warning", "--no-access-log"],
+        env=dict(os.environ),
+    )
+    try:
+        _wait_ready(base_url)
+        plan = build_requests(args.requests, args.seed, products)
+        chunks = [plan[i::args.processes] for i in range(args.processes)]
+        per_process = max(1, args.concurrency // args.processes)
+        started = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            outputs = pool.map(_load_worker, [(base_url, chunk, per_process, headers) for chunk in chunks])
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for worker_latencies, worker_errors, _ in outputs:
+        for name, values in worker_latencies.items():
+            latencies.setdefault(name, []).extend(values)
+        for name, count in worker_errors.items():
+            errors[name] = errors.get(name, 0) + count
+    return {name: summarize(values, elapsed, errors.get(name, 0)) for name, values in latencies.items()}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Devuelve las regresiones de p95 o throughput mayores a `threshold` (fracción)"""
+    regressions = []
+    for name, result in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and result["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {result['p95_ms']} ms")
+        if previous["throughput_rps"] and result["throughput_rps"] < previous["throughput_rps"] * (1 - threshold):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {result['throughput_rps']} rps")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict]):
+    print(f"{'endpoint / etapa':45} {'req':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'err':>4}")
+    for name, r in results.items():
+        queries = r.get("db_queries_per_request", "-")
+        print(f"{name:45} {r['requests']:6} {r['throughput_rps']:9} {r['p50_ms']:9} {r['p95_ms']:9} "
+              f"{r['p99_ms']:9} {queries:>8} {r['errors']:4}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "multiprocess"], default="inprocess")
+    parser.add_argument("--database-url", default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'nordia_bench.db')}")
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--products", type=int, default=200, help="productos por comercio")
+    parser.add_argument("--sales", type=int, default=100, help="ventas sembradas por comercio")
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=4, help="generadores de carga (multiprocess)")
+    parser.add_argument("--server-workers", type=int, default=1, help="workers de uvicorn (multiprocess)")
+    parser.add_argument("--stage-iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # La app lee DATABASE_URL al importarse: fijarlo antes de cualquier import de app.*
+    os.environ["DATABASE_URL"] = args.database_url
+    from sqlalchemy.orm import Session
+    from benchmarks.seed import reset_database, seed
+
+    engine = reset_database(args.database_url)
+    with Session(engine) as session:
+        counts = seed(session, args.stores, args.products, args.sales, events=args.events, seed_value=args.seed)
+    engine.dispose()
+    token, products = create_cashier(args.database_url)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    if args.mode == "inprocess":
+        results = asyncio.run(run_inprocess(args, headers, products))
+    else:
+        results = run_multiprocess(args, headers, products)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "mode": args.mode,
+            "database": args.database_url.split(":", 1)[0],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seeded": counts,
+            "stock_movements": count_movements(args.database_url),
+        },
+        "results": results,
+    }
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESIÓN {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"sin regresiones respecto de {args.compare} (commit {baseline['meta'].get('commit')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Genera datos sintéticos (comercios, productos, ventas y eventos de red) para
+benchmarks y pruebas de carga. Funciona sobre SQLite o un Postgres local.
+
+    cd backend
+    python -m benchmarks.seed --database-url sqlite:////tmp/nordia_bench.db --stores 50
+"""
+import argparse
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+# Nombres base por categoría; las mismas etiquetas que usa el motor neural
+CATALOG = {
+    "bebidas": ["Coca Cola", "Pepsi", "Agua Mineral", "Cerveza Quilmes", "Vino Tinto", "Jugo Cepita", "Sprite", "Fernet Branca"],
+    "lacteos": ["Leche Entera", "Yogur Bebible", "Queso Cremoso", "Manteca", "Dulce de Leche", "Crema de Leche"],
+    "panaderia": ["Pan Lactal", "Facturas", "Torta Marmolada", "Galletitas de Agua", "Medialunas", "Bizcochitos"],
+    "almacen": ["Arroz Largo Fino", "Aceite Girasol", "Azucar", "Sal Fina", "Fideos Tirabuzon", "Yerba Mate", "Harina 000"],
+    "limpieza": ["Lavandina", "Detergente", "Jabon en Polvo", "Papel Higienico", "Esponja", "Suavizante"],
+    "cigarrillos": ["Marlboro Box", "Philip Morris", "Parliament", "Camel"],
+    "golosinas": ["Chocolate con Leche", "Caramelos Surtidos", "Chicle Beldent", "Alfajor Triple", "Turron"],
+}
+BRANDS = ["La Serenisima", "Arcor", "Molinos", "Ledesma", "Marolio", "Genérico"]
+SIZES = ["250g", "500g", "1kg", "500ml", "1L", "1.5L", "x6", "x12"]
+STORE_CATEGORIES = ["almacen", "kiosco", "autoservicio", "farmacia"]
+EVENT_TYPES = ["price_change", "stock_out", "high_demand"]
+
+
+def _product_rows(rng: random.Random, store_id: str, count: int) -> List[Dict]:
+    rows = []
+    for _ in range(count):
+        category = rng.choice(list(CATALOG))
+        price = round(rng.uniform(150, 6000), 2)
+        min_stock = rng.randint(3, 15)
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "store_id": store_id,
+            "name": f"{rng.choice(CATALOG[category])} {rng.choice(BRANDS)} {rng.choice(SIZES)}",
+            "barcode": str(rng.randint(7790000000000, 7799999999999)),
+            "price": price,
+            "cost": round(price * rng.uniform(0.55, 0.8), 2),
+            # Una parte queda cerca del mínimo para ejercitar las alertas de stock
+            "stock": rng.randint(0, min_stock * 2) if rng.random() < 0.3 else rng.randint(min_stock * 2, 200),
+            "min_stock": min_stock,
+            "category": category,
+            "brand": rng.choice(BRANDS),
+            "sales_velocity": round(rng.uniform(0, 12), 2),
+            "is_active": True,
+        })
+    return rows
+
+
+def seed(session: Session, stores: int = 20, products_per_store: int = 200,
+         sales_per_store: int = 200, items_per_sale: int = 3, events: int = 500,
+         seed_value: int = 42) -> Dict[str, int]:
+    """Inserta el dataset sintético en bloque y devuelve cuántas filas creó por tabla"""
+    from app.models.models import Store, Product, Sale, SaleItem, NetworkEvent
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow()
+    store_rows, product_rows, sale_rows, item_rows, event_rows = [], [], [], [], []
+    products_by_store: Dict[str, List[Dict]] = {}
+
+    for i in range(stores):
+        store_id = str(uuid.uuid4())
+        store_rows.append({
+            "id": store_id,
+            "name": f"Comercio {i + 1}",
+            "owner_name": f"Dueño {i + 1}",
+            "phone": f"+54911{rng.randint(10000000, 99999999)}",
+            "latitude": -34.6 + rng.uniform(-0.05, 0.05),
+            "longitude": -58.4 + rng.uniform(-0.05, 0.05),
+            "category": rng.choice(STORE_CATEGORIES),
+            "is_active": True,
+            "created_at": now,
+        })
+        products = _product_rows(rng, store_id, products_per_store)
+        products_by_store[store_id] = products
+        product_rows += products
+
+        for _ in range(sales_per_store):
+            sale_id = str(uuid.uuid4())
+            total = 0.0
+            for product in rng.sample(products, min(items_per_sale, len(products))):
+                quantity = rng.randint(1, 4)
+                total += product["price"] * quantity
+                item_rows.append({
+                    "id": str(uuid.uuid4()),
+                    "sale_id": sale_id,
+                    "product_id": product["id"],
+                    "quantity": quantity,
+                    "unit_price": product["price"],
+                    "total_price": product["price"] * quantity,
+                })
+            sale_rows.append({
+                "id": sale_id,
+                "store_id": store_id,
+                "total_amount": round(total, 2),
+                "payment_method": rng.choice(["cash", "card", "mercadopago", "transfer"]),
+                "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            })
+
+    store_ids = [row["id"] for row in store_rows]
+    for _ in range(events):
+        source = rng.choice(store_ids)
+        product = rng.choice(products_by_store[source])
+        event_rows.append({
+            "id": str(uuid.uuid4()),
+            "event_type": rng.choice(EVENT_TYPES),
+            "source_store_id": source,
+            "product_id": product["id"],
+            "data": {"new_price": round(product["price"] * rng.uniform(0.8, 1.2), 2)},
+            "created_at": now,
+            "processed": False,
+        })
+
+    for model, rows in ((Store, store_rows), (Product, product_rows), (Sale, sale_rows),
+                        (SaleItem, item_rows), (NetworkEvent, event_rows)):
+        if rows:
+            session.execute(insert(model), rows)
+    session.commit()
+
+    return {
+        "stores": len(store_rows),
+        "products": len(product_rows),
+        "sales": len(sale_rows),
+        "sale_items": len(item_rows),
+        "network_events": len(event_rows),
+    }
+
+
+def reset_database(database_url: str):
+    """Crea las tablas desde cero en la base indicada"""
+    from app.core.database import Base
+    import app.models.models  # noqa: F401  (registra los modelos en Base)
+
+    engine = create_engine(database_url)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--products", type=int, default=200, help="productos por comercio")
+    parser.add_argument("--sales", type=int, default=200, help="ventas por comercio")
+    parser.add_argument("--events", type=int, default=500)
+    args = parser.parse_args()
+
+    engine = reset_database(args.database_url)
+    with Session(engine) as session:
+        counts = seed(session, args.stores, args.products, args.sales, events=args.events)
+    print(", ".join(f"{table}: {count}" for table, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
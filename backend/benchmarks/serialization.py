@@ -0,0 +1,97 @@
+"""
+CPU por request al serializar un listado grande de ventas: camino anterior
+(response_model + jsonable_encoder + json) contra el actual (filas compactas
+directo a orjson), y costo/tamaño de gzip y brotli sobre el mismo payload.
+
+    cd backend
+    python -m benchmarks.serialization --sales 5000
+"""
+import argparse
+import asyncio
+import gzip
+import time
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+from app.main import app
+from app.core.auth import get_current_user
+from app.core.compression import brotli
+from app.routers.sales import Sale, sales_storage, _to_row
+from benchmarks.hotpath_sales import build_sales
+
+BENCH_STORE_ID = "bench_store"
+
+
+def legacy_app(models: List[Sale]) -> FastAPI:
+    """El endpoint tal como era: devuelve modelos y FastAPI los valida y codifica"""
+    legacy = FastAPI(default_response_class=JSONResponse)
+
+    @legacy.get("/api/sales/", response_model=List[Sale])
+    async def get_sales():
+        return models
+
+    return legacy
+
+
+async def cpu_per_request(target, path: str, headers: dict, repeat: int):
+    transport = httpx.ASGITransport(app=target)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        response = await client.get(path, headers=headers)
+        response.raise_for_status()
+        started = time.process_time()
+        for _ in range(repeat):
+            await client.get(path, headers=headers)
+        return (time.process_time() - started) / repeat, response
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+async def run(args):
+    models = build_sales(args.sales, args.items)
+    for sale in models:
+        sale.store_id = BENCH_STORE_ID
+        sales_storage.append(_to_row(sale))
+    # Se mide la serialización, no la auth (ver benchmarks.auth_overhead)
+    app.dependency_overrides[get_current_user] = lambda: {"store_id": BENCH_STORE_ID}
+
+    identity = {"accept-encoding": "identity"}
+    old_cpu, _ = await cpu_per_request(legacy_app(models), "/api/sales/", identity, args.repeat)
+    new_cpu, plain = await cpu_per_request(app, "/api/sales/", identity, args.repeat)
+    gz_cpu, compressed = await cpu_per_request(app, "/api/sales/", {"accept-encoding": "gzip"}, args.repeat)
+
+    raw = plain.content
+    print(f"payload: {args.sales} ventas, {len(raw) / 1024:.0f} KB sin comprimir")
+    print(f"response_model + json   {old_cpu * 1000:7.1f} ms CPU/request")
+    print(f"filas + orjson          {new_cpu * 1000:7.1f} ms CPU/request  ({old_cpu / new_cpu:.1f}x)")
+    print(f"filas + orjson + gzip   {gz_cpu * 1000:7.1f} ms CPU/request  {int(compressed.headers['content-length']) / 1024:.0f} KB {compressed.headers.get('content-encoding')}")
+
+    t_gzip = best_of(lambda: gzip.compress(raw, compresslevel=6), args.repeat)
+    print(f"gzip nivel 6            {t_gzip * 1000:7.1f} ms  {len(gzip.compress(raw, compresslevel=6)) / 1024:.0f} KB")
+    if brotli is not None:
+        t_br = best_of(lambda: brotli.compress(raw, quality=4), args.repeat)
+        print(f"brotli calidad 4        {t_br * 1000:7.1f} ms  {len(brotli.compress(raw, quality=4)) / 1024:.0f} KB")
+    else:
+        print("brotli no instalado")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sales", type=int, default=5000)
+    parser.add_argument("--items", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
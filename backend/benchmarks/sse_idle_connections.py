@@ -0,0 +1,174 @@
+"""
+Prueba de carga del stream SSE de insights: abre N conexiones ociosas contra un
+worker de uvicorn y mide la memoria del proceso antes, durante y después de
+pasar varios heartbeats. Cada conexión se autentica con el token de un
+usuario de su comercio (?access_token=, como hace EventSource).
+
+    cd backend
+    python -m benchmarks.sse_idle_connections --connections 10000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import List
+
+
+def rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            await reader.readline()
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("el servidor no arrancó a tiempo")
+
+
+def create_tokens(database_url: str, stores: int) -> List[str]:
+    """Crea `stores` comercios con un usuario cada uno y devuelve un token por comercio"""
+    from sqlalchemy import insert
+
+    from app.core.auth import create_access_token
+    from app.models.models import Store, User
+    from benchmarks.seed import reset_database
+
+    engine = reset_database(database_url)
+    users = [
+        {"id": f"user_{i}", "store_id": f"store_{i}", "email": f"caja{i}@bench.local", "name": "Caja",
+         "hashed_password": "!", "role": "employee", "is_active": True}
+        for i in range(stores)
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(Store.__table__), [
+            {"id": f"store_{i}", "name": f"Bench {i}", "owner_name": "Bench", "phone": "0"} for i in range(stores)
+        ])
+        conn.execute(insert(User.__table__), users)
+    engine.dispose()
+    return [create_access_token(User(**user)) for user in users]
+
+
+async def open_stream(port: int, token: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET /api/insights/stream?access_token={token} HTTP/1.1\r\n"
+        f"Host: localhost\r\nAccept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status = await reader.readline()
+    if b" 200 " not in status:
+        raise RuntimeError(f"respuesta inesperada: {status!r}")
+    # Headers + primer evento (retry)
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    return reader, writer
+
+
+async def drain(reader: asyncio.StreamReader, counter: list):
+    """Consume heartbeats para que el servidor no acumule buffers de escritura"""
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        if line.startswith(b": ping"):
+            counter[0] += 1
+
+
+async def run(args):
+    tokens = create_tokens(args.database_url, args.stores)
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--log-level", "warning", "--no-access-log", "--backlog", "4096"],
+        env=env,
+    )
+    try:
+        await wait_ready(port)
+        baseline = rss_kb(server.pid)
+
+        streams = []
+        started = time.perf_counter()
+        for offset in range(0, args.connections, args.batch):
+            size = min(args.batch, args.connections - offset)
+            streams += await asyncio.gather(*(
+                open_stream(port, tokens[(offset + i) % args.stores]) for i in range(size)
+            ))
+        connect_time = time.perf_counter() - started
+        connected = rss_kb(server.pid)
+
+        pings = [0]
+        drainers = [asyncio.create_task(drain(reader, pings)) for reader, _ in streams]
+        samples = []
+        for _ in range(args.samples):
+            await asyncio.sleep(args.hold / args.samples)
+            samples.append(rss_kb(server.pid))
+
+        for _, writer in streams:
+            writer.close()
+        for task in drainers:
+            task.cancel()
+        await asyncio.sleep(2)
+        closed = rss_kb(server.pid)
+
+        per_conn = (connected - baseline) / args.connections
+        growth = samples[-1] - connected
+        print(f"conexiones:          {args.connections} en {connect_time:.1f}s")
+        print(f"RSS base:            {baseline / 1024:.1f} MB")
+        print(f"RSS conectado:       {connected / 1024:.1f} MB ({per_conn:.1f} KB por conexión)")
+        print(f"RSS tras {args.hold}s:      {samples[-1] / 1024:.1f} MB (crecimiento {growth / 1024:+.1f} MB)")
+        print(f"RSS tras cerrar:     {closed / 1024:.1f} MB")
+        print(f"heartbeats recibidos: {pings[0]}")
+
+        if per_conn > args.max_kb_per_conn:
+            print(f"FALLO: más de {args.max_kb_per_conn} KB por conexión")
+            return 1
+        return 0
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--stores", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--hold", type=int, default=40, help="segundos con las conexiones abiertas")
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--max-kb-per-conn", type=float, default=64)
+    parser.add_argument("--database-url", default="sqlite:////tmp/nordia_bench.db")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    if hard < args.connections + 100:
+        print(f"Aviso: el límite de archivos abiertos ({hard}) es menor que las conexiones pedidas")
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
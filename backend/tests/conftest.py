@@ -0,0 +1,73 @@
+"""
+Fixtures compartidos: base SQLite descartable (se recrea en cada test) y
+comercios de prueba. Se corre desde backend/:
+
+    pytest
+"""
+import os
+import tempfile
+
+# Antes de importar la app: base temporal y sin Redis (pubsub solo en proceso)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="nordia-tests-"), "test.db")
+os.environ.pop("REDIS_URL", None)
+
+import pytest
+
+from app.core.database import Base, SessionLocal, engine
+from app.core.auth import create_access_token, token_cache
+from app.models.models import Product, Store, User
+
+
+@pytest.fixture(autouse=True)
+def database():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    token_cache.invalidate_all()
+    yield
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def make_store(db, name: str = "Almacén Test", phone: str = "+54 9 11 5555-0000") -> Store:
+    store = Store(name=name, owner_name="Test", phone=phone)
+    db.add(store)
+    db.commit()
+    return store
+
+
+@pytest.fixture
+def store(db):
+    return make_store(db)
+
+
+def make_user(db, store: Store, role: str = "owner") -> User:
+    # El hash no se verifica en estos tests: evita pagar bcrypt en cada uno
+    user = User(store_id=store.id, email=f"{role}-{store.id}@test.local", name="Caja", hashed_password="!", role=role)
+    db.add(user)
+    db.commit()
+    return user
+
+
+def make_product(db, store: Store, name: str = "Yerba Mate 1kg", stock: int = 10, price: float = 100.0,
+                 commit: bool = True, **values) -> Product:
+    product = Product(store_id=store.id, name=name, price=price, stock=stock, **values)
+    db.add(product)
+    if commit:
+        db.commit()
+    return product
+
+
+def auth_headers(user: User) -> dict:
+    return {"Authorization": f"Bearer {create_access_token(user)}"}
+
+
+@pytest.fixture
+def user(db, store):
+    return make_user(db, store)
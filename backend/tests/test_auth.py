@@ -0,0 +1,85 @@
+import asyncio
+import fnmatch
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app.core import auth
+from app.core.auth import TokenCache, key_ring, load_revocations
+from app.core.pubsub import pubsub
+from app.main import app
+
+from conftest import auth_headers, make_store, make_user
+
+client = TestClient(app)
+
+
+class FakeRedis:
+    """Lo mínimo de redis.asyncio que usan las revocaciones (y el xadd del pubsub)"""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    async def set(self, key, value, ex=None):
+        self.values[key.encode()] = str(value).encode()
+        self.ttls[key] = ex
+
+    async def scan_iter(self, match, count=None):
+        for key in list(self.values):
+            if fnmatch.fnmatch(key.decode(), match):
+                yield key
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+    async def xadd(self, *args, **kwargs):
+        raise ConnectionError("sin streams en el fake")
+
+
+def test_token_without_jti_is_rejected(user):
+    now = datetime.utcnow()
+    token = key_ring.sign({"sub": user.id, "iat": now, "exp": now + timedelta(minutes=5)})
+    response = client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+
+
+def test_store_scoped_endpoints_require_a_token(user):
+    for method, path in (("get", "/api/sales/"), ("get", "/api/sales/analytics/today"),
+                         ("get", "/api/sync/version"), ("get", "/api/sync/changes"),
+                         ("get", "/api/pos/payments/x")):
+        assert client.request(method, path).status_code == 401, path
+    assert client.get("/api/sync/version", headers=auth_headers(user)).status_code == 200
+
+
+def test_sales_are_scoped_to_the_user_store(db, store, user):
+    other = make_user(db, make_store(db, name="Otro", phone="+54 9 11 4444-0000"))
+    sale = {"items": [{"product_id": "p1", "product_name": "Yerba", "quantity": 1, "unit_price": 100.0,
+                       "total_price": 100.0}], "total": 100.0, "payment_method": "cash", "store_id": "ajeno"}
+
+    created = client.post("/api/sales/", json=sale, headers=auth_headers(user))
+    assert created.status_code == 200
+    sale_id = created.json()["id"]
+
+    mine = client.get(f"/api/sales/{sale_id}", headers=auth_headers(user)).json()
+    assert mine["store_id"] == store.id
+    assert client.get(f"/api/sales/{sale_id}", headers=auth_headers(other)).status_code == 404
+    assert sale_id not in {s["id"] for s in client.get("/api/sales/", headers=auth_headers(other)).json()}
+    today = client.get("/api/sales/analytics/today", headers=auth_headers(other)).json()
+    assert (today["total_revenue"], today["total_transactions"]) == (0, 0)
+
+
+def test_revocations_survive_a_restart(monkeypatch, user):
+    fake = FakeRedis()
+    monkeypatch.setattr(pubsub, "_redis", fake)
+    headers = auth_headers(user)
+    assert client.post("/api/auth/logout", headers=headers).status_code == 200
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
+    assert all(0 < ttl <= 31 * 60 for ttl in fake.ttls.values())
+
+    # Worker nuevo: cache vacío, las revocaciones se recuperan de Redis
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    assert client.get("/api/auth/me", headers=headers).status_code == 200
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    assert asyncio.run(load_revocations()) == 1
+    assert client.get("/api/auth/me", headers=headers).status_code == 401
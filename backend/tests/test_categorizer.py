@@ -0,0 +1,40 @@
+import asyncio
+
+from app.neural import engine as engine_module
+from app.neural.categorizer import TAXONOMY, ProductCategorizer
+from app.neural.engine import NeuralEngine
+
+
+def test_keywords_match_whole_words_only():
+    categorizer = ProductCategorizer()
+    names = ["Pañales Pampers", "Panchos Paty", "Salchichas Vienissima", "Pan Lactal", "Panes Árabes",
+             "Sal Fina", "Galletitas de Agua", "Yogures Bebibles"]
+    assert categorizer.categorize_many(names) == [
+        "otros", "otros", "otros", "panaderia", "panaderia", "almacen", "panaderia", "lacteos"
+    ]
+
+
+def test_model_only_learns_the_taxonomy():
+    names = [f"Producto {i}" for i in range(60)] + [f"Articulo {i}" for i in range(60)]
+    categories = ["Almacén"] * 30 + ["Ofertas de la semana"] * 30 + ["Limpieza"] * 30 + ["Mis favoritos"] * 30
+    categorizer = ProductCategorizer()
+
+    assert categorizer.fit(names, categories) == 60
+    assert set(categorizer.model.labels) <= set(TAXONOMY)
+    assert categorizer.fit(names, ["Ofertas"] * len(names)) == 0
+
+
+def test_training_without_data_backs_off(monkeypatch):
+    calls = []
+    monkeypatch.setattr(engine_module.categorizer, "fit_from_db", lambda db: calls.append(db) or 0)
+    neural = NeuralEngine()
+
+    assert asyncio.run(neural.train_categorizer()) == 0
+    assert asyncio.run(neural.train_categorizer()) == 0
+    assert len(calls) == 1
+
+    monkeypatch.setattr(neural, "_categorizer_next_train", 0.0)
+    asyncio.run(neural.train_categorizer())
+    assert len(calls) == 2
+    # Cada fallo duplica la espera
+    assert neural._categorizer_failures == 2
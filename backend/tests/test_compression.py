@@ -0,0 +1,37 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from app.core.compression import CompressionMiddleware, brotli
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/big")
+async def big():
+    return PlainTextResponse("nordia " * 500)
+
+
+client = TestClient(app)
+
+
+def _encoding(accept: str):
+    return client.get("/big", headers={"Accept-Encoding": accept}).headers.get("content-encoding")
+
+
+def test_gzip_when_accepted():
+    assert _encoding("gzip") == "gzip"
+    assert _encoding("gzip;q=0.5") == "gzip"
+
+
+def test_zero_quality_is_a_refusal():
+    assert _encoding("gzip;q=0") is None
+    assert _encoding("gzip; q=0.0, identity") is None
+
+
+@pytest.mark.skipif(brotli is None, reason="Brotli no instalado")
+def test_refused_brotli_falls_back_to_gzip():
+    assert _encoding("br;q=0, gzip") == "gzip"
+    assert _encoding("br, gzip") == "br"
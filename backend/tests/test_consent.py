@@ -0,0 +1,53 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.core.consent import ConsentCache, consent_cache, mask_columns
+from app.main import app
+
+from conftest import auth_headers, make_store, make_user
+
+client = TestClient(app)
+
+
+def test_consent_endpoints_require_the_own_store(db, store, user):
+    other = make_store(db, name="Kiosco Vecino", phone="+54 9 11 5555-9999")
+    intruder = make_user(db, other)
+
+    assert client.post("/api/consent/", json={"store_id": store.id}).status_code == 401
+    assert client.post("/api/consent/", json={"store_id": store.id},
+                       headers=auth_headers(intruder)).status_code == 403
+
+    created = client.post("/api/consent/", json={"store_id": store.id, "price_ranges": True},
+                          headers=auth_headers(user))
+    assert created.status_code == 201 and created.json()["price_ranges"] is True
+
+    for method in ("get", "patch", "delete"):
+        kwargs = {"json": {"price_ranges": False}} if method == "patch" else {}
+        response = client.request(method, f"/api/consent/{store.id}", headers=auth_headers(intruder), **kwargs)
+        assert response.status_code == 403, method
+    assert consent_cache.flags(store.id)["price_ranges"] is True
+
+    assert client.patch(f"/api/consent/{store.id}", json={"price_ranges": False},
+                        headers=auth_headers(user)).json()["price_ranges"] is False
+    assert client.delete(f"/api/consent/{store.id}", headers=auth_headers(user)).status_code == 200
+    assert not any(consent_cache.flags(store.id).values())
+
+
+def test_mask_columns_uses_each_store_bits():
+    cache = ConsentCache()
+    cache._loaded = True
+    cache.set("a", {"sales_volume": True, "price_ranges": True})
+    cache.set("b", {"sales_volume": True, "price_ranges": False})
+    cache.set("c", {"sales_volume": True, "price_ranges": True})
+    cache.set("c", None)
+
+    bits = cache.bits_for(["a", "b", "c", "desconocido", "a"])
+    masked = mask_columns(
+        {"price_range": np.array(["alto", "bajo", "medio", "premium", "medio"], dtype=object)},
+        bits, {"price_range": "price_ranges"}, {"price_range": None}
+    )
+    assert list(masked["price_range"]) == ["alto", None, None, None, "medio"]
+
+    # Índice y bitmap se reemplazan juntos: el centinela sigue al final y en 0
+    index, state_bits = cache._state
+    assert len(state_bits) == len(index) + 1 and state_bits[-1] == 0
@@ -0,0 +1,37 @@
+import asyncio
+import threading
+
+from app.core.health import HealthMonitor, database_probe
+
+
+class HangingEngine:
+    """Engine cuyo connect() queda colgado hasta que el test lo libera"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        self.release.wait(5)
+        raise RuntimeError("sin conexión")
+
+
+def test_timed_out_database_ping_is_not_stacked():
+    engine = HangingEngine()
+    monitor = HealthMonitor(timeout=0.05)
+    monitor.add_probe("database", database_probe(engine))
+
+    async def scenario():
+        first = await monitor._run_probe("database")
+        second = await monitor._run_probe("database")
+        return first, second
+
+    try:
+        first, second = asyncio.run(scenario())
+    finally:
+        engine.release.set()
+
+    assert first["ok"] is False and "timeout" in first["error"]
+    assert second == {"ok": False, "error": "el ping anterior a la base sigue en curso"}
+    assert engine.connects == 1
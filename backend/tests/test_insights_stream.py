@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+
+from app.core.pubsub import PubSub, pubsub
+from app.main import app
+from app.routers import insights
+
+
+def test_gap_when_history_does_not_cover_last_id():
+    bus = PubSub(history=3)
+    start = bus._started[0]
+    # Id de antes de que arrancara el proceso: lo publicado en el medio no está en memoria
+    _, replay, gap = bus.subscribe("insights", "s1", f"{start - 1000}-0")
+    assert replay == [] and gap
+    _, replay, gap = bus.subscribe("insights", "s1", f"{start}-0")
+    assert replay == [] and not gap
+
+    for i in range(5):
+        bus._deliver("insights", "s1", f"{start + 100 + i}-0", {"n": i})
+    # Los dos primeros salieron del historial
+    _, replay, gap = bus.subscribe("insights", "s1", f"{start + 100}-0")
+    assert gap and [data["n"] for _, data in replay] == [2, 3, 4]
+    _, replay, gap = bus.subscribe("insights", "s1", f"{start + 101}-0")
+    assert not gap and [data["n"] for _, data in replay] == [2, 3, 4]
+    _, _, gap = bus.subscribe("insights", "otro", f"{start + 1}-0")
+    assert not gap
+
+
+class FakeStreams:
+    """XRANGE sobre un stream en memoria, con ids '<ms>-<seq>' y min exclusivo '(id'"""
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    async def xrange(self, name, min="-", max="+", count=None):
+        rows = self.entries
+        if min.startswith("("):
+            bound = tuple(int(part) for part in min[1:].split("-"))
+            rows = [row for row in rows if tuple(int(p) for p in row[0].decode().split("-")) > bound]
+        return rows[:count] if count else rows
+
+
+def test_resume_reads_the_redis_stream_after_a_restart():
+    bus = PubSub(history=50)
+    entries = [(f"{1000 + i}-0".encode(), {b"key": (b"s1" if i % 2 else b"s2"), b"data": json.dumps({"n": i}).encode()})
+               for i in range(600)]
+    bus._redis = FakeStreams(entries)
+
+    async def scenario():
+        sub, replay, gap = await bus.resume("insights", "s1", "1590-0")
+        # Llega en vivo algo que ya salió en el replay y algo nuevo
+        bus._deliver("insights", "s1", "1599-0", {"n": 599})
+        bus._deliver("insights", "s1", "1600-0", {"n": 600})
+        return replay, gap, [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+
+    replay, gap, live = asyncio.run(scenario())
+    assert not gap and [data["n"] for _, data in replay] == [591, 593, 595, 597, 599]
+    assert live == [("1600-0", {"n": 600})]
+
+    # Más de lo que entra en el historial: se mandan los últimos y se pide resync
+    _, replay, gap = asyncio.run(bus.resume("insights", "s1", "1000-0"))
+    assert gap and len(replay) == 50 and replay[-1][1] == {"n": 599}
+    # El stream ya recortó lo posterior a last_id
+    _, _, gap = asyncio.run(bus.resume("insights", "s1", "900-0"))
+    assert gap
+
+
+def test_stream_requires_token():
+    with TestClient(app) as client:
+        assert client.get("/api/insights/stream").status_code == 401
+        assert client.get("/api/insights/stream", params={"access_token": "basura"}).status_code == 401
+
+
+def test_stream_only_delivers_own_store():
+    """El comercio sale del usuario autenticado, no de la query"""
+    pubsub.publish("insights", "competencia", {"title": "ajeno", "source_phone": "+54 9 11 4444-0000"})
+    pubsub.publish("insights", "mio", {"title": "propio"})
+
+    async def read_replay():
+        response = await insights.stream_insights(last_event_id="0-0", current_user={"store_id": "mio"})
+        chunks = []
+        try:
+            async for chunk in response.body_iterator:
+                chunks.append(chunk)
+                if len(chunks) == 3:
+                    break
+        finally:
+            await response.body_iterator.aclose()
+        return "".join(chunks)
+
+    body = asyncio.run(read_replay())
+    # "0-0" es de antes de arrancar: resync y después el replay del propio comercio
+    assert "event: resync" in body
+    assert "propio" in body and "ajeno" not in body
@@ -0,0 +1,149 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.core.database import engine
+from app.core import inventory
+from app.core.inventory import StockWriter, apply_sale, stock_writer
+from app.core.pubsub import pubsub
+from app.main import app
+from app.models.models import InventoryMovement, NetworkEvent, Product
+
+from conftest import auth_headers, make_product, make_store
+
+
+def _stock(db, product: Product) -> int:
+    db.expire_all()
+    return db.get(Product, product.id).stock
+
+
+def test_sale_decrements_stock_and_writes_the_ledger(db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 10)
+    azucar = make_product(db, store, "Azúcar 1kg", 5)
+
+    changes = apply_sale(store.id, "venta-1", [(yerba.id, 2), (azucar.id, 1), (yerba.id, 1)])
+
+    assert {c.product_id: (c.stock_before, c.stock_after) for c in changes} == {yerba.id: (10, 7), azucar.id: (5, 4)}
+    assert (_stock(db, yerba), _stock(db, azucar)) == (7, 4)
+    ledger = {m.product_id: (m.quantity, m.stock_after, m.shortfall) for m in db.query(InventoryMovement)}
+    assert ledger == {yerba.id: (-3, 7, 0), azucar.id: (-1, 4, 0)}
+
+
+def test_overselling_stops_at_zero_and_records_the_shortfall(db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 3)
+    agotado = make_product(db, store, "Fideos 500g", 0)
+
+    changes = {c.product_id: c for c in apply_sale(store.id, "venta-1", [(yerba.id, 5), (agotado.id, 2)])}
+
+    assert _stock(db, yerba) == 0 and _stock(db, agotado) == 0
+    assert (changes[yerba.id].quantity, changes[yerba.id].shortfall, changes[yerba.id].ran_out) == (-3, 2, True)
+    assert (changes[agotado.id].quantity, changes[agotado.id].shortfall, changes[agotado.id].ran_out) == (0, 2, False)
+    ledger = {m.product_id: (m.quantity, m.stock_after, m.shortfall) for m in db.query(InventoryMovement)}
+    assert ledger == {yerba.id: (-3, 0, 2), agotado.id: (0, 0, 2)}
+    assert [e.product_id for e in db.query(NetworkEvent).filter(NetworkEvent.event_type == "stock_out")] == [yerba.id]
+
+
+def test_batch_replays_the_sales_in_order(db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 3)
+    writer = StockWriter()
+    for sale_id, quantity in (("venta-1", 2), ("venta-2", 2), ("venta-3", 1)):
+        writer.submit(store.id, sale_id, [(yerba.id, quantity)])
+
+    assert asyncio.run(writer.process(_queued(writer))) == 3
+    assert _stock(db, yerba) == 0
+    ledger = {m.sale_id: (m.quantity, m.stock_after, m.shortfall) for m in db.query(InventoryMovement)}
+    assert ledger == {"venta-1": (-2, 1, 0), "venta-2": (-1, 0, 1), "venta-3": (0, 0, 1)}
+    assert db.query(NetworkEvent).filter(NetworkEvent.event_type == "stock_out").count() == 1
+
+
+def test_unknown_products_skip_the_write(db, store):
+    store_id = store.id
+    other = make_store(db, name="Otro", phone="+54 9 11 4444-0000")
+    ajeno = make_product(db, other, "Yerba Mate 1kg", 10)
+    items = [("no-existe", 1), (ajeno.id, 1)]
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split(None, 1)[0].upper())
+
+    event.listen(engine, "before_cursor_execute", _record)
+    try:
+        assert apply_sale(store_id, "venta-1", items) == []
+    finally:
+        event.remove(engine, "before_cursor_execute", _record)
+
+    assert statements == ["SELECT"]
+    assert _stock(db, ajeno) == 10
+
+
+def _queued(writer: StockWriter) -> list:
+    return [writer.queue.get_nowait() for _ in range(writer.queue.qsize())]
+
+
+def test_sale_endpoint_queues_the_authenticated_store(db, store, user):
+    other = make_store(db, name="Otro", phone="+54 9 11 4444-0000")
+    mine = make_product(db, store, "Yerba Mate 1kg", 10)
+    theirs = make_product(db, other, "Yerba Mate 1kg", 10)
+    items = [{"product_id": product.id, "product_name": product.name, "quantity": 1,
+              "unit_price": 100.0, "total_price": 100.0} for product in (mine, theirs)]
+    _queued(stock_writer)
+
+    response = TestClient(app).post(
+        "/api/sales/", headers=auth_headers(user),
+        json={"store_id": other.id, "items": items, "total": 200.0, "payment_method": "cash"}
+    )
+    assert response.status_code == 200
+    queued = _queued(stock_writer)
+    assert [(store_id, sale_id) for store_id, sale_id, _ in queued] == [(store.id, response.json()["id"])]
+
+    assert asyncio.run(stock_writer.process(queued)) == 1
+    assert (_stock(db, mine), _stock(db, theirs)) == (9, 10)
+
+
+def test_writer_applies_the_batch_and_publishes_alerts(db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 3, min_stock=2)
+    azucar = make_product(db, store, "Azúcar 1kg", 10, min_stock=2)
+    writer = StockWriter()
+    for sale_id, items in (("venta-1", [(yerba.id, 2)]), ("venta-2", [("a-mano", 1)]),
+                           ("venta-3", [(yerba.id, 1), (azucar.id, 4)])):
+        assert writer.submit(store.id, sale_id, items)
+
+    assert asyncio.run(writer.process(_queued(writer))) == 2
+    assert (_stock(db, yerba), _stock(db, azucar)) == (0, 6)
+    assert {m.sale_id for m in db.query(InventoryMovement)} == {"venta-1", "venta-3"}
+
+    sub, replay, _ = pubsub.subscribe("insights", store.id, "0-0")
+    pubsub.unsubscribe(sub)
+    alerts = [data for _, data in replay if data["type"] == "stock_alert"]
+    assert [a["data"]["sale_id"] for a in alerts] == ["venta-1", "venta-3"]
+    assert alerts[1]["priority"] == "high"
+
+
+def test_failing_sale_does_not_drop_the_batch(monkeypatch, db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 10)
+    writer = StockWriter()
+    writer.submit(store.id, "venta-1", [(yerba.id, 1)])
+    writer.submit(store.id, "venta-2", [(yerba.id, 2)])
+
+    original = inventory.apply_batch_movements
+
+    def flaky(db, store_id, movements, reason):
+        if any(sale_id == "venta-2" for sale_id, _ in movements):
+            raise ValueError("fila bloqueada")
+        return original(db, store_id, movements, reason)
+
+    monkeypatch.setattr(inventory, "apply_batch_movements", flaky)
+    assert asyncio.run(writer.process(_queued(writer))) == 1
+    assert _stock(db, yerba) == 9
+
+
+def test_stop_applies_everything_still_queued(db, store):
+    yerba = make_product(db, store, "Yerba Mate 1kg", 1000)
+    writer = StockWriter(batch_size=200)
+    for i in range(500):
+        assert writer.submit(store.id, f"venta-{i}", [(yerba.id, 1)])
+
+    asyncio.run(writer.stop())
+    assert writer.queue.empty()
+    assert _stock(db, yerba) == 500
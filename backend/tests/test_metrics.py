@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.core.database import engine
+from app.core.metrics import REGISTRY
+
+
+def test_failed_queries_do_not_leak_timing_entries():
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM tabla_inexistente"))
+        assert conn.info.get("query_start") == []
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert conn.info["query_start"] == []
+    assert 'nordia_db_query_errors_total{operation="SELECT"}' in REGISTRY.render()
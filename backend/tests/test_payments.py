@@ -0,0 +1,225 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.database import SessionLocal
+from app.integrations.mercadopago import CircuitOpenError, MercadoPagoService, PaymentProviderError
+from app.integrations.payments import PaymentReconciler, charge_sale
+from app.main import app
+from app.models.compact import SaleRow, SalesLedger
+from app.models.models import Payment
+from app.routers import pos
+from app.routers.sales import sales_storage
+
+from conftest import auth_headers, make_store, make_user
+
+
+class FakeMercadoPago:
+    """Proveedor falso sobre httpx.MockTransport: guarda pagos por clave de idempotencia"""
+
+    def __init__(self, status: str = "approved"):
+        self.status = status
+        self.fail_with = None
+        self.payments = {}
+        self.by_key = {}
+        self.calls = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if self.fail_with is not None:
+            failure, self.fail_with = self.fail_with, None
+            return failure(request)
+        if request.method == "POST":
+            key = request.headers["X-Idempotency-Key"]
+            if key not in self.by_key:
+                payment = {"id": len(self.payments) + 1000, "status": self.status,
+                           "external_reference": json.loads(request.content)["external_reference"]}
+                self.payments[str(payment["id"])] = payment
+                self.by_key[key] = payment
+            return httpx.Response(201, json=self.by_key[key])
+        payment = self.payments[request.url.path.rsplit("/", 1)[-1]]
+        return httpx.Response(200, json=payment)
+
+    def service(self) -> MercadoPagoService:
+        return MercadoPagoService(token="test", base_url="https://mp.test", transport=httpx.MockTransport(self.handler))
+
+
+def _timeout(request):
+    raise httpx.ReadTimeout("lento", request=request)
+
+
+def _sale(store_id: str, total: float = 1500.0) -> SaleRow:
+    return SaleRow(id=f"venta-{datetime.now().timestamp()}", store_id=store_id, items=(), total=total,
+                   payment_method="mercadopago", timestamp=datetime.now())
+
+
+def test_breaker_opens_and_half_open_trial_is_released_on_any_error():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    service = MercadoPagoService(token="test", base_url="https://mp.test", transport=httpx.MockTransport(handler))
+    service.breaker.failure_threshold = 2
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(PaymentProviderError):
+                await service.get_payment("1")
+        assert service.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await service.get_payment("1")
+
+        # Half-open: la llamada de prueba devuelve algo que no es JSON
+        service.breaker.reset_timeout = 0
+        service.transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"<html>"))
+        service._client = None
+        with pytest.raises(PaymentProviderError):
+            await service.get_payment("1")
+        assert not service.breaker._trial_in_flight
+
+        # Falla de httpx que no es timeout ni de transporte
+        def decoding_error(request):
+            raise httpx.DecodingError("gzip roto", request=request)
+
+        service.transport = httpx.MockTransport(decoding_error)
+        service._client = None
+        with pytest.raises(PaymentProviderError):
+            await service.get_payment("1")
+        assert not service.breaker._trial_in_flight
+
+        # Cancelación a mitad de la llamada de prueba
+        async def slow(request):
+            await asyncio.sleep(10)
+
+        service.transport = httpx.MockTransport(slow)
+        service._client = None
+        task = asyncio.create_task(service.get_payment("1"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not service.breaker._trial_in_flight
+
+        service.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"id": 1}))
+        service._client = None
+        assert await service.get_payment("1") == {"id": 1}
+        assert service.breaker.state == "closed"
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_charge_sale_is_idempotent_across_provider_timeouts(store):
+    provider = FakeMercadoPago()
+    service = provider.service()
+
+    async def scenario():
+        db = SessionLocal()
+        try:
+            provider.fail_with = _timeout
+            deferred = await charge_sale(db, service, "venta-1", 1500.0, "Venta", store_id=store.id)
+            assert deferred.status == "pending" and deferred.provider_payment_id is None
+
+            retried = await charge_sale(db, service, "venta-1", 1500.0, "Venta", store_id=store.id)
+            again = await charge_sale(db, service, "venta-1", 1500.0, "Venta", store_id=store.id)
+            with pytest.raises(ValueError):
+                await charge_sale(db, service, "venta-1", 999.0, "Venta", store_id=store.id)
+            return retried, again
+        finally:
+            db.close()
+
+    retried, again = asyncio.run(scenario())
+    assert retried.status == "approved"
+    assert again.provider_payment_id == retried.provider_payment_id
+    assert list(provider.by_key) == ["nordia-sale-venta-1"]
+    assert provider.calls == 2  # El timeout y un único cobro real
+
+
+def test_rejected_request_closes_the_payment(store):
+    provider = FakeMercadoPago()
+    service = provider.service()
+    reconciler = PaymentReconciler(service)
+
+    async def scenario():
+        db = SessionLocal()
+        try:
+            provider.fail_with = lambda request: httpx.Response(400, json={"message": "payer.email inválido"})
+            rejected = await charge_sale(db, service, "venta-1", 1500.0, "Venta", store_id=store.id)
+            again = await charge_sale(db, service, "venta-1", 1500.0, "Venta", store_id=store.id)
+        finally:
+            db.close()
+        await reconciler.sweep(older_than=timedelta(0))
+        return rejected, again
+
+    rejected, again = asyncio.run(scenario())
+    assert (rejected.status, rejected.provider_payment_id) == ("error", None)
+    assert "payer.email" in rejected.status_detail
+    assert again.status == "error"
+    assert provider.calls == 1  # Ni el reintento de la caja ni el barrido vuelven a cobrar
+    assert service.breaker.state == "closed"
+
+
+def test_reconciler_updates_payment_and_ledger_sale(store):
+    provider = FakeMercadoPago(status="in_process")
+    service = provider.service()
+    ledger = SalesLedger()
+    sale = _sale(store.id)
+    ledger.append(sale)
+    reconciler = PaymentReconciler(service, ledger=ledger)
+
+    async def scenario():
+        db = SessionLocal()
+        try:
+            payment = await charge_sale(db, service, sale.id, sale.total, "Venta", store_id=store.id)
+        finally:
+            db.close()
+        provider.payments[payment.provider_payment_id]["status"] = "approved"
+        return await reconciler.reconcile([payment.provider_payment_id, payment.provider_payment_id])
+
+    assert asyncio.run(scenario()) == 1
+    db = SessionLocal()
+    try:
+        assert db.query(Payment).filter(Payment.sale_id == sale.id).one().status == "approved"
+    finally:
+        db.close()
+    assert sale.payment_status == "approved"
+
+
+def test_pos_payment_charges_the_registered_sale_total(monkeypatch, db, store, user):
+    provider = FakeMercadoPago()
+    monkeypatch.setattr(pos, "mercadopago", provider.service())
+    sale = _sale(store.id, total=2500.0)
+    sales_storage.append(sale)
+    client = TestClient(app)
+    headers = auth_headers(user)
+
+    assert client.post("/api/pos/payments", json={"sale_id": sale.id}).status_code == 401
+    missing = client.post("/api/pos/payments", json={"sale_id": "no-existe"}, headers=headers)
+    assert missing.status_code == 404
+    other_store = make_user(db, make_store(db, name="Otro", phone="+54 9 11 4444-0000"))
+    assert client.post("/api/pos/payments", json={"sale_id": sale.id},
+                       headers=auth_headers(other_store)).status_code == 404
+
+    response = client.post("/api/pos/payments", json={"sale_id": sale.id, "amount": 1}, headers=headers)
+    assert response.status_code == 200 and response.json()["status"] == "approved"
+    charged = next(iter(provider.by_key.values()))
+    assert charged["external_reference"] == sale.id
+    db = SessionLocal()
+    try:
+        assert db.query(Payment).filter(Payment.sale_id == sale.id).one().amount == 2500.0
+    finally:
+        db.close()
+    assert sale.payment_status == "approved"
+
+
+def test_mercadopago_webhook_rejects_malformed_bodies():
+    client = TestClient(app)
+    assert client.post("/api/webhook/mercadopago", content=b"no es json").status_code == 400
+    assert client.post("/api/webhook/mercadopago", json=[{"type": "payment"}]).status_code == 400
+    assert client.post("/api/webhook/mercadopago", json={"type": "otro"}).json() == {"status": "ignored"}
@@ -0,0 +1,140 @@
+from sqlalchemy import insert
+
+from app.core.sync import SyncJournal, sync_journal
+from app.models.models import Insight, Product
+
+from conftest import make_product
+
+
+def test_changes_since_returns_only_new_rows(db, store):
+    first = make_product(db, store)
+    full = sync_journal.changes_since(store.id)
+    assert full["full_resync"] and full["version"] == 1
+    assert [p["id"] for p in full["changes"]["product"]] == [first.id]
+
+    second = make_product(db, store, "Azúcar 1kg", commit=False)
+    first.price = 120.0
+    db.commit()
+    delta = sync_journal.changes_since(store.id, since=1, epoch=full["epoch"])
+    assert not delta["full_resync"]
+    assert delta["version"] == 3
+    assert {p["id"]: p["price"] for p in delta["changes"]["product"]} == {first.id: 120.0, second.id: 100.0}
+
+    assert sync_journal.changes_since(store.id, since=3, epoch=full["epoch"])["changes"] == {}
+
+
+def test_delete_is_a_tombstone(db, store):
+    product = make_product(db, store)
+    epoch, version = sync_journal.current(store.id)
+
+    db.delete(product)
+    db.commit()
+    delta = sync_journal.changes_since(store.id, since=version, epoch=epoch)
+    assert delta["deleted"] == {"product": [product.id]}
+    assert delta["changes"] == {}
+    # El resync completo no manda tombstones: el borrado ya no está en la tabla
+    assert sync_journal.changes_since(store.id)["changes"]["product"] == []
+
+
+def test_rollback_does_not_advance_version(db, store):
+    make_product(db, store, commit=False)
+    db.flush()
+    db.rollback()
+    assert sync_journal.current(store.id) == (None, 0)
+
+
+def test_state_survives_restart_and_full_snapshot_reads_the_database(db, store):
+    """Un journal nuevo (otro worker o un reinicio) ve la misma versión y el mismo epoch"""
+    make_product(db, store, commit=False)
+    db.add(Insight(store_id=store.id, type="stock_prediction", title="Stock", message="Queda poco"))
+    db.commit()
+    # Fila cargada por fuera del journal (ej: importación masiva): igual sale en el snapshot
+    db.execute(insert(Product.__table__), [{"id": "imported", "store_id": store.id, "name": "Sal 500g", "price": 50.0}])
+    db.commit()
+
+    restarted = SyncJournal()
+    epoch, version = sync_journal.current(store.id)
+    assert restarted.current(store.id) == (epoch, version)
+    assert not restarted.changes_since(store.id, since=version, epoch=epoch)["full_resync"]
+
+    full = restarted.changes_since(store.id)
+    assert {p["id"] for p in full["changes"]["product"]} >= {"imported"}
+    assert len(full["changes"]["insight"]) == 1
+
+
+def test_stale_epoch_or_future_cursor_forces_full_resync(db, store):
+    make_product(db, store)
+    epoch, version = sync_journal.current(store.id)
+    assert sync_journal.changes_since(store.id, since=version, epoch="otro")["full_resync"]
+    assert sync_journal.changes_since(store.id, since=version + 5, epoch=epoch)["full_resync"]
+
+
+def test_limit_pages_through_changes(db, store):
+    make_product(db, store)
+    epoch, since = sync_journal.current(store.id)
+    for i in range(5):
+        make_product(db, store, f"Producto {i}", commit=False)
+    db.commit()
+
+    seen = []
+    while True:
+        page = sync_journal.changes_since(store.id, since=since, epoch=epoch, limit=2)
+        seen.extend(p["name"] for p in page["changes"].get("product", []))
+        since = page["version"]
+        if not page["has_more"]:
+            break
+    assert sorted(seen) == [f"Producto {i}" for i in range(5)] and since == 6
+
+
+def test_full_resync_pages_by_id_with_a_pinned_version(db, store):
+    products = [make_product(db, store, f"Producto {i}", commit=False) for i in range(5)]
+    db.add(Insight(store_id=store.id, type="stock_prediction", title="Stock", message="Queda poco"))
+    db.commit()
+    epoch, pinned = sync_journal.current(store.id)
+
+    first = sync_journal.changes_since(store.id, limit=2)
+    assert first["full_resync"] and first["has_more"] and first["version"] == pinned
+    seen = [p["id"] for p in first["changes"]["product"]]
+    # Cambios entre páginas: la versión no se mueve y llegan en el delta siguiente
+    make_product(db, store, "Nuevo")
+
+    cursor = first["cursor"]
+    entities = set()
+    while cursor:
+        page = sync_journal.changes_since(store.id, epoch=epoch, limit=2, cursor=cursor)
+        assert page["full_resync"] and page["version"] == pinned
+        assert sum(len(rows) for rows in page["changes"].values()) <= 2
+        seen.extend(p["id"] for p in page["changes"].get("product", []))
+        entities.update(entity for entity, rows in page["changes"].items() if rows)
+        cursor = page["cursor"]
+        assert page["has_more"] == (cursor is not None)
+    assert set(seen) >= {p.id for p in products} and len(seen) == len(set(seen))
+    assert "insight" in entities
+
+    delta = sync_journal.changes_since(store.id, since=pinned, epoch=epoch)
+    assert [p["name"] for p in delta["changes"]["product"]] == ["Nuevo"]
+
+
+def test_snapshot_cursor_from_another_epoch_starts_over(db, store):
+    for i in range(3):
+        make_product(db, store, f"Producto {i}", commit=False)
+    db.commit()
+    first = sync_journal.changes_since(store.id, limit=1)
+    restarted = sync_journal.changes_since(store.id, epoch="otro", limit=1, cursor=first["cursor"])
+    assert restarted["changes"] == first["changes"]
+    assert sync_journal.changes_since(store.id, epoch=first["epoch"], limit=1, cursor="basura")["changes"] == first["changes"]
+
+
+def test_compaction_raises_the_floor(db, store):
+    journal = SyncJournal(max_tombstones=4)
+    products = [make_product(db, store, f"Producto {i}", commit=False) for i in range(6)]
+    db.commit()
+    epoch, old_version = journal.current(store.id)
+
+    for product in products:
+        journal.record(db, store.id, "product", [product.id], deleted=True)
+    db.commit()
+    assert journal.changes_since(store.id, since=1, epoch=epoch)["full_resync"]
+    recent = journal.changes_since(store.id, since=old_version + 4, epoch=epoch)
+    assert not recent["full_resync"]
+    assert len(recent["deleted"]["product"]) == 2
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import hmac
+
+import orjson
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+from app import main
+from app.integrations.whatsapp_inbound import WhatsAppIngestor
+from app.models.models import Sale, SaleItem
+
+from conftest import make_product
+
+BUSINESS_PHONE = "5491155550000"  # El del comercio de conftest
+
+
+def _payload(message_id: str, *items) -> dict:
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"display_phone_number": BUSINESS_PHONE},
+        "contacts": [{"wa_id": "5491166660000", "profile": {"name": "Marta"}}],
+        "messages": [{
+            "id": message_id,
+            "from": "5491166660000",
+            "type": "order",
+            "order": {"product_items": [
+                {"product_retailer_id": product_id, "quantity": quantity, "item_price": price}
+                for product_id, quantity, price in items
+            ]},
+        }],
+    }}]}]}
+
+
+def _run(ingestor: WhatsAppIngestor, *payloads) -> int:
+    return asyncio.run(ingestor.process([(payload, 0) for payload in payloads]))
+
+
+def test_bad_payload_only_drops_itself(db, store):
+    product = make_product(db, store, price=1500.0)
+    bad = _payload("wamid.malo", (product.id, "dos", 1500))
+    created = _run(WhatsAppIngestor(), _payload("wamid.1", (product.id, 1, 1500)), bad,
+                   _payload("wamid.2", (product.id, 2, 1500)))
+    assert created == 2
+    assert {mid for (mid,) in db.query(Sale.whatsapp_message_id)} == {"wamid.1", "wamid.2"}
+
+
+def test_total_counts_only_the_kept_items(db, store):
+    product = make_product(db, store, price=1500.0)
+    _run(WhatsAppIngestor(), _payload("wamid.1", (product.id, 2, 1500), ("no-existe", 1, 999)))
+    sale = db.query(Sale).one()
+    assert sale.total_amount == 3000.0
+    assert db.query(SaleItem).count() == 1
+
+
+def test_duplicate_from_another_worker_is_skipped(monkeypatch, db, store):
+    product = make_product(db, store, price=1500.0)
+    assert _run(WhatsAppIngestor(), _payload("wamid.1", (product.id, 1, 1500))) == 1
+
+    # Otro worker con su propio LRU que no llega a ver la fila en el chequeo previo
+    racing = WhatsAppIngestor()
+    monkeypatch.setattr(racing, "_existing_message_ids", lambda db, ids: set())
+    created = _run(racing, _payload("wamid.1", (product.id, 1, 1500)), _payload("wamid.2", (product.id, 1, 1500)))
+    assert created == 1
+    assert db.query(Sale).count() == 2
+
+
+def test_database_failure_requeues_the_batch(monkeypatch, db, store):
+    product = make_product(db, store, price=1500.0)
+    ingestor = WhatsAppIngestor(retry_delay=0)
+    original = ingestor._insert_orders
+    calls = []
+
+    def flaky(session, resolved):
+        calls.append(len(resolved))
+        if len(calls) == 1:
+            raise OperationalError("INSERT", {}, Exception("base caída"))
+        return original(session, resolved)
+
+    monkeypatch.setattr(ingestor, "_insert_orders", flaky)
+
+    async def scenario():
+        first = await ingestor.process([(_payload("wamid.1", (product.id, 1, 1500)), 0)])
+        await asyncio.sleep(0.01)
+        requeued = [ingestor.queue.get_nowait() for _ in range(ingestor.queue.qsize())]
+        second = await ingestor.process(requeued)
+        return first, requeued, second
+
+    first, requeued, second = asyncio.run(scenario())
+    assert first == 0
+    assert [attempt for _, attempt in requeued] == [1]
+    assert second == 1
+    assert db.query(Sale).count() == 1
+
+
+def test_webhook_checks_the_signature_before_enqueueing(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(main, "whatsapp_app_secret", "secreto")
+    monkeypatch.setattr(main.whatsapp_ingestor, "submit", lambda data: submitted.append(data) or True)
+    client = TestClient(main.app)
+    body = orjson.dumps(_payload("wamid.1"))
+    signature = "sha256=" + hmac.new(b"secreto", body, hashlib.sha256).hexdigest()
+
+    assert client.post("/api/webhook/whatsapp", content=body).status_code == 401
+    assert client.post("/api/webhook/whatsapp", content=body,
+                       headers={"X-Hub-Signature-256": "sha256=" + "0" * 64}).status_code == 401
+    assert submitted == []
+
+    response = client.post("/api/webhook/whatsapp", content=body, headers={"X-Hub-Signature-256": signature})
+    assert response.json() == {"status": "received"}
+    assert submitted == [orjson.loads(body)]